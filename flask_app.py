@@ -1,34 +1,376 @@
 # -*- coding: utf-8 -*-
 import secrets
+import shutil
 import sqlite3
+import csv
+import gzip
+import io
 import click
 import os
-from flask import Flask, request, render_template_string, redirect, url_for, flash, g, session
+import time
+import hashlib
+import heapq
+import http.client
+import json
+import itertools
+import mimetypes
+import operator
+import platform
+import queue
+import random
+import re
+import subprocess
+import tarfile
+import tempfile
+import threading
+import urllib.parse
+import urllib.request
+from flask import Flask, Response, abort, make_response, request, render_template, render_template_string, get_template_attribute, redirect, send_from_directory, url_for, flash, g, session, stream_with_context
 from flask.cli import with_appcontext
+from jinja2 import BaseLoader, TemplateNotFound
+from werkzeug.security import safe_join
+from array import array
 from collections import defaultdict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime
-from functools import wraps
-from statistics import mean
+from functools import lru_cache, partial, wraps
+from statistics import mean, median
+
+try:
+    import numpy as np
+except ImportError:  # O motor vetorizado é opcional; sem NumPy usa-se o motor em Python puro.
+    np = None
+
+try:
+    import brotli
+except ImportError:  # Sem o módulo brotli as respostas são comprimidas apenas com gzip.
+    brotli = None
 
 # --- 1. CONFIGURAÇÃO DA APLICAÇÃO ---
 app = Flask(__name__)
 app.secret_key = secrets.token_hex(16)
 app.config['ADMIN_PASSWORD'] = '42' # Senha para acesso administrativo. Em produção, use uma variável de ambiente.
+app.config['MOTOR_PONTUACAO'] = os.environ.get('SASAC_MOTOR_PONTUACAO', 'indices') # 'indices' (tabelas pré-calculadas), 'sql' (calculado pelo SQLite), 'numpy' (vetorizado) ou 'python' (cálculo original, para comparação).
+app.config['MODO_ALOCACAO'] = 'guloso' # Modo pré-selecionado no painel: 'guloso', 'otimo', 'otimo_cobertura' ou 'estavel'.
+app.config['ALOCACAO_EM_SEGUNDO_PLANO'] = True # False: /processar espera pelo fim da alocação (útil em testes).
+app.config['TAREFA_ALOCACAO_MAX_S'] = 1800 # Uma tarefa ativa há mais tempo do que isto deixa de bloquear novas execuções, mesmo com o worker vivo.
+app.config['METRICAS'] = os.environ.get('SASAC_METRICAS') == '1' # Latência por rota, SQL por pedido e fases da alocação, expostos em /metrics.
+app.config['LIMIAR_PEDIDO_LENTO_MS'] = int(os.environ['SASAC_PEDIDO_LENTO_MS']) if os.environ.get('SASAC_PEDIDO_LENTO_MS') else None # Regista no log os pedidos mais lentos do que este valor.
 
 DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sasac.db')
+app.config['DATABASE'] = DATABASE # Base de dados do processo seletivo principal (endereços sem prefixo).
+app.config['PASTA_PROCESSOS'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'processos') # Uma base <nome>.db por processo seletivo, servido em /p/<nome>/.
+app.config['PASTA_ATIVOS'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ativos') # CSS/JS servidos pela aplicação em /ativos/ (ver `flask preparar-ativos`).
+app.config['COMPRESSAO_MIN_BYTES'] = 1024 # Respostas de texto a partir deste tamanho são comprimidas (gzip/brotli). None desativa.
+app.config['COMPRESSAO_NIVEL_GZIP'] = 6
+app.config['COMPRESSAO_NIVEL_BROTLI'] = 5 # 0-11; acima de ~6 o custo de CPU por pedido cresce muito mais do que o ganho.
+# Afinação do SQLite aplicada a cada nova ligação do pool.
+app.config['SQLITE_SYNCHRONOUS'] = 'NORMAL' # Com WAL, NORMAL é seguro contra corrupção e evita um fsync por transação.
+app.config['SQLITE_CACHE_SIZE'] = -20000 # Valor negativo = KiB (cerca de 20 MB por ligação).
+app.config['SQLITE_MMAP_SIZE'] = 256 * 1024 * 1024
+app.config['SQLITE_BUSY_TIMEOUT'] = 5000 # ms a aguardar pelo bloqueio de escrita antes de "database is locked".
+# Escrita em grupo das avaliações submetidas no portal (ver ESCRITA EM GRUPO). Desligada por omissão.
+app.config['ESCRITA_EM_GRUPO'] = os.environ.get('SASAC_ESCRITA_EM_GRUPO') == '1'
+app.config['ESCRITA_GRUPO_MAX_TAMANHO'] = 256 # Submissões por commit.
+app.config['ESCRITA_GRUPO_ESPERA_MS'] = 0 # Espera extra para juntar mais submissões a um grupo; 0 = grava logo as que já estão na fila.
+app.config['ESCRITA_GRUPO_MAX_FILA'] = 1000 # Submissões à espera; com a fila cheia, o pedido recebe 503.
+app.config['ESCRITA_GRUPO_TIMEOUT_S'] = 10 # Tempo máximo que um pedido espera pela gravação antes de receber 503.
 
 # --- 2. GESTÃO DO BANCO DE DADOS SQLITE ---
+_ESQUEMAS_VERIFICADOS = set()
+# Pool de ligações: uma ligação por thread e por ficheiro, reutilizada entre pedidos. O PID é guardado para que
+# um processo criado por fork (ex.: workers do gunicorn com --preload) nunca reutilize ligações do processo pai.
+_POOL_CONEXOES = threading.local()
+
+# Instruções SQL executadas enquanto o explain-consultas percorre a aplicação: {forma normalizada: exemplo}.
+# Fora desse comando é None e as ligações não têm trace.
+_REGISTO_SQL = None
+_TRAVA_REGISTO_SQL = threading.Lock()
+
+# A forma normalizada troca os literais por '?' e junta as listas de valores (IN (...), VALUES), para que a mesma
+# instrução com parâmetros diferentes seja explicada uma só vez.
+def normalizar_instrucao(sql):
+    sql = re.sub(r"'(?:[^']|'')*'|(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|\bNULL\b", '?', sql)
+    sql = re.sub(r"\?(?:\s*,\s*\?)+", '?', sql)
+    sql = re.sub(r"\(\?\)(?:\s*,\s*\(\?\))+", '(?)', sql)
+    return ' '.join(sql.split())
+
+def registar_instrucao(sql):
+    chave = normalizar_instrucao(sql)
+    with _TRAVA_REGISTO_SQL:
+        if _REGISTO_SQL is not None:
+            _REGISTO_SQL.setdefault(chave, sql)
+
+class ConexaoSASAC(sqlite3.Connection):
+    # Guarda o caminho do ficheiro, que identifica a base de dados nas caches em memória (ex.: configurações).
+    caminho = None
+
+def abrir_conexao(caminho):
+    sincronismo = str(app.config['SQLITE_SYNCHRONOUS']).upper()
+    if sincronismo not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+        raise ValueError(f"SQLITE_SYNCHRONOUS inválido: {sincronismo}")
+    db = sqlite3.connect(caminho, detect_types=sqlite3.PARSE_DECLTYPES, factory=ConexaoInstrumentada if instrumentacao_ativa() else ConexaoSASAC)
+    db.caminho = caminho
+    db.row_factory = sqlite3.Row
+    if _REGISTO_SQL is not None:
+        db.set_trace_callback(registar_instrucao)
+    db.execute(f"PRAGMA busy_timeout = {int(app.config['SQLITE_BUSY_TIMEOUT'])}")
+    db.execute("PRAGMA journal_mode = WAL")
+    db.execute(f"PRAGMA synchronous = {sincronismo}")
+    db.execute(f"PRAGMA cache_size = {int(app.config['SQLITE_CACHE_SIZE'])}")
+    db.execute(f"PRAGMA mmap_size = {int(app.config['SQLITE_MMAP_SIZE'])}")
+    return db
+
+def obter_conexao(caminho):
+    if getattr(_POOL_CONEXOES, 'pid', None) != os.getpid():
+        _POOL_CONEXOES.pid, _POOL_CONEXOES.conexoes = os.getpid(), {}
+    db = _POOL_CONEXOES.conexoes.get(caminho)
+    if db is not None:
+        try:
+            db.execute("SELECT 1").fetchone()
+        except sqlite3.Error:
+            db = None
+    if db is None:
+        db = _POOL_CONEXOES.conexoes[caminho] = abrir_conexao(caminho)
+    return db
+
+# Fecha a ligação do pool desta thread e esquece as caches associadas a um ficheiro (ex.: bases temporárias).
+def descartar_base_de_dados(caminho):
+    conexao = getattr(_POOL_CONEXOES, 'conexoes', {}).pop(caminho, None)
+    if conexao is not None:
+        conexao.close()
+    _ESQUEMAS_VERIFICADOS.discard(caminho)
+    _CACHE_CONFIGURACOES.pop(caminho, None)
+    _CACHE_QUESTIONARIO.pop(caminho, None)
+
+# Ligação à base de dados do processo seletivo atual, sem verificar o esquema (init-db e upgrade-db).
+def conexao_processo():
+    return obter_conexao(caminho_processo(g.get('processo')))
+
 def get_db():
     if 'db' not in g:
-        g.db = sqlite3.connect(DATABASE, detect_types=sqlite3.PARSE_DECLTYPES)
-        g.db.row_factory = sqlite3.Row
+        g.db = conexao_processo()
+        if g.db.caminho not in _ESQUEMAS_VERIFICADOS and verificar_esquema(g.db):
+            _ESQUEMAS_VERIFICADOS.add(g.db.caminho)
     return g.db
 
 @app.teardown_appcontext
 def close_db(exception):
+    # A ligação não é fechada: volta ao pool, sem deixar transações pendentes.
     db = g.pop('db', None)
-    if db is not None:
-        db.close()
+    if db is None:
+        return
+    try:
+        if db.in_transaction:
+            db.rollback()
+    except sqlite3.Error:
+        pass  # Ligação inutilizável: o health check do pool substitui-a no próximo pedido.
+
+# --- PROCESSOS SELETIVOS ---
+# Cada processo seletivo tem a sua própria base de dados (PASTA_PROCESSOS/<nome>.db) e é servido com o prefixo
+# /p/<nome>. O prefixo passa para o SCRIPT_NAME, pelo que as rotas, o url_for e os endereços relativos a
+# request.script_root funcionam sem alterações; sem prefixo, usa-se a base DATABASE. Como as ligações, o esquema
+# verificado e a cache de configurações são guardados por ficheiro, e cada ficheiro tem o seu próprio bloqueio de
+# escrita do SQLite, uma alocação num processo não atrasa as avaliações submetidas noutro.
+NOME_PROCESSO = re.compile(r'[a-z0-9][a-z0-9_-]{0,63}')
+
+def caminho_processo(nome=None):
+    if nome is None:
+        return app.config['DATABASE']
+    return os.path.join(app.config['PASTA_PROCESSOS'], f"{nome}.db")
+
+def processo_existe(nome):
+    return NOME_PROCESSO.fullmatch(nome) is not None and os.path.exists(caminho_processo(nome))
+
+def listar_processos():
+    pasta = app.config['PASTA_PROCESSOS']
+    if not os.path.isdir(pasta):
+        return []
+    return sorted(nome[:-3] for nome in os.listdir(pasta) if nome.endswith('.db') and NOME_PROCESSO.fullmatch(nome[:-3]))
+
+def criar_processo(nome):
+    if NOME_PROCESSO.fullmatch(nome) is None:
+        raise ValueError("Nome inválido: use apenas letras minúsculas, algarismos, '-' e '_' (até 64 caracteres).")
+    if processo_existe(nome):
+        raise ValueError(f"O processo seletivo '{nome}' já existe.")
+    os.makedirs(app.config['PASTA_PROCESSOS'], exist_ok=True)
+    with app.app_context():
+        g.processo = nome
+        init_db_logic()
+
+class EncaminhamentoProcessos:
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        caminho = environ.get('PATH_INFO', '')
+        environ['sasac.raiz'] = environ.get('SCRIPT_NAME', '')
+        if caminho.startswith('/p/'):
+            nome, _, resto = caminho[3:].partition('/')
+            environ['sasac.processo'] = nome
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + '/p/' + nome
+            environ['PATH_INFO'] = '/' + resto
+        return self.wsgi_app(environ, start_response)
+
+app.wsgi_app = EncaminhamentoProcessos(app.wsgi_app)
+
+@app.before_request
+def definir_processo():
+    nome = request.environ.get('sasac.processo')
+    if nome is not None and not processo_existe(nome):
+        abort(404)
+    g.processo = nome
+
+# Endereço base de um processo seletivo (None = o principal), a partir da raiz da aplicação e não do prefixo atual.
+@app.template_global()
+def endereco_processo(nome=None):
+    raiz = request.environ.get('sasac.raiz', request.script_root)
+    return f"{raiz}/p/{nome}" if nome else raiz
+
+# Comandos que usam a base de dados: --processo (ou SASAC_PROCESSO) escolhe o processo seletivo. Aplicado abaixo de
+# @with_appcontext, para que g já exista quando o comando é chamado.
+def opcao_processo(comando):
+    @wraps(comando)
+    def com_processo(*args, processo=None, **kwargs):
+        if processo is not None and not processo_existe(processo):
+            raise click.BadParameter(f"o processo seletivo '{processo}' não existe (ver \"flask listar-processos\").", param_hint='--processo')
+        g.processo = processo
+        return comando(*args, **kwargs)
+    return click.option('--processo', envvar='SASAC_PROCESSO', default=None, help='Processo seletivo (por omissão, a base de dados principal).')(com_processo)
+
+# --- INSTRUMENTAÇÃO ---
+# Métricas em memória, por processo (cada worker expõe as suas). Com METRICAS e LIMIAR_PEDIDO_LENTO_MS desligados,
+# as ligações abertas são ConexaoSASAC simples e os hooks dos pedidos saem logo no início: o custo é desprezável.
+LIMITES_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LIMITES_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+HISTOGRAMAS = {
+    'sasac_pedido_duracao_segundos': ("Duração dos pedidos HTTP, por rota.", LIMITES_SEGUNDOS),
+    'sasac_pedido_sql_consultas': ("Instruções SQL executadas em cada pedido, por rota.", LIMITES_CONSULTAS),
+    'sasac_pedido_sql_segundos': ("Tempo acumulado em SQL (execução e leitura das linhas) em cada pedido, por rota.", LIMITES_SEGUNDOS),
+    'sasac_alocacao_fase_segundos': ("Duração de cada fase da alocação.", LIMITES_SEGUNDOS),
+    'sasac_escrita_grupo_tamanho': ("Submissões gravadas em cada commit da escrita em grupo.", LIMITES_CONSULTAS),
+}
+CONTADORES = {
+    'sasac_pedidos_total': "Pedidos HTTP, por rota, método e estado.",
+}
+
+class RegistoMetricas:
+    def __init__(self):
+        self.trava = threading.Lock()
+        self.histogramas = {nome: {} for nome in HISTOGRAMAS}  # {rótulos: [contagem por limite..., +Inf, soma]}
+        self.contadores = {nome: defaultdict(float) for nome in CONTADORES}
+
+    def observar(self, nome, rotulos, valor):
+        limites = HISTOGRAMAS[nome][1]
+        chave = tuple(sorted(rotulos.items()))
+        with self.trava:
+            serie = self.histogramas[nome].get(chave)
+            if serie is None:
+                serie = self.histogramas[nome][chave] = [0] * (len(limites) + 1) + [0.0]
+            for i, limite in enumerate(limites):
+                if valor <= limite:
+                    serie[i] += 1
+            serie[-2] += 1
+            serie[-1] += valor
+
+    def incrementar(self, nome, rotulos, valor=1):
+        with self.trava:
+            self.contadores[nome][tuple(sorted(rotulos.items()))] += valor
+
+    # Formato de texto do Prometheus (versão 0.0.4).
+    def exportar(self):
+        def formatar(rotulos):
+            escapar = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            return '{' + ','.join(f'{k}="{escapar(v)}"' for k, v in rotulos) + '}' if rotulos else ''
+        linhas = []
+        with self.trava:
+            for nome, (ajuda, limites) in HISTOGRAMAS.items():
+                linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} histogram"]
+                for chave, serie in sorted(self.histogramas[nome].items()):
+                    for limite, contagem in zip([*limites, '+Inf'], serie):
+                        linhas.append(f"{nome}_bucket{formatar(chave + (('le', limite),))} {contagem}")
+                    linhas += [f"{nome}_sum{formatar(chave)} {serie[-1]}", f"{nome}_count{formatar(chave)} {serie[-2]}"]
+            for nome, ajuda in CONTADORES.items():
+                linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} counter"]
+                linhas += [f"{nome}{formatar(chave)} {valor:g}" for chave, valor in sorted(self.contadores[nome].items())]
+        return '\n'.join(linhas) + '\n'
+
+METRICAS = RegistoMetricas()
+
+def instrumentacao_ativa():
+    return app.config['METRICAS'] or app.config['LIMIAR_PEDIDO_LENTO_MS'] is not None
+
+# Medição do pedido em curso nesta thread: [instruções SQL, segundos em SQL]. Fora de um pedido não há medição.
+_MEDICAO_PEDIDO = threading.local()
+
+def acumular_sql(segundos, instrucoes=0):
+    medicao = getattr(_MEDICAO_PEDIDO, 'sql', None)
+    if medicao is not None:
+        medicao[0] += instrucoes
+        medicao[1] += segundos
+
+# O tempo de cada instrução inclui a execução e a leitura das linhas, que no sqlite3 acontece à medida que se itera.
+class CursorInstrumentado(sqlite3.Cursor):
+    def _medir(self, metodo, args, instrucoes=0):
+        inicio = time.perf_counter()
+        try:
+            return metodo(*args)
+        finally:
+            acumular_sql(time.perf_counter() - inicio, instrucoes)
+
+    def execute(self, *args):
+        return self._medir(super().execute, args, 1)
+
+    def executemany(self, *args):
+        return self._medir(super().executemany, args, 1)
+
+    def executescript(self, *args):
+        return self._medir(super().executescript, args, 1)
+
+    def fetchone(self):
+        return self._medir(super().fetchone, ())
+
+    def fetchmany(self, *args):
+        return self._medir(super().fetchmany, args)
+
+    def fetchall(self):
+        return self._medir(super().fetchall, ())
+
+    def __next__(self):
+        return self._medir(super().__next__, ())
+
+class ConexaoInstrumentada(ConexaoSASAC):
+    def cursor(self, factory=CursorInstrumentado):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def executescript(self, *args):
+        return self.cursor().executescript(*args)
+
+    def commit(self):
+        inicio = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            acumular_sql(time.perf_counter() - inicio, 1)
+
+# Fases da alocação: cada chamada fecha a fase anterior desta thread (registando a sua duração) e abre a seguinte;
+# None fecha a última. Os motores e as estratégias refinam as fases marcadas por executar_alocacao.
+_FASE_ALOCACAO = threading.local()
+
+def marcar_fase(fase, primeira=False):
+    if not app.config['METRICAS']:
+        return
+    agora = time.perf_counter()
+    anterior = getattr(_FASE_ALOCACAO, 'fase', None)
+    if anterior is not None and not primeira:
+        METRICAS.observar('sasac_alocacao_fase_segundos', {'fase': anterior}, agora - _FASE_ALOCACAO.inicio)
+    _FASE_ALOCACAO.fase, _FASE_ALOCACAO.inicio = fase, agora
 
 # --- DECORADOR DE AUTENTICAÇÃO ---
 def login_required(f):
@@ -39,8 +381,223 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# --- CACHE HTTP CONDICIONAL (ETAG) ---
+# As páginas de leitura mais recarregadas levam um ETag forte formado pela versão dos dados (contador mantido por
+# triggers, ver SCHEMA_VERSAO_DADOS_SQL) e por um resumo do código da aplicação, que muda a cada atualização.
+# Um If-None-Match igual recebe 304 depois de uma única leitura pela chave primária, sem correr as consultas nem
+# os templates da página. Pedidos com mensagens flash pendentes não usam ETag: a página seguinte tem de as mostrar.
+with open(__file__, 'rb') as _fonte:
+    VERSAO_CODIGO = hashlib.sha1(_fonte.read()).hexdigest()[:12]
+
+def com_etag(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+            return f(*args, **kwargs)
+        etag = f"{ler_versao_dados(get_db())}-{VERSAO_CODIGO}"
+        # Cada codificação (ver COMPRESSÃO) tem o seu ETag: "<etag>-gzip", "<etag>-br".
+        validado = next((e for e in (etag, *(f"{etag}-{c}" for c in CODIFICACOES)) if request.if_none_match.contains(e)), None)
+        if validado:
+            resposta = Response(status=304)
+            etag = validado
+        else:
+            resposta = make_response(f(*args, **kwargs))
+            if resposta.status_code != 200:
+                return resposta
+        resposta.set_etag(etag)
+        resposta.headers['Cache-Control'] = 'private, no-cache'
+        return resposta
+    return decorated_function
+
+# --- ATIVOS ESTÁTICOS E COMPRESSÃO ---
+# O CSS e o JS das páginas são servidos pela própria aplicação a partir de PASTA_ATIVOS. O endereço leva um resumo
+# do conteúdo (?v=...), pelo que o navegador pode guardá-lo durante um ano sem voltar a pedir: uma nova versão do
+# ficheiro muda o endereço. Enquanto um ficheiro não estiver na pasta usa-se o endereço público de ATIVOS_EXTERNOS.
+# O MathJax não é um ficheiro único: o script principal pede as fontes (output/chtml/fonts/woff-v2/) e as extensões
+# carregadas a pedido a partir da sua própria pasta. Por isso é instalada a árvore es5/ completa do pacote, numa pasta
+# com a versão no nome; só o script principal leva o resumo no endereço.
+MATHJAX_VERSAO = '3.2.2'
+MATHJAX_PASTA = f'mathjax-{MATHJAX_VERSAO}'
+MATHJAX_PRINCIPAL = f'{MATHJAX_PASTA}/tex-mml-chtml.js'
+MATHJAX_PACOTE = f'https://registry.npmjs.org/mathjax/-/mathjax-{MATHJAX_VERSAO}.tgz'
+ATIVOS_EXTERNOS = {
+    'bootstrap.min.css': 'https://stackpath.bootstrapcdn.com/bootstrap/4.5.2/css/bootstrap.min.css',
+    MATHJAX_PRINCIPAL: f'https://cdn.jsdelivr.net/npm/mathjax@{MATHJAX_VERSAO}/es5/tex-mml-chtml.js',
+}
+CODIFICACOES = ('br', 'gzip')
+TIPOS_COMPRESSIVEIS = {'text/html', 'text/css', 'text/csv', 'text/plain', 'text/javascript', 'application/javascript', 'application/json', 'image/svg+xml'}
+_RESUMOS_ATIVOS = {}
+
+def resumo_ativo(caminho):
+    estado = os.stat(caminho)
+    chave = (caminho, estado.st_mtime_ns, estado.st_size)
+    if chave not in _RESUMOS_ATIVOS:
+        with open(caminho, 'rb') as f:
+            _RESUMOS_ATIVOS[chave] = hashlib.sha1(f.read()).hexdigest()[:12]
+    return _RESUMOS_ATIVOS[chave]
+
+@app.template_global()
+def ativo_estatico(nome):
+    try:
+        resumo = resumo_ativo(os.path.join(app.config['PASTA_ATIVOS'], nome))
+    except FileNotFoundError:
+        return ATIVOS_EXTERNOS[nome]
+    return f"{endereco_processo()}/ativos/{nome}?v={resumo}"
+
+def codificacoes_aceites():
+    return [c for c in CODIFICACOES if (c != 'br' or brotli is not None) and request.accept_encodings.quality(c) > 0]
+
+def comprimir(dados, codificacao):
+    if codificacao == 'br':
+        return brotli.compress(dados, quality=app.config['COMPRESSAO_NIVEL_BROTLI'])
+    return gzip.compress(dados, compresslevel=app.config['COMPRESSAO_NIVEL_GZIP'], mtime=0)
+
+# Os ativos são comprimidos uma única vez (ficheiros .br/.gz ao lado do original, ver preparar-ativos) e servidos
+# tal como estão; sem essas versões, o original segue sem compressão.
+@app.route('/ativos/<path:nome>')
+def ativos(nome):
+    pasta = app.config['PASTA_ATIVOS']
+    caminho = safe_join(pasta, nome)
+    if caminho is None or not os.path.isfile(caminho):
+        abort(404)
+    # Os ficheiros da pasta do MathJax mudam de endereço com a versão (MATHJAX_PASTA), mesmo os pedidos sem resumo.
+    versao_atual = request.args.get('v') == resumo_ativo(caminho) or nome.startswith(f'{MATHJAX_PASTA}/')
+    opcoes = {'max_age': 365 * 24 * 3600 if versao_atual else 0, 'mimetype': mimetypes.guess_type(nome)[0] or 'application/octet-stream'}
+    for codificacao in codificacoes_aceites():
+        extensao = {'br': '.br', 'gzip': '.gz'}[codificacao]
+        if os.path.isfile(os.path.join(pasta, nome + extensao)):
+            resposta = send_from_directory(pasta, nome + extensao, **opcoes)
+            resposta.headers['Content-Encoding'] = codificacao
+            break
+    else:
+        resposta = send_from_directory(pasta, nome, **opcoes)
+    if versao_atual:
+        resposta.cache_control.immutable = True
+    resposta.vary.add('Accept-Encoding')
+    return resposta
+
+# Compressão das respostas geradas (relatórios, ajuda, listagens, exportações pequenas). As respostas em streaming
+# e os ficheiros enviados por send_from_directory ficam de fora. O ETag ganha o sufixo da codificação, para que
+# caches intermédias nunca confundam a versão comprimida com a original.
+@app.after_request
+def comprimir_resposta(resposta):
+    minimo = app.config['COMPRESSAO_MIN_BYTES']
+    if minimo is None or resposta.mimetype not in TIPOS_COMPRESSIVEIS or resposta.direct_passthrough or resposta.is_streamed or 'Content-Encoding' in resposta.headers:
+        return resposta
+    resposta.vary.add('Accept-Encoding')
+    codificacoes = codificacoes_aceites()
+    if not codificacoes or resposta.status_code != 200:
+        return resposta
+    dados = resposta.get_data()
+    if len(dados) < minimo:
+        return resposta
+    resposta.set_data(comprimir(dados, codificacoes[0]))
+    resposta.headers['Content-Encoding'] = codificacoes[0]
+    etag, fraco = resposta.get_etag()
+    if etag:
+        resposta.set_etag(f"{etag}-{codificacoes[0]}", weak=fraco)
+    return resposta
+
+# Extrai a árvore es5/ do pacote npm do MathJax para PASTA_ATIVOS/MATHJAX_PASTA. A extração é feita numa pasta
+# temporária, que só substitui a definitiva no fim: um pacote incompleto nunca fica a ser servido.
+def instalar_mathjax(pasta):
+    with urllib.request.urlopen(MATHJAX_PACOTE, timeout=120) as resposta:
+        conteudo = resposta.read()
+    prefixo = 'package/es5/'
+    temporaria = tempfile.mkdtemp(prefix='.mathjax-', dir=pasta)
+    try:
+        with tarfile.open(fileobj=io.BytesIO(conteudo), mode='r:gz') as pacote:
+            membros = [m for m in pacote.getmembers() if m.isfile() and m.name.startswith(prefixo)]
+            for membro in membros:
+                membro.name = os.path.normpath(membro.name[len(prefixo):])
+                if os.path.isabs(membro.name) or membro.name.startswith('..'):
+                    raise click.ClickException(f"{MATHJAX_PACOTE}: caminho inválido no pacote: {membro.name}")
+            # O filtro 'data' (Python 3.11.4 e seguintes) recusa ainda permissões e tipos de ficheiro perigosos.
+            pacote.extractall(temporaria, members=membros, **({'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}))
+        os.replace(temporaria, os.path.join(pasta, MATHJAX_PASTA))
+    except BaseException:
+        shutil.rmtree(temporaria, ignore_errors=True)
+        raise
+    return len(membros), len(conteudo)
+
+# Ficheiros que uma página com fórmulas pede ao servidor e que faltam na pasta do MathJax: o script principal, as
+# fontes que ele declara (lidas do próprio script) e a pasta das extensões do TeX carregadas a pedido.
+def ficheiros_em_falta_mathjax(pasta):
+    raiz = os.path.join(pasta, MATHJAX_PASTA)
+    principal = os.path.join(pasta, MATHJAX_PRINCIPAL)
+    if not os.path.isfile(principal):
+        return [MATHJAX_PRINCIPAL]
+    with open(principal, encoding='utf-8') as f:
+        fontes = sorted(set(re.findall(r"MathJax_[\w-]+\.woff", f.read())))
+    if not fontes:
+        return [f"{MATHJAX_PRINCIPAL} não declara nenhuma fonte (output/chtml/fonts/woff-v2/MathJax_*.woff)"]
+    pedidos = [f"output/chtml/fonts/woff-v2/{fonte}" for fonte in fontes]
+    em_falta = [f"{MATHJAX_PASTA}/{pedido}" for pedido in pedidos if not os.path.isfile(os.path.join(raiz, pedido))]
+    extensoes = os.path.join(raiz, 'input', 'tex', 'extensions')
+    if not os.path.isdir(extensoes) or not os.listdir(extensoes):
+        em_falta.append(f"{MATHJAX_PASTA}/input/tex/extensions/")
+    return em_falta
+
+# Descarrega para PASTA_ATIVOS os ficheiros de ATIVOS_EXTERNOS que ainda lá não estejam (o MathJax, do pacote
+# completo) e cria as versões comprimidas (.gz e, com o módulo brotli, .br) dos ativos de texto. Termina com erro se
+# faltar algum dos ficheiros que as páginas com fórmulas vão pedir. Correr de novo após substituir um ficheiro.
+@click.command('preparar-ativos')
+@click.option('--sem-descarregar', is_flag=True, help='Apenas comprime os ficheiros já presentes na pasta.')
+def preparar_ativos_command(sem_descarregar):
+    pasta = app.config['PASTA_ATIVOS']
+    os.makedirs(pasta, exist_ok=True)
+    if not sem_descarregar:
+        if not os.path.isdir(os.path.join(pasta, MATHJAX_PASTA)):
+            ficheiros, tamanho = instalar_mathjax(pasta)
+            click.echo(f"{MATHJAX_PASTA}: {ficheiros} ficheiros extraídos de {MATHJAX_PACOTE} ({tamanho} bytes).")
+        for nome, endereco in ATIVOS_EXTERNOS.items():
+            destino = os.path.join(pasta, nome)
+            if os.path.exists(destino) or nome == MATHJAX_PRINCIPAL:
+                continue
+            with urllib.request.urlopen(endereco, timeout=60) as resposta:
+                conteudo = resposta.read()
+            with open(destino, 'wb') as f:
+                f.write(conteudo)
+            click.echo(f"{nome}: descarregado de {endereco} ({len(conteudo)} bytes).")
+    for raiz, _, ficheiros in os.walk(pasta):
+        for nome in sorted(ficheiros):
+            # As fontes (woff) já vêm comprimidas.
+            if nome.endswith(('.gz', '.br')) or mimetypes.guess_type(nome)[0] not in TIPOS_COMPRESSIVEIS:
+                continue
+            caminho = os.path.join(raiz, nome)
+            with open(caminho, 'rb') as f:
+                conteudo = f.read()
+            # Compressão máxima: é feita uma só vez, não a cada pedido.
+            comprimidos = {'.gz': gzip.compress(conteudo, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                comprimidos['.br'] = brotli.compress(conteudo, quality=11)
+            for extensao, comprimido in comprimidos.items():
+                with open(caminho + extensao, 'wb') as f:
+                    f.write(comprimido)
+            click.echo(f"{os.path.relpath(caminho, pasta)}: {len(conteudo)} bytes -> " + ', '.join(f"{extensao} {len(c)}" for extensao, c in comprimidos.items()))
+    if os.path.isdir(os.path.join(pasta, MATHJAX_PASTA)):
+        em_falta = ficheiros_em_falta_mathjax(pasta)
+        if em_falta:
+            raise click.ClickException("Faltam ficheiros do MathJax que as páginas com fórmulas vão pedir: " + ', '.join(em_falta))
+        click.echo(f"{MATHJAX_PASTA}: o script principal, as fontes e as extensões estão todos presentes.")
+
+app.cli.add_command(preparar_ativos_command)
+
+# Índices secundários das consultas mais frequentes (avaliações por candidato, preferências por orientador e
+# listagens ordenadas por nome). As chaves primárias e UNIQUE já cobrem as restantes pesquisas.
+INDICES_SECUNDARIOS_SQL = """
+CREATE INDEX IF NOT EXISTS idx_avaliacoes_candidato ON avaliacoes (candidato_id);
+CREATE INDEX IF NOT EXISTS idx_preferencias_orientador ON preferencias_candidatos (orientador_id, candidato_id);
+CREATE INDEX IF NOT EXISTS idx_orientadores_nome ON orientadores (nome);
+CREATE INDEX IF NOT EXISTS idx_candidatos_nome ON candidatos (nome);
+"""
+
 SCHEMA_SQL = """
 DROP TABLE IF EXISTS avaliacoes; DROP TABLE IF EXISTS preferencias_candidatos; DROP TABLE IF EXISTS orientadores; DROP TABLE IF EXISTS candidatos; DROP TABLE IF EXISTS configuracoes;
+DROP TABLE IF EXISTS notas_curriculo_agregadas; DROP TABLE IF EXISTS indices_preparo; DROP TABLE IF EXISTS indices_afinidade;
+DROP TABLE IF EXISTS execucao_pontuacoes; DROP TABLE IF EXISTS execucao_alocacoes; DROP TABLE IF EXISTS execucao_orientadores; DROP TABLE IF EXISTS execucoes_alocacao;
+DROP TABLE IF EXISTS tarefas_alocacao; DROP TABLE IF EXISTS respostas; DROP TABLE IF EXISTS questoes; DROP TABLE IF EXISTS secoes;
+PRAGMA user_version = 0;
 CREATE TABLE orientadores (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     nome TEXT NOT NULL,
@@ -60,172 +617,2089 @@ CREATE TABLE preferencias_candidatos (
 );
 CREATE TABLE avaliacoes (
     id INTEGER PRIMARY KEY AUTOINCREMENT, orientador_id INTEGER NOT NULL, candidato_id INTEGER NOT NULL,
-    s2_1 INTEGER, s2_2 INTEGER, s3_1 INTEGER, s3_2 INTEGER, s4_1 INTEGER, s4_2 INTEGER,
     FOREIGN KEY (orientador_id) REFERENCES orientadores(id) ON DELETE CASCADE,
     FOREIGN KEY (candidato_id) REFERENCES candidatos(id) ON DELETE CASCADE,
     UNIQUE(orientador_id, candidato_id)
 );
 CREATE TABLE configuracoes ( chave TEXT PRIMARY KEY, valor TEXT NOT NULL );
+""" + INDICES_SECUNDARIOS_SQL
+
+# --- QUESTIONÁRIO ---
+# As secções e as questões vivem nas tabelas secoes e questoes e as notas na tabela respostas, uma linha por
+# (avaliação, questão): acrescentar uma questão não altera o esquema (ver flask adicionar-questao). Cada secção é
+# respondida pelos orientadores com a atribuição indicada (uma das colunas ATRIBUICOES de orientadores) e entra num
+# dos índices: 'preparo' (IPc) ou 'afinidade' (IAoc). O código da questão (ex.: s2_1) é o nome do campo nos
+# formulários e na API e a chave do peso em configuracoes; o id fixa a ordem das somas, igual em todos os motores.
+ATRIBUICOES = ('avalia_curriculo', 'avalia_entrevista', 'avalia_afinidade')
+INDICES_QUESTOES = ('preparo', 'afinidade')
+QUESTIONARIO_PADRAO = (
+    ("II. Avaliação do Currículo", 'avalia_curriculo', 'preparo', [("s2_1", "2.1. O desempenho acadêmico e a formação do candidato são adequados."), ("s2_2", "2.2. O candidato possui experiência prévia relevante em pesquisa.")]),
+    ("III. Avaliação da Entrevista", 'avalia_entrevista', 'afinidade', [("s3_1", "3.1. O candidato comunicou-se com clareza e objetividade."), ("s3_2", "3.2. A motivação do candidato é evidente e bem fundamentada.")]),
+    ("IV. Avaliação da Afinidade", 'avalia_afinidade', 'afinidade', [("s4_1", "4.1. Os interesses de pesquisa estão alinhados aos do orientador."), ("s4_2", "4.2. O candidato demonstra alto potencial de desenvolvimento.")]),
+)
+
+SCHEMA_QUESTIONARIO_SQL = f"""
+CREATE TABLE IF NOT EXISTS secoes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    titulo TEXT NOT NULL UNIQUE,
+    atribuicao TEXT NOT NULL CHECK (atribuicao IN ({', '.join(f"'{a}'" for a in ATRIBUICOES)})),
+    indice TEXT NOT NULL CHECK (indice IN ({', '.join(f"'{i}'" for i in INDICES_QUESTOES)})),
+    ordem INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS questoes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    secao_id INTEGER NOT NULL,
+    codigo TEXT NOT NULL UNIQUE,
+    texto TEXT NOT NULL,
+    ordem INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (secao_id) REFERENCES secoes(id)
+);
+CREATE TABLE IF NOT EXISTS respostas (
+    avaliacao_id INTEGER NOT NULL,
+    questao_id INTEGER NOT NULL,
+    nota INTEGER NOT NULL,
+    PRIMARY KEY (avaliacao_id, questao_id)
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS avaliacoes_apagar_respostas AFTER DELETE ON avaliacoes
+BEGIN DELETE FROM respostas WHERE avaliacao_id = OLD.id; END;
 """
 
-QUESTIONARIO_ESTRUTURA = {
-    "II. Avaliação do Currículo": [{"id": "s2_1", "texto": "2.1. O desempenho acadêmico e a formação do candidato são adequados."}, {"id": "s2_2", "texto": "2.2. O candidato possui experiência prévia relevante em pesquisa."}],
-    "III. Avaliação da Entrevista": [{"id": "s3_1", "texto": "3.1. O candidato comunicou-se com clareza e objetividade."}, {"id": "s3_2", "texto": "3.2. A motivação do candidato é evidente e bem fundamentada."}],
-    "IV. Avaliação da Afinidade": [{"id": "s4_1", "texto": "4.1. Os interesses de pesquisa estão alinhados aos do orientador."}, {"id": "s4_2", "texto": "4.2. O candidato demonstra alto potencial de desenvolvimento."}]
-}
+# Condição SQL "a resposta conta para os índices": o orientador (o) tem a atribuição da secção (s) da questão.
+SQL_RESPOSTA_VALIDA = "CASE s.atribuicao " + " ".join(f"WHEN '{a}' THEN o.{a}" for a in ATRIBUICOES) + " END"
+
+class Questionario:
+    def __init__(self, secoes, questoes):
+        # secoes: pela ordem de apresentação, cada uma com as suas questões (também pela ordem de apresentação).
+        # questoes: todas, pela ordem do id, que é a ordem das somas nos índices.
+        self.secoes = secoes
+        self.questoes = questoes
+        self.por_id = {q['id']: q for q in questoes}
+        self.por_codigo = {q['codigo']: q for q in questoes}
+        self.preparo = [q for q in questoes if q['indice'] == 'preparo']
+        self.afinidade = [q for q in questoes if q['indice'] == 'afinidade']
+
+    def secoes_do_orientador(self, orientador):
+        return [secao for secao in self.secoes if orientador[secao['atribuicao']]]
+
+    def do_orientador(self, orientador):
+        return [questao for secao in self.secoes_do_orientador(orientador) for questao in secao['questoes']]
+
+# Cache do questionário por base de dados, com a mesma lógica da cache das configurações (contador 'questionario').
+_CACHE_QUESTIONARIO = {}
+
+def carregar_questionario(db):
+    caminho = getattr(db, 'caminho', None)
+    versao = db.execute("SELECT versao FROM contadores_versao WHERE nome = 'questionario'").fetchone()[0]
+    em_cache = _CACHE_QUESTIONARIO.get(caminho) if caminho else None
+    if em_cache and em_cache[0] == versao:
+        return em_cache[1]
+    secoes = [dict(row, questoes=[]) for row in db.execute("SELECT * FROM secoes ORDER BY ordem, id")]
+    questoes = [dict(row) for row in db.execute("SELECT q.*, s.atribuicao, s.indice FROM questoes q JOIN secoes s ON s.id = q.secao_id ORDER BY q.id")]
+    por_secao = {secao['id']: secao for secao in secoes}
+    for questao in sorted(questoes, key=lambda q: (q['ordem'], q['id'])):
+        por_secao[questao['secao_id']]['questoes'].append(questao)
+    questionario = Questionario(secoes, questoes)
+    if caminho and not db.in_transaction:
+        _CACHE_QUESTIONARIO[caminho] = (versao, questionario)
+    return questionario
+
+# O questionário padrão sem base de dados (ids pela ordem de QUESTIONARIO_PADRAO), ex.: para medir os templates.
+def questionario_padrao():
+    secoes, questoes = [], []
+    for ordem, (titulo, atribuicao, indice, itens) in enumerate(QUESTIONARIO_PADRAO, 1):
+        secao = {'id': ordem, 'titulo': titulo, 'atribuicao': atribuicao, 'indice': indice, 'ordem': ordem, 'questoes': []}
+        for ordem_questao, (codigo, texto) in enumerate(itens, 1):
+            questao = {'id': len(questoes) + 1, 'secao_id': ordem, 'codigo': codigo, 'texto': texto, 'ordem': ordem_questao, 'atribuicao': atribuicao, 'indice': indice}
+            secao['questoes'].append(questao)
+            questoes.append(questao)
+        secoes.append(secao)
+    return Questionario(secoes, questoes)
+
+# Notas das avaliações, {avaliacao_id: {questao_id: nota}}; condicao filtra as avaliações (alias a).
+def carregar_notas(db, condicao="", params=()):
+    notas = defaultdict(dict)
+    for avaliacao_id, questao_id, nota in db.execute(
+        f"SELECT r.avaliacao_id, r.questao_id, r.nota FROM avaliacoes a JOIN respostas r ON r.avaliacao_id = a.id {condicao} ORDER BY r.avaliacao_id, r.questao_id", params
+    ):
+        notas[avaliacao_id][questao_id] = nota
+    return notas
+
+# As mesmas notas indexadas pelo código da questão, como nos formulários.
+def notas_por_codigo(questionario, notas):
+    return {questionario.por_id[qid]['codigo']: nota for qid, nota in notas.items() if qid in questionario.por_id}
+
+# Cache das configurações por base de dados: {caminho: (versão, configs)}. A versão é lida a cada chamada (uma
+# pesquisa pela chave primária) e só quando muda é que as configurações são relidas, para todos os workers.
+_CACHE_CONFIGURACOES = {}
+
+def ler_configuracoes(db):
+    caminho = getattr(db, 'caminho', None)
+    try:
+        versao = db.execute("SELECT versao FROM contadores_versao WHERE nome = 'configuracoes'").fetchone()[0]
+    except (sqlite3.OperationalError, TypeError):
+        caminho = None  # Esquema anterior à migração 5: sem contador, lê-se sempre da tabela.
+    em_cache = _CACHE_CONFIGURACOES.get(caminho) if caminho else None
+    if em_cache and em_cache[0] == versao:
+        return dict(em_cache[1])
+    configs = {row['chave']: float(row['valor']) for row in db.execute("SELECT * FROM configuracoes").fetchall()}
+    # Dentro de uma transação de escrita a versão pode ainda vir a ser desfeita: só se guarda o que já está confirmado.
+    if caminho and not db.in_transaction:
+        _CACHE_CONFIGURACOES[caminho] = (versao, dict(configs))
+    return configs
+
+# --- ÍNDICES PRÉ-CALCULADOS ---
+# Somas e contagens das notas de currículo por candidato (apenas de avaliadores de currículo), o IPc resultante
+# e o IAoc de cada avaliação. São mantidos na mesma transação de cada escrita, de modo que a alocação só
+# precisa de ler uma linha por par em vez de reagregar todas as avaliações.
+SCHEMA_INDICES_SQL = """
+CREATE TABLE IF NOT EXISTS notas_curriculo_agregadas (
+    candidato_id INTEGER NOT NULL,
+    questao_id TEXT NOT NULL,
+    soma INTEGER NOT NULL,
+    contagem INTEGER NOT NULL,
+    PRIMARY KEY (candidato_id, questao_id)
+);
+CREATE TABLE IF NOT EXISTS indices_preparo ( candidato_id INTEGER PRIMARY KEY, ipc REAL NOT NULL );
+CREATE TABLE IF NOT EXISTS indices_afinidade (
+    avaliacao_id INTEGER PRIMARY KEY,
+    orientador_id INTEGER NOT NULL,
+    candidato_id INTEGER NOT NULL,
+    iaoc REAL NOT NULL
+);
+"""
+
+def calcular_ipc(questionario, notas_agregadas, configs):
+    # notas_agregadas: {codigo: (soma, contagem)}. Soma pela ordem das questões, como nos motores de pontuação.
+    soma_ponderada_preparo, soma_pesos_preparo = 0, 0
+    for questao in questionario.preparo:
+        soma, contagem = notas_agregadas.get(questao['codigo'], (0, 0))
+        if contagem:
+            peso = configs.get(questao['codigo'], 1.0)
+            soma_ponderada_preparo += (soma / contagem) * peso
+            soma_pesos_preparo += peso
+    return soma_ponderada_preparo / soma_pesos_preparo if soma_pesos_preparo > 0 else 0
+
+def calcular_iaoc(questionario, orientador, notas, configs):
+    # notas: {questao_id: nota} de uma avaliação; contam as questões de afinidade das secções do orientador.
+    soma_ponderada_afinidade, soma_pesos_afinidade = 0, 0
+    for qid in sorted(notas):
+        questao = questionario.por_id.get(qid)
+        if questao and questao['indice'] == 'afinidade' and orientador[questao['atribuicao']]:
+            peso = configs.get(questao['codigo'], 1.0)
+            soma_ponderada_afinidade += notas[qid] * peso
+            soma_pesos_afinidade += peso
+    return soma_ponderada_afinidade / soma_pesos_afinidade if soma_pesos_afinidade > 0 else 0
+
+def recalcular_ipc(db, configs, candidato_ids=None):
+    filtro, params = "", []
+    if candidato_ids is not None:
+        filtro, params = f"WHERE candidato_id IN ({', '.join('?' * len(candidato_ids))})", list(candidato_ids)
+        db.execute(f"DELETE FROM indices_preparo {filtro}", params)
+    else:
+        db.execute("DELETE FROM indices_preparo")
+    questionario = carregar_questionario(db)
+    notas = defaultdict(dict)
+    for row in db.execute(f"SELECT candidato_id, questao_id, soma, contagem FROM notas_curriculo_agregadas {filtro}", params):
+        if row['contagem'] > 0:
+            notas[row['candidato_id']][row['questao_id']] = (row['soma'], row['contagem'])
+    db.executemany("INSERT INTO indices_preparo (candidato_id, ipc) VALUES (?, ?)", [(cid, calcular_ipc(questionario, n, configs)) for cid, n in notas.items()])
+
+def reconstruir_notas_curriculo(db, configs, candidato_ids=None):
+    filtro, params = "", []
+    if candidato_ids is not None:
+        candidato_ids = list(candidato_ids)
+        if not candidato_ids:
+            return
+        filtro, params = f"AND a.candidato_id IN ({', '.join('?' * len(candidato_ids))})", candidato_ids
+        db.execute(f"DELETE FROM notas_curriculo_agregadas WHERE candidato_id IN ({', '.join('?' * len(candidato_ids))})", candidato_ids)
+    else:
+        db.execute("DELETE FROM notas_curriculo_agregadas")
+    # Uma única agregação para todas as questões de preparo, qualquer que seja o seu número.
+    db.execute(
+        f"INSERT INTO notas_curriculo_agregadas (candidato_id, questao_id, soma, contagem) "
+        f"SELECT a.candidato_id, q.codigo, SUM(r.nota), COUNT(*) FROM avaliacoes a JOIN orientadores o ON o.id = a.orientador_id "
+        f"JOIN respostas r ON r.avaliacao_id = a.id JOIN questoes q ON q.id = r.questao_id JOIN secoes s ON s.id = q.secao_id "
+        f"WHERE s.indice = 'preparo' AND {SQL_RESPOSTA_VALIDA} {filtro} GROUP BY a.candidato_id, q.id",
+        params
+    )
+    recalcular_ipc(db, configs, candidato_ids)
+
+def reconstruir_indices_afinidade(db, configs, orientador_id=None):
+    filtro, params = ("WHERE a.orientador_id = ?", [orientador_id]) if orientador_id is not None else ("", [])
+    if orientador_id is not None:
+        db.execute("DELETE FROM indices_afinidade WHERE orientador_id = ?", (orientador_id,))
+    else:
+        db.execute("DELETE FROM indices_afinidade")
+    questionario = carregar_questionario(db)
+    notas = carregar_notas(db, filtro, params)
+    linhas = db.execute(f"SELECT a.id, a.orientador_id, a.candidato_id, {', '.join(f'o.{a}' for a in ATRIBUICOES)} FROM avaliacoes a JOIN orientadores o ON o.id = a.orientador_id {filtro}", params)
+    db.executemany(
+        "INSERT INTO indices_afinidade (avaliacao_id, orientador_id, candidato_id, iaoc) VALUES (?, ?, ?, ?)",
+        [(av['id'], av['orientador_id'], av['candidato_id'], calcular_iaoc(questionario, av, notas.get(av['id'], {}), configs)) for av in linhas.fetchall()]
+    )
+
+def reconstruir_indices(db, configs=None):
+    configs = configs if configs is not None else ler_configuracoes(db)
+    reconstruir_notas_curriculo(db, configs)
+    reconstruir_indices_afinidade(db, configs)
+
+# Atualização incremental após gravar uma avaliação: aplica a diferença entre as notas anteriores e as novas
+# ({questao_id: nota}) nas somas de currículo e recalcula apenas o IPc do candidato e o IAoc do par.
+def atualizar_indices_avaliacao(db, questionario, orientador, avaliacao_id, candidato_id, anterior, atual, configs):
+    preparo = [q for q in questionario.preparo if orientador[q['atribuicao']]]
+    for questao in preparo:
+        qid = questao['id']
+        delta_soma, delta_contagem = 0, 0
+        if qid in anterior:
+            delta_soma, delta_contagem = -anterior[qid], -1
+        if qid in atual:
+            delta_soma, delta_contagem = delta_soma + atual[qid], delta_contagem + 1
+        if delta_soma or delta_contagem:
+            db.execute(
+                "INSERT INTO notas_curriculo_agregadas (candidato_id, questao_id, soma, contagem) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(candidato_id, questao_id) DO UPDATE SET soma = soma + excluded.soma, contagem = contagem + excluded.contagem",
+                (candidato_id, questao['codigo'], delta_soma, delta_contagem)
+            )
+    if preparo:
+        recalcular_ipc(db, configs, [candidato_id])
+    db.execute(
+        "INSERT OR REPLACE INTO indices_afinidade (avaliacao_id, orientador_id, candidato_id, iaoc) VALUES (?, ?, ?, ?)",
+        (avaliacao_id, orientador['id'], candidato_id, calcular_iaoc(questionario, orientador, atual, configs))
+    )
+
+# --- GRAVAÇÃO DE AVALIAÇÕES ---
+# Usada tanto pelo formulário de um candidato como pela submissão em lote: valida as notas contra as secções do
+# orientador e grava as respostas de todas as avaliações com um único upsert, mantendo os índices na mesma transação.
+NOTAS_VALIDAS = (-2, -1, 0, 1, 2)
+
+def validar_notas(questionario, orientador, dados):
+    valores = {}
+    for codigo in (questao['codigo'] for questao in questionario.do_orientador(orientador)):
+        # Formulários trazem texto; lotes em JSON podem trazer números. int() truncaria 1.9 e aceitaria true.
+        bruto = dados.get(codigo)
+        if isinstance(bruto, bool) or (isinstance(bruto, float) and not bruto.is_integer()) or not isinstance(bruto, (str, int, float)):
+            raise ValueError(f"nota em falta ou inválida para a questão {codigo}")
+        try:
+            valor = int(bruto)
+        except ValueError:
+            raise ValueError(f"nota em falta ou inválida para a questão {codigo}")
+        if valor not in NOTAS_VALIDAS:
+            raise ValueError(f"a nota da questão {codigo} deve estar entre {NOTAS_VALIDAS[0]} e {NOTAS_VALIDAS[-1]}")
+        valores[codigo] = valor
+    return valores
+
+def gravar_avaliacoes(db, orientador, notas_por_candidato, configs):
+    # notas_por_candidato: {candidato_id: {codigo: nota}}, já validado. Devolve as notas anteriores
+    # ({candidato_id: {questao_id: nota}}) das avaliações que já existiam.
+    questionario = carregar_questionario(db)
+    candidato_ids = list(notas_por_candidato)
+    if not questionario.do_orientador(orientador) or not candidato_ids:
+        return {}
+    filtro, params = f"WHERE a.orientador_id = ? AND a.candidato_id IN ({', '.join('?' * len(candidato_ids))})", [orientador['id']] + candidato_ids
+    existentes = {row['candidato_id']: row['id'] for row in db.execute(f"SELECT a.id, a.candidato_id FROM avaliacoes a {filtro}", params)}
+    notas_anteriores = carregar_notas(db, filtro, params)
+    anteriores = {cid: notas_anteriores.get(aid, {}) for cid, aid in existentes.items()}
+    db.executemany("INSERT INTO avaliacoes (orientador_id, candidato_id) VALUES (?, ?)", [(orientador['id'], cid) for cid in candidato_ids if cid not in existentes])
+    ids = {row['candidato_id']: row['id'] for row in db.execute(f"SELECT a.id, a.candidato_id FROM avaliacoes a {filtro}", params)}
+    respostas = [(ids[cid], questionario.por_codigo[codigo]['id'], nota) for cid, notas in notas_por_candidato.items() for codigo, nota in notas.items()]
+    db.executemany(
+        "INSERT INTO respostas (avaliacao_id, questao_id, nota) VALUES (?, ?, ?) "
+        "ON CONFLICT(avaliacao_id, questao_id) DO UPDATE SET nota = excluded.nota",
+        respostas
+    )
+    atuais = defaultdict(dict)
+    for avaliacao_id, questao_id, nota in respostas:
+        atuais[avaliacao_id][questao_id] = nota
+    for cid, aid in ids.items():
+        atualizar_indices_avaliacao(db, questionario, orientador, aid, cid, anteriores.get(cid, {}), {**anteriores.get(cid, {}), **atuais[aid]}, configs)
+    return anteriores
+
+# --- ESCRITA EM GRUPO ---
+# Com ESCRITA_EM_GRUPO, as avaliações submetidas no portal deixam de abrir cada uma a sua transação (que disputa o
+# bloqueio de escrita do SQLite com as restantes e faz um fsync por avaliação). Entram numa fila e uma única thread
+# por processo seletivo, em cada worker, grava-as em grupos: tudo o que estiver na fila (até ESCRITA_GRUPO_MAX_TAMANHO)
+# numa só transação, com um único commit. Enquanto um grupo é gravado, as novas submissões acumulam-se para o
+# seguinte, pelo que os grupos crescem com o número de avaliadores em simultâneo. Cada submissão corre num SAVEPOINT
+# próprio: um erro desfaz apenas essa submissão e é devolvido ao pedido respetivo. O pedido espera pelo commit (a
+# avaliação está gravada quando recebe a resposta), no máximo ESCRITA_GRUPO_TIMEOUT_S. Se a submissão ainda estiver
+# na fila, é retirada e o pedido recebe 503, como num "database is locked" (nada foi gravado, pode repetir). Se já
+# estiver a ser gravada, o pedido continua à espera do fim do grupo; só se nem assim terminar recebe 504, com o
+# resultado dado como desconhecido.
+class FilaEscritaOcupada(Exception):
+    pass
+
+class EscritaIncerta(Exception):
+    pass
+
+class FilaEscrita:
+    def __init__(self, processo):
+        self.processo = processo
+        self.fila = queue.Queue(maxsize=app.config['ESCRITA_GRUPO_MAX_FILA'])
+        threading.Thread(target=self.executar, name=f"escrita-{processo or 'principal'}", daemon=True).start()
+
+    def submeter(self, escrita):
+        prazo = time.monotonic() + app.config['ESCRITA_GRUPO_TIMEOUT_S']
+        futuro = Future()
+        try:
+            self.fila.put((escrita, futuro), timeout=app.config['ESCRITA_GRUPO_TIMEOUT_S'])
+        except queue.Full:
+            raise FilaEscritaOcupada("fila de escrita cheia")
+        try:
+            return futuro.result(timeout=max(0, prazo - time.monotonic()))
+        except FutureTimeoutError:  # antes do Python 3.11 não é o TimeoutError embutido
+            # Ainda na fila: o escritor ignora os futuros cancelados, pelo que a submissão não chega a ser gravada.
+            if futuro.cancel():
+                raise FilaEscritaOcupada("tempo de espera pela gravação esgotado")
+        # Já faz parte de um grupo em gravação: o grupo termina (commit ou erro) dentro do busy_timeout do SQLite.
+        try:
+            return futuro.result(timeout=app.config['SQLITE_BUSY_TIMEOUT'] / 1000 + app.config['ESCRITA_GRUPO_TIMEOUT_S'])
+        except FutureTimeoutError:
+            raise EscritaIncerta("a gravação começou mas não terminou a tempo")
+
+    def executar(self):
+        while True:
+            grupo = [self.fila.get()]
+            limite = time.monotonic() + app.config['ESCRITA_GRUPO_ESPERA_MS'] / 1000
+            while len(grupo) < app.config['ESCRITA_GRUPO_MAX_TAMANHO']:
+                try:
+                    grupo.append(self.fila.get(timeout=limite - time.monotonic()) if limite > time.monotonic() else self.fila.get_nowait())
+                except queue.Empty:
+                    break
+            grupo = [(escrita, futuro) for escrita, futuro in grupo if futuro.set_running_or_notify_cancel()]
+            if grupo:
+                self.gravar(grupo)
+
+    def gravar(self, grupo):
+        resultados = []
+        try:
+            with app.app_context():
+                g.processo = self.processo
+                db = get_db()
+                db.execute("BEGIN IMMEDIATE")
+                for escrita, futuro in grupo:
+                    db.execute("SAVEPOINT submissao")
+                    try:
+                        resultados.append((futuro, escrita(db), None))
+                    except Exception as e:
+                        db.execute("ROLLBACK TO submissao")
+                        resultados.append((futuro, None, e))
+                    db.execute("RELEASE submissao")
+                db.commit()
+        except Exception as e:
+            # A transação do grupo falhou (ex.: "database is locked" no BEGIN ou no COMMIT): falham todas as submissões.
+            for _, futuro in grupo:
+                futuro.set_exception(e)
+            return
+        if app.config['METRICAS']:
+            METRICAS.observar('sasac_escrita_grupo_tamanho', {}, len(grupo))
+        for futuro, valor, erro in resultados:
+            if erro is None:
+                futuro.set_result(valor)
+            else:
+                futuro.set_exception(erro)
+
+_FILAS_ESCRITA = {}
+_TRAVA_FILAS_ESCRITA = threading.Lock()
+
+# Uma fila por processo seletivo e por processo do sistema (as threads não sobrevivem a um fork).
+def escrever_em_grupo(escrita):
+    chave = (os.getpid(), g.get('processo'))
+    with _TRAVA_FILAS_ESCRITA:
+        if chave not in _FILAS_ESCRITA:
+            _FILAS_ESCRITA[chave] = FilaEscrita(g.get('processo'))
+        fila = _FILAS_ESCRITA[chave]
+    return fila.submeter(escrita)
+
+# Gravação das avaliações do portal: pela fila de escrita em grupo ou, sem ela, numa transação própria.
+def gravar_avaliacoes_submetidas(db, orientador, notas_por_candidato):
+    configs = ler_configuracoes(db)
+    if app.config['ESCRITA_EM_GRUPO']:
+        return escrever_em_grupo(lambda conexao: gravar_avaliacoes(conexao, orientador, notas_por_candidato, configs))
+    anteriores = gravar_avaliacoes(db, orientador, notas_por_candidato, configs)
+    db.commit()
+    return anteriores
+
+# --- HISTÓRICO DE EXECUÇÕES DA ALOCAÇÃO ---
+# Cada execução fica registada na base de dados (e não na memória do processo), para que todos os workers
+# mostrem o mesmo relatório e para que execuções diferentes possam ser comparadas.
+SCHEMA_EXECUCOES_SQL = """
+CREATE TABLE IF NOT EXISTS execucoes_alocacao (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    criada_em TEXT NOT NULL,
+    data_processamento TEXT NOT NULL,
+    configs_usadas TEXT NOT NULL,
+    motor TEXT NOT NULL,
+    modo_alocacao TEXT NOT NULL,
+    tempo_alocacao_ms REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS execucao_orientadores (
+    execucao_id INTEGER NOT NULL,
+    orientador_id INTEGER NOT NULL,
+    nome TEXT NOT NULL,
+    vagas INTEGER NOT NULL,
+    PRIMARY KEY (execucao_id, orientador_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS execucao_pontuacoes (
+    execucao_id INTEGER NOT NULL,
+    candidato_id INTEGER NOT NULL,
+    orientador_id INTEGER NOT NULL,
+    ipc REAL NOT NULL,
+    iaoc REAL NOT NULL,
+    bonus REAL NOT NULL,
+    pontuacao_final REAL NOT NULL,
+    PRIMARY KEY (execucao_id, candidato_id, orientador_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS execucao_alocacoes (
+    execucao_id INTEGER NOT NULL,
+    candidato_id INTEGER NOT NULL,
+    nome_candidato TEXT NOT NULL,
+    orientador_id INTEGER,
+    posicao INTEGER,
+    PRIMARY KEY (execucao_id, candidato_id)
+) WITHOUT ROWID;
+"""
+
+# --- MIGRAÇÕES DO ESQUEMA ---
+# --- CONTADORES DE VERSÃO ---
+# Mantidos por triggers, na mesma transação de cada escrita em configuracoes. A tabela não é apagada pelo
+# init-db e começa num valor aleatório, para que uma base recriada no mesmo caminho não repita versões já em cache.
+SCHEMA_VERSOES_SQL = """
+CREATE TABLE IF NOT EXISTS contadores_versao ( nome TEXT PRIMARY KEY, versao INTEGER NOT NULL );
+INSERT OR IGNORE INTO contadores_versao (nome, versao) VALUES ('configuracoes', abs(random() % 1000000000));
+CREATE TRIGGER IF NOT EXISTS configuracoes_versao_insert AFTER INSERT ON configuracoes
+BEGIN UPDATE contadores_versao SET versao = versao + 1 WHERE nome = 'configuracoes'; END;
+CREATE TRIGGER IF NOT EXISTS configuracoes_versao_update AFTER UPDATE ON configuracoes
+BEGIN UPDATE contadores_versao SET versao = versao + 1 WHERE nome = 'configuracoes'; END;
+CREATE TRIGGER IF NOT EXISTS configuracoes_versao_delete AFTER DELETE ON configuracoes
+BEGIN UPDATE contadores_versao SET versao = versao + 1 WHERE nome = 'configuracoes'; END;
+"""
+
+def incrementar_versao_configuracoes(db):
+    # O init-db recria a tabela configuracoes (e os seus triggers) antes de as migrações voltarem a correr.
+    db.execute("UPDATE contadores_versao SET versao = versao + 1 WHERE nome = 'configuracoes'")
+
+# --- TAREFAS DE ALOCAÇÃO ---
+# A alocação corre numa thread do worker e não dentro do pedido HTTP, para não ultrapassar o timeout do servidor.
+# O estado de cada tarefa fica na tabela tarefas_alocacao (partilhada por todos os workers) e o índice único
+# parcial garante que só existe uma tarefa ativa de cada vez.
+SCHEMA_TAREFAS_SQL = """
+CREATE TABLE IF NOT EXISTS tarefas_alocacao (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    estado TEXT NOT NULL,
+    fase TEXT,
+    progresso REAL NOT NULL DEFAULT 0,
+    modo_alocacao TEXT NOT NULL,
+    motor TEXT,
+    pid INTEGER NOT NULL,
+    criada_em REAL NOT NULL,
+    iniciada_em REAL,
+    terminada_em REAL,
+    execucao_id INTEGER,
+    mensagem TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_tarefas_alocacao_ativa ON tarefas_alocacao ((0)) WHERE estado IN ('pendente', 'em_execucao');
+"""
+# --- PREFERÊNCIAS ORDENADAS ---
+# Cada candidato ordena os orientadores que indicou (ordem 1 = preferido). Cada execução guarda a ordem que o
+# candidato deu ao orientador obtido e o número de pares bloqueantes da alocação.
+SCHEMA_PREFERENCIAS_ORDENADAS_SQL = """
+ALTER TABLE preferencias_candidatos ADD COLUMN ordem INTEGER;
+ALTER TABLE execucao_alocacoes ADD COLUMN ordem_preferencia INTEGER;
+ALTER TABLE execucoes_alocacao ADD COLUMN pares_bloqueantes INTEGER;
+"""
+
+def numerar_preferencias(db):
+    # As preferências anteriores não tinham ordem: ficam numeradas pelo id do orientador.
+    db.execute(
+        "UPDATE preferencias_candidatos SET ordem = (SELECT COUNT(*) FROM preferencias_candidatos p "
+        "WHERE p.candidato_id = preferencias_candidatos.candidato_id AND p.orientador_id <= preferencias_candidatos.orientador_id) "
+        "WHERE ordem IS NULL"
+    )
+
+# --- VERSÃO DOS DADOS ---
+# Contador incrementado por triggers a cada escrita nas tabelas que as páginas com ETag mostram (uma nova execução
+# da alocação conta como escrita em execucoes_alocacao). Tal como o contador das configurações, começa num valor
+# aleatório e não é apagado pelo init-db.
+TABELAS_VERSAO_DADOS = ('orientadores', 'candidatos', 'preferencias_candidatos', 'avaliacoes', 'configuracoes', 'execucoes_alocacao')
+def triggers_versao(contador, tabelas):
+    return f"INSERT OR IGNORE INTO contadores_versao (nome, versao) VALUES ('{contador}', abs(random() % 1000000000));\n" + "".join(
+        f"CREATE TRIGGER IF NOT EXISTS {tabela}_versao_{contador}_{operacao.lower()} AFTER {operacao} ON {tabela}\n"
+        f"BEGIN UPDATE contadores_versao SET versao = versao + 1 WHERE nome = '{contador}'; END;\n"
+        for tabela in tabelas for operacao in ('INSERT', 'UPDATE', 'DELETE')
+    )
+
+SCHEMA_VERSAO_DADOS_SQL = triggers_versao('dados', TABELAS_VERSAO_DADOS)
+
+def incrementar_versao_dados(db):
+    # Depois de um init-db, as páginas guardadas em cache pelos browsers deixam de ser válidas.
+    db.execute("UPDATE contadores_versao SET versao = versao + 1 WHERE nome = 'dados'")
+
+def ler_versao_dados(db):
+    return db.execute("SELECT versao FROM contadores_versao WHERE nome = 'dados'").fetchone()[0]
+
+# --- QUESTIONÁRIO NORMALIZADO ---
+# Migração 9: cria as tabelas do questionário (com o questionário padrão, se estiverem vazias), passa as notas das
+# antigas colunas s2_1..s4_2 de avaliacoes para a tabela respostas, remove essas colunas e reconstrói os índices.
+# O contador 'questionario' invalida a cache do questionário em todos os workers; as respostas contam como dados.
+SCHEMA_MIGRACAO_QUESTIONARIO_SQL = SCHEMA_QUESTIONARIO_SQL + triggers_versao('questionario', ('secoes', 'questoes')) + triggers_versao('dados', ('secoes', 'questoes', 'respostas'))
+
+def criar_secao(db, titulo, atribuicao, indice, ordem=None):
+    if ordem is None:
+        ordem = db.execute("SELECT COALESCE(MAX(ordem), 0) + 1 FROM secoes").fetchone()[0]
+    return db.execute("INSERT INTO secoes (titulo, atribuicao, indice, ordem) VALUES (?, ?, ?, ?)", (titulo, atribuicao, indice, ordem)).lastrowid
+
+def criar_questao(db, secao_id, codigo, texto, ordem=None):
+    if ordem is None:
+        ordem = db.execute("SELECT COALESCE(MAX(ordem), 0) + 1 FROM questoes WHERE secao_id = ?", (secao_id,)).fetchone()[0]
+    db.execute("INSERT OR IGNORE INTO configuracoes (chave, valor) VALUES (?, '1.0')", (codigo,))
+    return db.execute("INSERT INTO questoes (secao_id, codigo, texto, ordem) VALUES (?, ?, ?, ?)", (secao_id, codigo, texto, ordem)).lastrowid
+
+def migrar_questionario(db):
+    if not db.execute("SELECT 1 FROM secoes").fetchone():
+        for titulo, atribuicao, indice, questoes in QUESTIONARIO_PADRAO:
+            secao_id = criar_secao(db, titulo, atribuicao, indice)
+            for codigo, texto in questoes:
+                criar_questao(db, secao_id, codigo, texto)
+    colunas = {row['name'] for row in db.execute("PRAGMA table_info(avaliacoes)")}
+    for questao in db.execute("SELECT id, codigo FROM questoes ORDER BY id").fetchall():
+        if questao['codigo'] in colunas:
+            db.execute(f"INSERT OR IGNORE INTO respostas (avaliacao_id, questao_id, nota) SELECT id, ?, {questao['codigo']} FROM avaliacoes WHERE {questao['codigo']} IS NOT NULL", (questao['id'],))
+            db.execute(f"ALTER TABLE avaliacoes DROP COLUMN {questao['codigo']}")
+    reconstruir_indices(db)
+
+# Bases de dados criadas por versões anteriores são atualizadas com `flask upgrade-db` (o init-db também aplica todas
+# as migrações). A versão aplicada fica registada em PRAGMA user_version.
+MIGRACOES = [
+    (1, SCHEMA_INDICES_SQL, None),  # Os índices são preenchidos pela migração 9, já a partir da tabela respostas.
+    (2, SCHEMA_EXECUCOES_SQL, None),
+    (3, INDICES_SECUNDARIOS_SQL + """
+CREATE INDEX IF NOT EXISTS idx_indices_afinidade_orientador ON indices_afinidade (orientador_id);
+CREATE INDEX IF NOT EXISTS idx_indices_afinidade_candidato ON indices_afinidade (candidato_id);
+ANALYZE;
+""", None),
+    (4, "CREATE INDEX IF NOT EXISTS idx_execucao_alocacoes_orientador ON execucao_alocacoes (execucao_id, orientador_id, posicao);", None),
+    (5, SCHEMA_VERSOES_SQL, incrementar_versao_configuracoes),
+    (6, SCHEMA_TAREFAS_SQL, None),
+    (7, SCHEMA_PREFERENCIAS_ORDENADAS_SQL, numerar_preferencias),
+    (8, SCHEMA_VERSAO_DADOS_SQL, incrementar_versao_dados),
+    (9, SCHEMA_MIGRACAO_QUESTIONARIO_SQL, migrar_questionario),
+]
+
+VERSAO_ESQUEMA = MIGRACOES[-1][0]
+
+class EsquemaDesatualizado(click.ClickException):
+    pass
+
+def base_inicializada(db):
+    return db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'orientadores'").fetchone() is not None
+
+def versao_esquema(db):
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+# Os pedidos não migram a base de dados: com vários workers, a migração podia correr em dois ao mesmo tempo, e a
+# migração 9 copia dados e apaga colunas. Um esquema antigo é recusado até que se execute `flask upgrade-db`.
+def verificar_esquema(db):
+    if not base_inicializada(db):
+        return False  # Base de dados ainda não inicializada (flask init-db).
+    versao = versao_esquema(db)
+    if versao < VERSAO_ESQUEMA:
+        raise EsquemaDesatualizado(f"A base de dados {db.caminho} está na versão {versao} do esquema e esta versão da aplicação precisa da versão {VERSAO_ESQUEMA}. Execute \"flask upgrade-db\".")
+    return True
+
+# O executescript faz commit antes de correr o script: as instruções são executadas uma a uma, dentro da transação
+# da migração (sqlite3.complete_statement junta as que têm ';' no corpo, como os triggers).
+def executar_instrucoes(db, sql):
+    instrucao = ''
+    for parte in sql.split(';'):
+        instrucao += parte + ';'
+        if sqlite3.complete_statement(instrucao):
+            if instrucao.strip(' \t\r\n;'):
+                db.execute(instrucao)
+            instrucao = ''
+
+# Cada migração corre numa transação BEGIN IMMEDIATE: se falhar a meio, nada fica aplicado. A versão é lida de novo
+# depois de obtido o bloqueio de escrita, pelo que uma migração já aplicada por outro processo não corre segunda vez.
+def atualizar_esquema(db):
+    if not base_inicializada(db):
+        return False
+    for numero, sql, preencher in MIGRACOES:
+        if numero <= versao_esquema(db):
+            continue
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if numero > versao_esquema(db):
+                executar_instrucoes(db, sql)
+                if preencher:
+                    preencher(db)
+                db.execute(f"PRAGMA user_version = {numero}")
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+    return True
 
 def init_db_logic():
-    db = get_db()
+    db = conexao_processo()
     db.executescript(SCHEMA_SQL)
     cursor = db.cursor()
     cursor.execute("INSERT INTO configuracoes (chave, valor) VALUES ('peso_preparo', '0.5'), ('peso_afinidade', '0.5'), ('peso_preferencia_candidato', '0.5')")
-    for secao in QUESTIONARIO_ESTRUTURA.values():
-        for questao in secao:
-            cursor.execute("INSERT INTO configuracoes (chave, valor) VALUES (?, ?)", (questao['id'], '1.0'))
     db.commit()
+    # O questionário padrão (e o peso 1.0 de cada questão) é criado pela migração 9.
+    atualizar_esquema(db)
 
 @click.command('init-db')
 @with_appcontext
+@opcao_processo
 def init_db_command():
     init_db_logic()
     click.echo('Base de dados inicializada (tabelas criadas e configurações padrão inseridas).')
 
 app.cli.add_command(init_db_command)
 
-# --- 3. LÓGICA DE NEGÓCIO ---
-DADOS_SESSAO = { "alocacao_final": None, "nao_alocados": None, "todas_pontuacoes": None, "configs_usadas": None, "data_processamento": None }
+@click.command('upgrade-db')
+@with_appcontext
+@opcao_processo
+def upgrade_db_command():
+    db = conexao_processo()
+    if not atualizar_esquema(db):
+        click.echo('A base de dados ainda não foi inicializada. Execute "flask init-db".')
+        return
+    _ESQUEMAS_VERIFICADOS.discard(db.caminho)
+    click.echo(f"Esquema atualizado (versão {versao_esquema(db)}).")
 
-# ALTERADO: Lógica de alocação para guardar o detalhe completo do cálculo da nota.
-def executar_alocacao():
+app.cli.add_command(upgrade_db_command)
+
+# --- GESTÃO DO QUESTIONÁRIO ---
+# Secções e questões são dados: acrescentá-las não exige migração nem alterações aos motores de pontuação. Uma
+# nova questão começa com peso 1.0 e passa a ser pedida nos formulários; as avaliações já submetidas mantêm-se e
+# os índices só mudam com as respostas que lhe forem sendo dadas.
+@click.command('listar-questionario')
+@with_appcontext
+@opcao_processo
+def listar_questionario_command():
     db = get_db()
-    orientadores_raw = db.execute("SELECT * FROM orientadores").fetchall()
-    orientadores = {row['id']: dict(row) for row in orientadores_raw}
-    orientadores_com_vagas = {k: v for k, v in orientadores.items() if v['vagas'] > 0}
+    configs = ler_configuracoes(db)
+    for secao in carregar_questionario(db).secoes:
+        click.echo(f"[{secao['id']}] {secao['titulo']} (respondida por {secao['atribuicao']}, índice {secao['indice']})")
+        for questao in secao['questoes']:
+            click.echo(f"    {questao['codigo']} (peso {configs.get(questao['codigo'], 1.0):g}): {questao['texto']}")
 
-    candidatos = {row['id']: dict(row) for row in db.execute("SELECT * FROM candidatos").fetchall()}
-    avaliacoes = db.execute("SELECT * FROM avaliacoes").fetchall()
-    configs = {row['chave']: float(row['valor']) for row in db.execute("SELECT * FROM configuracoes").fetchall()}
-    peso_preparo_geral = configs.get('peso_preparo', 0.5)
-    peso_afinidade_geral = configs.get('peso_afinidade', 0.5)
-    bonus_preferencia_config = configs.get('peso_preferencia_candidato', 0.0)
+@click.command('adicionar-secao')
+@click.argument('titulo')
+@click.option('--atribuicao', type=click.Choice(ATRIBUICOES), required=True, help='Orientadores que respondem à secção.')
+@click.option('--indice', type=click.Choice(INDICES_QUESTOES), required=True, help='Índice para o qual contam as respostas.')
+@with_appcontext
+@opcao_processo
+def adicionar_secao_command(titulo, atribuicao, indice):
+    db = get_db()
+    try:
+        secao_id = criar_secao(db, titulo, atribuicao, indice)
+    except sqlite3.IntegrityError:
+        raise click.ClickException(f"Já existe uma secção com o título {titulo!r}.")
+    db.commit()
+    click.echo(f"Secção {secao_id} criada. Acrescente-lhe questões com: flask adicionar-questao {secao_id} CODIGO TEXTO")
 
-    preferencias_raw = db.execute("SELECT * FROM preferencias_candidatos").fetchall()
-    preferencias_candidatos = defaultdict(set)
-    for pref in preferencias_raw:
-        preferencias_candidatos[pref['candidato_id']].add(pref['orientador_id'])
+@click.command('adicionar-questao')
+@click.argument('secao_id', type=int)
+@click.argument('codigo')
+@click.argument('texto')
+@with_appcontext
+@opcao_processo
+def adicionar_questao_command(secao_id, codigo, texto):
+    db = get_db()
+    # O código é o nome do campo nos formulários e a chave do peso nas configurações.
+    if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', codigo):
+        raise click.BadParameter("use apenas letras, algarismos e _ (ex.: s4_3)", param_hint="'CODIGO'")
+    if not db.execute("SELECT 1 FROM secoes WHERE id = ?", (secao_id,)).fetchone():
+        raise click.ClickException(f"A secção {secao_id} não existe (ver flask listar-questionario).")
+    if db.execute("SELECT 1 FROM configuracoes WHERE chave = ? UNION ALL SELECT 1 FROM questoes WHERE codigo = ?", (codigo, codigo)).fetchone():
+        raise click.ClickException(f"O código {codigo!r} já está em uso.")
+    criar_questao(db, secao_id, codigo, texto)
+    db.commit()
+    click.echo(f"Questão {codigo} acrescentada à secção {secao_id} (peso 1.0).")
 
-    if not avaliacoes:
-        flash("Nenhuma avaliação foi submetida.", "warning")
-        return
+app.cli.add_command(listar_questionario_command)
+app.cli.add_command(adicionar_secao_command)
+app.cli.add_command(adicionar_questao_command)
 
-    now = datetime.now().astimezone()
-    offset_str = now.strftime('%z')
-    formatted_offset = f"{offset_str[:3]}:{offset_str[3:]}"
-    timestamp_str = now.strftime(f"%d/%m/%Y às %H:%M:%S (UTC{formatted_offset})")
+@click.command('criar-processo')
+@click.argument('nome')
+@with_appcontext
+def criar_processo_command(nome):
+    try:
+        criar_processo(nome)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Processo seletivo '{nome}' criado em {caminho_processo(nome)} (endereço /p/{nome}/).")
+
+@click.command('listar-processos')
+@with_appcontext
+def listar_processos_command():
+    click.echo(f"(principal)  {caminho_processo()}")
+    for nome in listar_processos():
+        click.echo(f"{nome}  {caminho_processo(nome)}")
+
+app.cli.add_command(criar_processo_command)
+app.cli.add_command(listar_processos_command)
+
+# --- IMPORTAÇÃO EM LOTE ---
+# Os ficheiros CSV (com cabeçalho) ou JSONL são lidos linha a linha e escritos em lotes com executemany, cada lote na
+# sua própria transação, para que a memória usada não dependa do tamanho do ficheiro. Só as chaves (ids e tokens) do
+# lote em curso ficam em memória: as dos lotes anteriores são procuradas na base de dados, pelos índices únicos.
+VALORES_VERDADEIROS = {'1', 'true', 'sim', 's', 'yes', 'y', 'x'}
+
+def ler_registos(caminho, formato=None):
+    formato = formato or ('jsonl' if caminho.lower().endswith(('.jsonl', '.ndjson')) else 'csv')
+    with open(caminho, newline='', encoding='utf-8-sig') as ficheiro:
+        if formato == 'csv':
+            yield from enumerate(csv.DictReader(ficheiro), start=2)
+            return
+        for linha, texto in enumerate(ficheiro, start=1):
+            if not texto.strip():
+                continue
+            try:
+                registo = json.loads(texto)
+            except json.JSONDecodeError as e:
+                registo = ValueError(f"JSON inválido ({e.msg})")
+            yield linha, registo
+
+def campo_texto(registo, campo):
+    valor = registo.get(campo)
+    if valor is None or not str(valor).strip():
+        raise ValueError(f"campo '{campo}' em falta")
+    return str(valor).strip()
+
+def campo_inteiro(registo, campo, padrao=None):
+    valor = registo.get(campo)
+    if valor is None or (isinstance(valor, str) and not valor.strip()):
+        if padrao is None:
+            raise ValueError(f"campo '{campo}' em falta")
+        return padrao
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f"campo '{campo}' não é um número inteiro: {valor!r}")
+
+def campo_booleano(registo, campo):
+    valor = registo.get(campo)
+    if isinstance(valor, str):
+        return 1 if valor.strip().lower() in VALORES_VERDADEIROS else 0
+    return 1 if valor else 0
+
+def proximo_id(db, tabela):
+    # Os ids são atribuídos aqui (e não pelo AUTOINCREMENT) para que as preferências possam ir no mesmo executemany.
+    return db.execute(
+        f"SELECT MAX(m) FROM (SELECT COALESCE(MAX(id), 0) AS m FROM {tabela} UNION ALL SELECT seq FROM sqlite_sequence WHERE name = ?)",
+        (tabela,)
+    ).fetchone()[0] + 1
+
+# Com --dry-run nada é gravado: as chaves dos lotes anteriores ficam na tabela temporária importacao_chaves.
+def chave_existente(db, estado, coluna, valor):
+    if valor in estado['lote'][coluna]:
+        return True
+    if db.execute(f"SELECT 1 FROM {estado['tabela']} WHERE {coluna} = ?", (valor,)).fetchone():
+        return True
+    return estado['simular'] and db.execute("SELECT 1 FROM temp.importacao_chaves WHERE coluna = ? AND valor = ?", (coluna, valor)).fetchone() is not None
+
+def atribuir_id(db, registo, estado):
+    if registo.get('id') not in (None, ''):
+        novo_id = campo_inteiro(registo, 'id')
+        if chave_existente(db, estado, 'id', novo_id):
+            raise ValueError(f"id {novo_id} já existe")
+    else:
+        while chave_existente(db, estado, 'id', estado['proximo_id']):
+            estado['proximo_id'] += 1
+        novo_id = estado['proximo_id']
+    estado['lote']['id'].add(novo_id)
+    return novo_id
 
-    DADOS_SESSAO['data_processamento'] = timestamp_str
-    DADOS_SESSAO['configs_usadas'] = configs
+def preparar_orientador(db, registo, estado):
+    nome = campo_texto(registo, 'nome')
+    vagas = campo_inteiro(registo, 'vagas', 0)
+    if vagas < 0:
+        raise ValueError("o número de vagas não pode ser negativo")
+    token = str(registo.get('token') or '').strip() or None
+    if token is not None and chave_existente(db, estado, 'token', token):
+        raise ValueError(f"token {token!r} já existe")
+    orientador_id = atribuir_id(db, registo, estado)
+    token = token or secrets.token_urlsafe(16)
+    estado['lote']['token'].add(token)
+    return {'linhas': [(orientador_id, nome, vagas, token, campo_booleano(registo, 'avalia_curriculo'), campo_booleano(registo, 'avalia_entrevista'), campo_booleano(registo, 'avalia_afinidade'))]}
+
+def escrever_orientadores(db, lote):
+    db.executemany(
+        "INSERT INTO orientadores (id, nome, vagas, token, avalia_curriculo, avalia_entrevista, avalia_afinidade) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (linha for item in lote for linha in item['linhas'])
+    )
+
+def preparar_candidato(db, registo, estado):
+    nome = campo_texto(registo, 'nome')
+    preferencias = registo.get('preferencias') or []
+    if isinstance(preferencias, str):
+        preferencias = [p for p in preferencias.replace(',', ';').split(';') if p.strip()]
+    elif not isinstance(preferencias, list):
+        raise ValueError("o campo 'preferencias' deve ser uma lista de ids de orientadores")
+    orientador_ids = []
+    for valor in preferencias:
+        orientador_id = campo_inteiro({'preferencias': valor}, 'preferencias')
+        if orientador_id not in estado['orientadores']:
+            raise ValueError(f"orientador {orientador_id} não existe")
+        if orientador_id not in orientador_ids:
+            orientador_ids.append(orientador_id)
+    candidato_id = atribuir_id(db, registo, estado)
+    # A posição na lista é a ordem de preferência (1 = preferido).
+    return {'linhas': [(candidato_id, nome)], 'preferencias': [(candidato_id, orientador_id, ordem) for ordem, orientador_id in enumerate(orientador_ids, 1)]}
+
+def escrever_candidatos(db, lote):
+    db.executemany("INSERT INTO candidatos (id, nome) VALUES (?, ?)", (linha for item in lote for linha in item['linhas']))
+    db.executemany("INSERT INTO preferencias_candidatos (candidato_id, orientador_id, ordem) VALUES (?, ?, ?)", (par for item in lote for par in item['preferencias']))
+
+def importar_em_lotes(db, registos, preparar, escrever, estado, tamanho_lote, simular):
+    lote, importados, erros = [], 0, 0
+    inicio = time.perf_counter()
+    def gravar_lote():
+        if simular:
+            db.executemany("INSERT INTO temp.importacao_chaves (coluna, valor) VALUES (?, ?)",
+                           ((coluna, valor) for coluna, valores in estado['lote'].items() for valor in valores))
+        else:
+            # As chaves já foram verificadas, mas outra escrita pode ter chegado entre a verificação e o lote.
+            try:
+                escrever(db, lote)
+            except sqlite3.IntegrityError as e:
+                db.rollback()
+                raise click.ClickException(f"Linhas {lote[0]['linha']} a {lote[-1]['linha']}: {e}. O lote não foi gravado; {importados} registo(s) já importados em lotes anteriores.")
+        db.commit()
+        for valores in estado['lote'].values():
+            valores.clear()
+    for linha, registo in registos:
+        try:
+            if isinstance(registo, Exception):
+                raise registo
+            if not isinstance(registo, dict):
+                raise ValueError("cada linha deve ser um objeto JSON")
+            item = preparar(db, registo, estado)
+            item['linha'] = linha
+        except ValueError as e:
+            erros += 1
+            if not simular:
+                db.rollback()
+                raise click.ClickException(f"Linha {linha}: {e}. {importados} registo(s) já importados em lotes anteriores; use --dry-run para validar o ficheiro completo.")
+            click.echo(f"Linha {linha}: {e}", err=True)
+            continue
+        lote.append(item)
+        if len(lote) >= tamanho_lote:
+            gravar_lote()
+            importados += len(lote)
+            lote = []
+    if lote:
+        gravar_lote()
+    importados += len(lote)
+    return importados, erros, time.perf_counter() - inicio
+
+def executar_importacao(ficheiro, formato, tamanho_lote, simular, preparar, escrever, estado):
+    db = get_db()
+    estado['simular'] = simular
+    if simular:
+        db.execute("CREATE TEMP TABLE IF NOT EXISTS importacao_chaves (coluna TEXT NOT NULL, valor NOT NULL, PRIMARY KEY (coluna, valor)) WITHOUT ROWID")
+        db.execute("DELETE FROM temp.importacao_chaves")
+    try:
+        importados, erros, duracao = importar_em_lotes(db, ler_registos(ficheiro, formato), preparar, escrever, estado, tamanho_lote, simular)
+    finally:
+        if simular:
+            db.rollback()
+            db.execute("DROP TABLE IF EXISTS temp.importacao_chaves")
+    taxa = importados / duracao if duracao > 0 else 0
+    if simular:
+        click.echo(f"Validação concluída: {importados} registo(s) válidos, {erros} com erros ({taxa:.0f} linhas/s). Nada foi gravado.")
+        if erros:
+            raise click.exceptions.Exit(1)
+    else:
+        click.echo(f"{importados} registo(s) importados em {duracao:.2f} s ({taxa:.0f} linhas/s).")
+
+def opcoes_importacao(comando):
+    comando = click.option('--dry-run', 'simular', is_flag=True, help='Apenas valida o ficheiro e as referências, sem gravar.')(comando)
+    comando = click.option('--lote', 'tamanho_lote', default=1000, show_default=True, type=click.IntRange(min=1), help='Registos por transação.')(comando)
+    comando = click.option('--formato', type=click.Choice(['csv', 'jsonl']), default=None, help='Por omissão, deduzido da extensão do ficheiro.')(comando)
+    return click.argument('ficheiro', type=click.Path(exists=True, dir_okay=False))(comando)
+
+# Colunas: nome, vagas, avalia_curriculo, avalia_entrevista, avalia_afinidade e, opcionalmente, id e token.
+@click.command('import-orientadores')
+@opcoes_importacao
+@with_appcontext
+@opcao_processo
+def import_orientadores_command(ficheiro, formato, tamanho_lote, simular):
+    db = get_db()
+    estado = {
+        'tabela': 'orientadores',
+        'lote': {'id': set(), 'token': set()},
+        'proximo_id': proximo_id(db, 'orientadores'),
+    }
+    executar_importacao(ficheiro, formato, tamanho_lote, simular, preparar_orientador, escrever_orientadores, estado)
+
+# Colunas: nome, preferencias (ids de orientadores separados por ';' no CSV, ou uma lista no JSONL) e, opcionalmente, id.
+@click.command('import-candidatos')
+@opcoes_importacao
+@with_appcontext
+@opcao_processo
+def import_candidatos_command(ficheiro, formato, tamanho_lote, simular):
+    db = get_db()
+    estado = {
+        'tabela': 'candidatos',
+        'lote': {'id': set()},
+        'orientadores': {row['id'] for row in db.execute("SELECT id FROM orientadores")},
+        'proximo_id': proximo_id(db, 'candidatos'),
+    }
+    executar_importacao(ficheiro, formato, tamanho_lote, simular, preparar_candidato, escrever_candidatos, estado)
+
+app.cli.add_command(import_orientadores_command)
+app.cli.add_command(import_candidatos_command)
+
+# --- 3. LÓGICA DE NEGÓCIO ---
+# Pontuações dos pares em colunas (struct of arrays): cada coluna é um array tipado (8 bytes por par) em vez de um
+# dicionário com um dicionário de detalhes por par. As estratégias de alocação trabalham sobre os índices dos pares;
+# par[i] devolve uma vista leve, com os mesmos campos que os dicionários usavam.
+class PontuacoesPares:
+    COLUNAS = (('id_candidato', 'q'), ('id_orientador', 'q'), ('ipc', 'd'), ('iaoc', 'd'), ('bonus', 'd'), ('pontuacao_final', 'd'))
+
+    def __init__(self, peso_preparo=0.5, peso_afinidade=0.5):
+        self.peso_preparo, self.peso_afinidade = peso_preparo, peso_afinidade
+        for nome, tipo in self.COLUNAS:
+            setattr(self, nome, array(tipo))
+
+    @classmethod
+    def de_colunas(cls, peso_preparo, peso_afinidade, **colunas):
+        # Aceita listas ou vetores NumPy (copiados em bloco, sem passar por objetos Python).
+        pares = cls(peso_preparo, peso_afinidade)
+        for nome, tipo in cls.COLUNAS:
+            valores = colunas[nome]
+            if np is not None and isinstance(valores, np.ndarray):
+                getattr(pares, nome).frombytes(np.ascontiguousarray(valores, dtype=np.int64 if tipo == 'q' else np.float64).tobytes())
+            else:
+                getattr(pares, nome).extend(valores)
+        return pares
+
+    def acrescentar(self, cid, oid, ipc, iaoc, bonus, pontuacao_final):
+        self.id_candidato.append(cid)
+        self.id_orientador.append(oid)
+        self.ipc.append(ipc)
+        self.iaoc.append(iaoc)
+        self.bonus.append(bonus)
+        self.pontuacao_final.append(pontuacao_final)
+
+    def __len__(self):
+        return len(self.id_candidato)
+
+    def __getitem__(self, i):
+        return ParPontuado(self, i)
+
+    def __iter__(self):
+        return (ParPontuado(self, i) for i in range(len(self)))
+
+    # Linhas (candidato, orientador, ipc, iaoc, bónus, pontuação final), pela ordem dos pares.
+    def linhas(self):
+        return zip(*(getattr(self, nome) for nome, _ in self.COLUNAS))
+
+    # Índices dos pares por pontuação decrescente; em empate, mantém-se a ordem original.
+    def ordem_decrescente(self, indices=None):
+        return sorted(range(len(self)) if indices is None else indices, key=self.pontuacao_final.__getitem__, reverse=True)
+
+    def nbytes(self):
+        return sum(coluna.itemsize * len(coluna) for coluna in (getattr(self, nome) for nome, _ in self.COLUNAS))
+
+class ParPontuado:
+    __slots__ = ('pares', 'i')
+
+    def __init__(self, pares, i):
+        self.pares, self.i = pares, i
+
+    def __getattr__(self, nome):
+        if nome == 'detalhes':
+            pares, i = self.pares, self.i
+            return {'ipc': pares.ipc[i], 'iaoc': pares.iaoc[i], 'peso_preparo': pares.peso_preparo, 'peso_afinidade': pares.peso_afinidade, 'bonus': pares.bonus[i]}
+        if nome in ('id_candidato', 'id_orientador', 'ipc', 'iaoc', 'bonus', 'pontuacao_final'):
+            return getattr(self.pares, nome)[self.i]
+        raise AttributeError(nome)
+
+    __getitem__ = __getattr__
+
+def carregar_dados_alocacao(db):
+    orientadores = {row['id']: dict(row) for row in db.execute("SELECT * FROM orientadores").fetchall()}
+    candidatos = {row['id']: dict(row) for row in db.execute("SELECT * FROM candidatos").fetchall()}
+    configs = ler_configuracoes(db)
+    return orientadores, candidatos, configs, carregar_preferencias(db)
+
+# {candidato: {orientador: ordem}}, com a ordem renumerada a partir de 1 (remover um orientador deixa lacunas).
+def carregar_preferencias(db):
+    preferencias_candidatos = defaultdict(dict)
+    for pref in db.execute("SELECT candidato_id, orientador_id FROM preferencias_candidatos ORDER BY candidato_id, ordem, orientador_id").fetchall():
+        preferencias = preferencias_candidatos[pref['candidato_id']]
+        preferencias[pref['orientador_id']] = len(preferencias) + 1
+    return preferencias_candidatos
+
+# Motor de referência: percorre as respostas uma a uma (uma linha por avaliação e questão). Os restantes motores
+# têm de produzir exatamente os mesmos resultados (ver flask comparar-motores).
+def calcular_pontuacoes_python(db, orientadores, configs, preferencias_candidatos):
+    questionario = carregar_questionario(db)
+    avaliacoes = db.execute("SELECT id, orientador_id, candidato_id FROM avaliacoes").fetchall()
+    notas = carregar_notas(db)
+    orientadores_com_vagas = {k: v for k, v in orientadores.items() if v['vagas'] > 0}
+    peso_preparo_geral = configs.get('peso_preparo', 0.5)
+    peso_afinidade_geral = configs.get('peso_afinidade', 0.5)
+    bonus_preferencia_config = configs.get('peso_preferencia_candidato', 0.0)
 
     notas_curriculo_por_candidato = defaultdict(lambda: defaultdict(list))
     for av in avaliacoes:
-        oid = av['orientador_id']
-        if orientadores.get(oid) and orientadores[oid]['avalia_curriculo']:
-            cid = av['candidato_id']
-            if av['s2_1'] is not None: notas_curriculo_por_candidato[cid]['s2_1'].append(av['s2_1'])
-            if av['s2_2'] is not None: notas_curriculo_por_candidato[cid]['s2_2'].append(av['s2_2'])
+        orientador = orientadores.get(av['orientador_id'])
+        if not orientador:
+            continue
+        for qid, nota in notas.get(av['id'], {}).items():
+            questao = questionario.por_id.get(qid)
+            if questao and questao['indice'] == 'preparo' and orientador[questao['atribuicao']]:
+                notas_curriculo_por_candidato[av['candidato_id']][qid].append(nota)
 
+    marcar_fase('ipc')
     ipc_por_candidato = {}
-    for cid, notas in notas_curriculo_por_candidato.items():
+    for cid, notas_candidato in notas_curriculo_por_candidato.items():
         soma_ponderada_preparo, soma_pesos_preparo = 0, 0
-        questoes_curriculo = QUESTIONARIO_ESTRUTURA["II. Avaliação do Currículo"]
-        for questao in questoes_curriculo:
-            qid = questao['id']
-            if notas[qid]:
-                nota_media = mean(notas[qid])
-                peso = configs.get(qid, 1.0)
+        for questao in questionario.preparo:
+            if notas_candidato[questao['id']]:
+                nota_media = mean(notas_candidato[questao['id']])
+                peso = configs.get(questao['codigo'], 1.0)
                 soma_ponderada_preparo += nota_media * peso
                 soma_pesos_preparo += peso
         ipc_por_candidato[cid] = soma_ponderada_preparo / soma_pesos_preparo if soma_pesos_preparo > 0 else 0
 
-    pontuacoes = []
+    marcar_fase('iaoc')
+    pontuacoes = PontuacoesPares(peso_preparo_geral, peso_afinidade_geral)
     for avaliacao in avaliacoes:
         cid = avaliacao['candidato_id']
         oid = avaliacao['orientador_id']
         orientador_atual = orientadores.get(oid)
 
-        if not orientador_atual or oid not in orientadores_com_vagas:
-            continue
+        if not orientador_atual or oid not in orientadores_com_vagas:
+            continue
+
+        if cid not in ipc_por_candidato:
+            continue
+        
+        ip_c = ipc_por_candidato[cid]
+        ia_oc = calcular_iaoc(questionario, orientador_atual, notas.get(avaliacao['id'], {}), configs)
+
+        p_oc = (peso_preparo_geral * ip_c) + (peso_afinidade_geral * ia_oc)
+        
+        bonus_aplicado = 0
+        if oid in preferencias_candidatos.get(cid, set()):
+            p_oc += bonus_preferencia_config
+            bonus_aplicado = bonus_preferencia_config
+
+        pontuacoes.acrescentar(cid, oid, ip_c, ia_oc, bonus_aplicado, p_oc)
+    return pontuacoes
+
+# Motor vetorizado: um único núcleo para qualquer questionário. As respostas são carregadas em vetores (avaliação,
+# questão, nota) pela ordem da chave primária e as atribuições e os pesos de cada questão são aplicados por
+# indexação; as somas por célula (candidato, questão) e por avaliação são feitas com bincount, sem ciclos por
+# questão. O bincount acumula pela ordem das respostas, que é a ordem das questões dentro de cada candidato e de
+# cada avaliação, a partir de 0: os resultados são idênticos bit a bit aos do motor de referência (as médias de
+# inteiros são exatas em vírgula flutuante).
+def calcular_pontuacoes_numpy(db, orientadores, configs, preferencias_candidatos):
+    questionario = carregar_questionario(db)
+    avaliacoes = db.execute("SELECT id, candidato_id, orientador_id FROM avaliacoes ORDER BY id").fetchall()
+    peso_preparo_geral = configs.get('peso_preparo', 0.5)
+    peso_afinidade_geral = configs.get('peso_afinidade', 0.5)
+    if not avaliacoes or not orientadores or not questionario.questoes:
+        return PontuacoesPares(peso_preparo_geral, peso_afinidade_geral)
+    bonus_preferencia_config = configs.get('peso_preferencia_candidato', 0.0)
+
+    ids_avaliacoes, cids, oids = np.array([tuple(av) for av in avaliacoes], dtype=np.int64).T
+    # As respostas são muitas: lidas como tuplos simples (sem sqlite3.Row) e copiadas para o array de uma vez.
+    cursor = db.cursor()
+    cursor.row_factory = None
+    respostas = np.fromiter(itertools.chain.from_iterable(cursor.execute("SELECT avaliacao_id, questao_id, nota FROM respostas ORDER BY avaliacao_id, questao_id")), dtype=np.int64).reshape(-1, 3)
+
+    # Atributos do orientador de cada avaliação (orientadores inexistentes ficam com tudo a zero): vagas e uma
+    # coluna por atribuição, pela ordem de ATRIBUICOES.
+    ids_orientadores = np.array(sorted(orientadores), dtype=np.int64)
+    atributos = np.array([[orientadores[oid]['vagas'], *(orientadores[oid][a] for a in ATRIBUICOES)] for oid in ids_orientadores.tolist()], dtype=np.int64)
+    pos = np.searchsorted(ids_orientadores, oids).clip(0, len(ids_orientadores) - 1)
+    existe = ids_orientadores[pos] == oids
+    atrib = np.where(existe[:, None], atributos[pos], 0)
+    tem_vagas = atrib[:, 0] > 0
+
+    # Questões, pela ordem do id: coluna da atribuição em atrib, índice a que pertencem e peso.
+    ids_questoes = np.array([q['id'] for q in questionario.questoes], dtype=np.int64)
+    coluna_questao = np.array([1 + ATRIBUICOES.index(q['atribuicao']) for q in questionario.questoes], dtype=np.int64)
+    preparo_questao = np.array([q['indice'] == 'preparo' for q in questionario.questoes])
+    peso_questao = np.array([configs.get(q['codigo'], 1.0) for q in questionario.questoes], dtype=np.float64)
+
+    # Respostas que contam: avaliação e questão conhecidas e orientador com a atribuição da secção.
+    ai = np.searchsorted(ids_avaliacoes, respostas[:, 0]).clip(0, len(ids_avaliacoes) - 1)
+    qi = np.searchsorted(ids_questoes, respostas[:, 1]).clip(0, len(ids_questoes) - 1)
+    conta = (ids_avaliacoes[ai] == respostas[:, 0]) & (ids_questoes[qi] == respostas[:, 1])
+    conta[conta] = atrib[ai[conta], coluna_questao[qi[conta]]] != 0
+    ai, qi, nota = ai[conta], qi[conta], respostas[conta, 2].astype(np.float64)
+    preparo = preparo_questao[qi]
+
+    # IPc: soma e contagem por célula (candidato, questão), média de cada célula com notas e média ponderada por candidato.
+    marcar_fase('ipc')
+    ids_candidatos, cidx = np.unique(cids, return_inverse=True)
+    n_candidatos, n_questoes = len(ids_candidatos), len(ids_questoes)
+    celula = cidx[ai[preparo]] * n_questoes + qi[preparo]
+    contagem = np.bincount(celula, minlength=n_candidatos * n_questoes)
+    soma = np.bincount(celula, weights=nota[preparo], minlength=n_candidatos * n_questoes)
+    com_notas = np.flatnonzero(contagem)
+    candidato_celula, peso_celula = com_notas // n_questoes, peso_questao[com_notas % n_questoes]
+    soma_ponderada_preparo = np.bincount(candidato_celula, weights=(soma[com_notas] / contagem[com_notas]) * peso_celula, minlength=n_candidatos)
+    soma_pesos_preparo = np.bincount(candidato_celula, weights=peso_celula, minlength=n_candidatos)
+    tem_notas_curriculo = np.bincount(candidato_celula, minlength=n_candidatos) > 0
+    ipc = np.divide(soma_ponderada_preparo, soma_pesos_preparo, out=np.zeros(n_candidatos), where=soma_pesos_preparo > 0)
+
+    # IAoc: média ponderada das respostas de afinidade de cada avaliação.
+    marcar_fase('iaoc')
+    afinidade = ~preparo
+    peso_resposta = peso_questao[qi[afinidade]]
+    soma_ponderada_afinidade = np.bincount(ai[afinidade], weights=nota[afinidade] * peso_resposta, minlength=len(ids_avaliacoes))
+    soma_pesos_afinidade = np.bincount(ai[afinidade], weights=peso_resposta, minlength=len(ids_avaliacoes))
+    iaoc = np.divide(soma_ponderada_afinidade, soma_pesos_afinidade, out=np.zeros(len(ids_avaliacoes)), where=soma_pesos_afinidade > 0)
+
+    ipc_par = ipc[cidx]
+    pontuacao = (peso_preparo_geral * ipc_par) + (peso_afinidade_geral * iaoc)
+    pares_preferidos = np.array([(cid, oid) for cid, oids_pref in preferencias_candidatos.items() for oid in oids_pref], dtype=np.int64).reshape(-1, 2)
+    base = int(max(oids.max(), pares_preferidos[:, 1].max(initial=0))) + 1
+    preferido = np.isin(cids * base + oids, pares_preferidos[:, 0] * base + pares_preferidos[:, 1])
+    pontuacao = np.where(preferido, pontuacao + bonus_preferencia_config, pontuacao)
+    bonus = np.where(preferido, bonus_preferencia_config, 0.0)
+
+    validos = np.flatnonzero(existe & tem_vagas & tem_notas_curriculo[cidx])
+    return PontuacoesPares.de_colunas(
+        peso_preparo_geral, peso_afinidade_geral, id_candidato=cids[validos], id_orientador=oids[validos],
+        ipc=ipc_par[validos], iaoc=iaoc[validos], bonus=bonus[validos], pontuacao_final=pontuacao[validos]
+    )
+
+# Motor sobre os índices pré-calculados: lê uma linha por par (IPc e IAoc já agregados), pela ordem das avaliações,
+# e só aplica os pesos gerais e o bónus de preferência.
+def calcular_pontuacoes_indices(db, orientadores, configs, preferencias_candidatos):
+    peso_preparo_geral = configs.get('peso_preparo', 0.5)
+    peso_afinidade_geral = configs.get('peso_afinidade', 0.5)
+    bonus_preferencia_config = configs.get('peso_preferencia_candidato', 0.0)
+    pares = db.execute(
+        "SELECT ia.candidato_id, ia.orientador_id, ip.ipc, ia.iaoc FROM indices_afinidade ia "
+        "JOIN indices_preparo ip ON ip.candidato_id = ia.candidato_id "
+        "JOIN orientadores o ON o.id = ia.orientador_id WHERE o.vagas > 0 ORDER BY ia.avaliacao_id"
+    )
+    pontuacoes = PontuacoesPares(peso_preparo_geral, peso_afinidade_geral)
+    acrescentar = pontuacoes.acrescentar
+    for cid, oid, ip_c, ia_oc in pares:
+        p_oc = (peso_preparo_geral * ip_c) + (peso_afinidade_geral * ia_oc)
+        bonus_aplicado = 0
+        if oid in preferencias_candidatos.get(cid, ()):
+            p_oc += bonus_preferencia_config
+            bonus_aplicado = bonus_preferencia_config
+        acrescentar(cid, oid, ip_c, ia_oc, bonus_aplicado, p_oc)
+    return pontuacoes
+
+# Motor em SQL: as médias de currículo por candidato e questão, o IPc, as somas ponderadas de afinidade e o IAoc de
+# cada par são calculados pelo SQLite, a partir das respostas, das secções e das atribuições dos orientadores. Os
+# pesos das questões entram como uma tabela de valores (id da questão, peso) passada por parâmetros, pelo que a
+# consulta é a mesma para qualquer questionário com o mesmo número de questões. O Python recebe uma linha por par
+# pontuado, lida do cursor à medida que é produzida, e só aplica os pesos gerais e o bónus, como o motor indices.
+# As somas de vírgula flutuante são feitas em janelas ordenadas pelo id da questão, a ordem dos restantes motores, e
+# reduzidas a uma linha com GROUP BY: assim o SQLite cria um índice automático para as junções com preparo e afinidade.
+# (O SQLite 3.43 passou a usar soma compensada em SUM: aí, com três ou mais termos, o último bit pode diferir.)
+@lru_cache(maxsize=None)
+def montar_sql_pontuacoes(n_questoes):
+    return f"""
+WITH pesos (questao_id, peso) AS (VALUES {', '.join(['(?, ?)'] * n_questoes)}),
+validas AS (
+    SELECT a.id AS avaliacao_id, a.candidato_id, r.questao_id, r.nota, s.indice, p.peso
+    FROM avaliacoes a
+    CROSS JOIN orientadores o ON o.id = a.orientador_id
+    CROSS JOIN respostas r ON r.avaliacao_id = a.id
+    CROSS JOIN questoes q ON q.id = r.questao_id
+    CROSS JOIN secoes s ON s.id = q.secao_id
+    CROSS JOIN pesos p ON p.questao_id = q.id
+    WHERE {SQL_RESPOSTA_VALIDA}
+), medias AS (
+    SELECT candidato_id, questao_id, AVG(nota) AS media, peso FROM validas WHERE indice = 'preparo' GROUP BY candidato_id, questao_id
+), preparo AS (
+    SELECT candidato_id, MAX(soma) AS soma, MAX(pesos) AS pesos FROM (
+        SELECT candidato_id, SUM(media * peso) OVER janela AS soma, SUM(peso) OVER janela AS pesos
+        FROM medias
+        WINDOW janela AS (PARTITION BY candidato_id ORDER BY questao_id ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+    ) GROUP BY candidato_id
+), afinidade AS (
+    SELECT avaliacao_id, MAX(soma) AS soma, MAX(pesos) AS pesos FROM (
+        SELECT avaliacao_id, SUM(nota * peso) OVER janela AS soma, SUM(peso) OVER janela AS pesos
+        FROM validas WHERE indice = 'afinidade'
+        WINDOW janela AS (PARTITION BY avaliacao_id ORDER BY questao_id ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+    ) GROUP BY avaliacao_id
+)
+SELECT a.candidato_id, a.orientador_id,
+    CASE WHEN p.pesos > 0 THEN p.soma / p.pesos ELSE 0.0 END AS ipc,
+    CASE WHEN f.pesos > 0 THEN f.soma / f.pesos ELSE 0.0 END AS iaoc,
+    pc.candidato_id IS NOT NULL AS preferido
+FROM avaliacoes a
+CROSS JOIN orientadores o ON o.id = a.orientador_id
+CROSS JOIN preparo p ON p.candidato_id = a.candidato_id
+LEFT JOIN afinidade f ON f.avaliacao_id = a.id
+LEFT JOIN preferencias_candidatos pc ON pc.candidato_id = a.candidato_id AND pc.orientador_id = a.orientador_id
+WHERE o.vagas > 0
+ORDER BY a.id"""
+
+def parametros_pontuacoes_sql(questionario, configs):
+    return [valor for q in questionario.questoes for valor in (q['id'], float(configs.get(q['codigo'], 1.0)))]
+
+def calcular_pontuacoes_sql(db, orientadores, configs, preferencias_candidatos):
+    questionario = carregar_questionario(db)
+    peso_preparo_geral = configs.get('peso_preparo', 0.5)
+    peso_afinidade_geral = configs.get('peso_afinidade', 0.5)
+    bonus_preferencia_config = configs.get('peso_preferencia_candidato', 0.0)
+    pontuacoes = PontuacoesPares(peso_preparo_geral, peso_afinidade_geral)
+    if not questionario.questoes:
+        return pontuacoes
+    acrescentar = pontuacoes.acrescentar
+    for cid, oid, ip_c, ia_oc, preferido in db.execute(montar_sql_pontuacoes(len(questionario.questoes)), parametros_pontuacoes_sql(questionario, configs)):
+        p_oc = (peso_preparo_geral * ip_c) + (peso_afinidade_geral * ia_oc)
+        bonus_aplicado = 0
+        if preferido:
+            p_oc += bonus_preferencia_config
+            bonus_aplicado = bonus_preferencia_config
+        acrescentar(cid, oid, ip_c, ia_oc, bonus_aplicado, p_oc)
+    return pontuacoes
+
+MOTORES_PONTUACAO = {'python': calcular_pontuacoes_python, 'numpy': calcular_pontuacoes_numpy, 'indices': calcular_pontuacoes_indices, 'sql': calcular_pontuacoes_sql}
+
+def selecionar_motor_pontuacao(nome=None):
+    nome = nome or app.config['MOTOR_PONTUACAO']
+    if nome not in MOTORES_PONTUACAO:
+        raise ValueError(f"Motor de pontuação desconhecido: {nome}")
+    if nome == 'numpy' and np is None:
+        nome = 'python'
+    return nome, MOTORES_PONTUACAO[nome]
+
+# Alocação gulosa original: percorre os pares por ordem decrescente de pontuação e preenche as vagas.
+def alocar_guloso(pontuacoes, orientadores_com_vagas, preferencias_candidatos=None):
+    marcar_fase('ordenar')
+    ordem = pontuacoes.ordem_decrescente()
+    marcar_fase('atribuir')
+    candidatos_alocados_ids, vagas_preenchidas = set(), {o_id: 0 for o_id in orientadores_com_vagas}
+    ids_candidatos, ids_orientadores = pontuacoes.id_candidato, pontuacoes.id_orientador
+    escolhidos = []
+    for i in ordem:
+        id_c, id_o = ids_candidatos[i], ids_orientadores[i]
+        if id_o in orientadores_com_vagas and id_c not in candidatos_alocados_ids and vagas_preenchidas[id_o] < orientadores_com_vagas[id_o]["vagas"]:
+            escolhidos.append(i)
+            vagas_preenchidas[id_o] += 1
+            candidatos_alocados_ids.add(id_c)
+    return escolhidos
+
+# Alocação ótima: problema de afetação com capacidades resolvido como fluxo de custo mínimo, pelo método dos
+# caminhos mais curtos sucessivos (Dijkstra com potenciais), acrescentando um candidato de cada vez.
+# Cada candidato tem ainda a opção "não alocado" (nó fictício sem limite de vagas), o que permite trocas em que
+# um candidato já alocado cede o lugar. O custo de cada par é -pontuação: maximiza-se a soma das pontuações, e um
+# candidato fica por alocar se isso der uma soma maior (ex.: pontuações negativas, ou ceder o lugar a um candidato
+# com uma pontuação muito maior). Com priorizar_cobertura (modo 'otimo_cobertura'), o custo passa a -(pontuação + M),
+# com M maior do que qualquer diferença possível de pontuação total: primeiro maximiza-se o número de candidatos
+# alocados e, entre essas soluções, a soma das pontuações.
+# Um candidato já alocado só é alcançável a partir do seu orientador, pelo que a sua distância fica definitiva
+# quando o orientador sai da fila: os candidatos são expandidos diretamente e só os orientadores passam pelo heap.
+def alocar_otimo(pontuacoes, orientadores_com_vagas, preferencias_candidatos=None, priorizar_cobertura=False):
+    marcar_fase('atribuir')
+    ids_candidatos_par, ids_orientadores_par, notas_par = pontuacoes.id_candidato, pontuacoes.id_orientador, pontuacoes.pontuacao_final
+    pares = [i for i, oid in enumerate(ids_orientadores_par) if oid in orientadores_com_vagas]
+    if not pares:
+        return []
+    ids_candidatos = sorted({ids_candidatos_par[i] for i in pares})
+    ids_orientadores = sorted(orientadores_com_vagas)
+    n_c = len(ids_candidatos)
+    indice_c = {cid: i for i, cid in enumerate(ids_candidatos)}
+    indice_o = {oid: n_c + i for i, oid in enumerate(ids_orientadores)}
+    FICTICIO, SUMIDOURO = n_c + len(ids_orientadores), n_c + len(ids_orientadores) + 1
+    vagas = [0] * n_c + [orientadores_com_vagas[oid]['vagas'] for oid in ids_orientadores]
+
+    notas = [notas_par[i] for i in pares]
+    maior_ganho = min(n_c, sum(vagas))
+    M = maior_ganho * (max(notas) - min(notas)) + max(abs(max(notas)), abs(min(notas))) + 1.0 if priorizar_cobertura else 0.0
+
+    arestas = [dict() for _ in range(n_c)]  # candidato -> {orientador: (custo, índice do par)}
+    for i, p in enumerate(pares):
+        arestas[indice_c[ids_candidatos_par[p]]][indice_o[ids_orientadores_par[p]]] = (-(notas_par[p] + M), i)
+    vizinhos = [[(o, custo) for o, (custo, _) in a.items()] for a in arestas]
+
+    inf = float('inf')
+    potencial = [0.0] * (SUMIDOURO + 1)
+    distancia = [inf] * (SUMIDOURO + 1)
+    anterior = [-1] * (SUMIDOURO + 1)
+    atribuido = [-1] * n_c
+    custo_atribuido = [0.0] * n_c
+    alocados = [None] * n_c + [[] for _ in ids_orientadores]
+
+    # Candidatos com melhor pontuação primeiro: a maioria encontra vaga livre logo no primeiro passo.
+    ordem = sorted(range(n_c), key=lambda c: min(custo for _, custo in vizinhos[c]))
+    for origem in ordem:
+        potencial[origem] = max(0.0, max(potencial[o] - custo for o, custo in vizinhos[origem]))
+        distancia[origem] = 0.0
+        tocados, fila, limite = [origem], [], inf
+        pendentes = [(origem, 0.0)]
+        while True:
+            # Expansão dos candidatos com distância já definitiva.
+            for c, dc in pendentes:
+                if dc >= limite:
+                    continue
+                base, atual = dc + potencial[c], atribuido[c]
+                for o, custo in vizinhos[c]:
+                    nd = base + custo - potencial[o]
+                    if nd < distancia[o] and nd < limite and o != atual:
+                        if distancia[o] == inf:
+                            tocados.append(o)
+                        distancia[o] = nd
+                        anterior[o] = c
+                        heapq.heappush(fila, (nd, o))
+                if atual != FICTICIO and base < distancia[FICTICIO] and base < limite:
+                    if distancia[FICTICIO] == inf:
+                        tocados.append(FICTICIO)
+                    distancia[FICTICIO] = base
+                    anterior[FICTICIO] = c
+                    heapq.heappush(fila, (base, FICTICIO))
+            pendentes = []
+            if not fila:
+                break
+            d, u = heapq.heappop(fila)
+            if u == SUMIDOURO:
+                break
+            if d > distancia[u]:
+                continue
+            base = d + potencial[u]
+            if u == FICTICIO or len(alocados[u]) < vagas[u]:
+                if base < limite:
+                    if distancia[SUMIDOURO] == inf:
+                        tocados.append(SUMIDOURO)
+                    distancia[SUMIDOURO] = limite = base
+                    anterior[SUMIDOURO] = u
+                    heapq.heappush(fila, (base, SUMIDOURO))
+            if u != FICTICIO:
+                for c in alocados[u]:
+                    dc = base - custo_atribuido[c] - potencial[c]
+                    if dc < distancia[c]:
+                        if distancia[c] == inf:
+                            tocados.append(c)
+                        distancia[c] = dc
+                        anterior[c] = u
+                        pendentes.append((c, dc))
+
+        total = distancia[SUMIDOURO]
+        for v in tocados:
+            if distancia[v] < total:
+                potencial[v] -= total - distancia[v]
+
+        destino = anterior[SUMIDOURO]
+        while True:
+            c = anterior[destino]
+            saida = atribuido[c]
+            if saida >= 0 and saida != FICTICIO:
+                alocados[saida].remove(c)
+            atribuido[c] = destino
+            if destino != FICTICIO:
+                alocados[destino].append(c)
+                custo_atribuido[c] = arestas[c][destino][0]
+            if c == origem:
+                break
+            destino = saida
+
+        for v in tocados:
+            distancia[v] = inf
+
+    return pontuacoes.ordem_decrescente([pares[arestas[c][o][1]] for c, o in enumerate(atribuido) if o != FICTICIO])
+
+# Ordem de preferência do candidato: primeiro os orientadores que indicou, pela ordem indicada; depois os restantes
+# orientadores que o avaliaram, por pontuação decrescente. Quanto menor a chave, mais preferido.
+def chave_preferencia_candidato(pontuacoes, i, preferencias_candidatos):
+    oid = pontuacoes.id_orientador[i]
+    ordem = preferencias_candidatos.get(pontuacoes.id_candidato[i], {}).get(oid)
+    return (ordem if ordem is not None else float('inf'), -pontuacoes.pontuacao_final[i], oid)
+
+# Os orientadores ordenam os candidatos pela pontuação do par (em empate, o menor id). Quanto maior a chave, mais preferido.
+def chave_preferencia_orientador(pontuacoes, i):
+    return (pontuacoes.pontuacao_final[i], -pontuacoes.id_candidato[i])
+
+# Alocação estável: aceitação diferida (Gale-Shapley) com os candidatos a propor. Cada orientador mantém os aceites
+# num heap mínimo com tantas posições quantas as vagas, cujo topo é o pior aceite: uma proposta entra se houver
+# vaga ou se for melhor do que o topo, que é rejeitado e volta a propor. Cada par é proposto no máximo uma vez,
+# pelo que o custo é O(pares · log vagas), além da ordenação inicial das listas de cada candidato.
+def alocar_estavel(pontuacoes, orientadores_com_vagas, preferencias_candidatos=None):
+    preferencias_candidatos = preferencias_candidatos or {}
+    marcar_fase('ordenar')
+    ids_candidatos, ids_orientadores = pontuacoes.id_candidato, pontuacoes.id_orientador
+    listas = defaultdict(list)
+    for i, oid in enumerate(ids_orientadores):
+        if oid in orientadores_com_vagas:
+            listas[ids_candidatos[i]].append(i)
+    for lista in listas.values():
+        lista.sort(key=lambda i: chave_preferencia_candidato(pontuacoes, i, preferencias_candidatos), reverse=True)  # pop() devolve o preferido
+
+    marcar_fase('atribuir')
+    aceites = {oid: [] for oid in orientadores_com_vagas}
+    livres = sorted(listas, reverse=True)
+    while livres:
+        lista = listas[livres.pop()]
+        while lista:
+            i = lista.pop()
+            heap, vagas = aceites[ids_orientadores[i]], orientadores_com_vagas[ids_orientadores[i]]['vagas']
+            proposta = (chave_preferencia_orientador(pontuacoes, i), ids_candidatos[i], i)
+            if len(heap) < vagas:
+                heapq.heappush(heap, proposta)
+                break
+            if proposta[0] > heap[0][0]:
+                livres.append(heapq.heapreplace(heap, proposta)[1])
+                break
+
+    return pontuacoes.ordem_decrescente([i for heap in aceites.values() for _, _, i in heap])
+
+# Um par (candidato, orientador) é bloqueante se o candidato prefere esse orientador ao que obteve (ou não foi alocado)
+# e o orientador tem uma vaga livre ou prefere esse candidato ao pior que aceitou. A alocação estável não tem nenhum.
+def contar_pares_bloqueantes(pontuacoes, escolhidos, orientadores_com_vagas, preferencias_candidatos):
+    ids_candidatos, ids_orientadores = pontuacoes.id_candidato, pontuacoes.id_orientador
+    chave_obtida = {ids_candidatos[i]: chave_preferencia_candidato(pontuacoes, i, preferencias_candidatos) for i in escolhidos}
+    ocupacao, pior_aceite = defaultdict(int), {}
+    for i in escolhidos:
+        oid, chave = ids_orientadores[i], chave_preferencia_orientador(pontuacoes, i)
+        ocupacao[oid] += 1
+        pior_aceite[oid] = min(pior_aceite.get(oid, chave), chave)
+    bloqueantes = 0
+    for i, (cid, oid) in enumerate(zip(ids_candidatos, ids_orientadores)):
+        if oid not in orientadores_com_vagas:
+            continue
+        if cid in chave_obtida and chave_obtida[cid] <= chave_preferencia_candidato(pontuacoes, i, preferencias_candidatos):
+            continue
+        if ocupacao[oid] < orientadores_com_vagas[oid]['vagas'] or chave_preferencia_orientador(pontuacoes, i) > pior_aceite[oid]:
+            bloqueantes += 1
+    return bloqueantes
+
+# Cada estratégia recebe as pontuações (PontuacoesPares), os orientadores com vagas e as preferências ordenadas dos
+# candidatos ({candidato: {orientador: ordem}}), que só a alocação estável usa, e devolve os índices dos pares
+# escolhidos por pontuação decrescente.
+ESTRATEGIAS_ALOCACAO = {
+    'guloso': ('Guloso (maior pontuação primeiro)', alocar_guloso),
+    'otimo': ('Ótimo (fluxo de custo mínimo, maior soma das pontuações)', alocar_otimo),
+    'otimo_cobertura': ('Ótimo com cobertura (primeiro o maior número de alocados, depois a maior soma)', partial(alocar_otimo, priorizar_cobertura=True)),
+    'estavel': ('Estável (aceitação diferida, os candidatos propõem)', alocar_estavel),
+}
+
+# ALTERADO: Lógica de alocação para guardar o detalhe completo do cálculo da nota.
+# Devolve o id da execução gravada, ou None se ainda não houver avaliações. reportar(fase) é chamado no início de
+# cada fase (ver FASES_ALOCACAO), para acompanhar o progresso de uma tarefa em segundo plano.
+def executar_alocacao(db, motor=None, modo=None, reportar=None):
+    modo = modo or app.config['MODO_ALOCACAO']
+    if modo not in ESTRATEGIAS_ALOCACAO:
+        raise ValueError(f"Modo de alocação desconhecido: {modo}")
+    reportar = reportar or (lambda fase: None)
+    reportar('carregar')
+    marcar_fase('carregar', primeira=True)
+    orientadores, candidatos, configs, preferencias_candidatos = carregar_dados_alocacao(db)
+    orientadores_com_vagas = {k: v for k, v in orientadores.items() if v['vagas'] > 0}
+    candidatos_avaliados_ids = {row['candidato_id'] for row in db.execute("SELECT DISTINCT candidato_id FROM avaliacoes").fetchall()}
+
+    if not candidatos_avaliados_ids:
+        marcar_fase(None)
+        return None
+
+    now = datetime.now().astimezone()
+    offset_str = now.strftime('%z')
+    formatted_offset = f"{offset_str[:3]}:{offset_str[3:]}"
+    timestamp_str = now.strftime(f"%d/%m/%Y às %H:%M:%S (UTC{formatted_offset})")
+
+    reportar('pontuar')
+    marcar_fase('pontuar')
+    nome_motor, calcular_pontuacoes = selecionar_motor_pontuacao(motor)
+    pontuacoes = calcular_pontuacoes(db, orientadores, configs, preferencias_candidatos)
+
+    reportar('alocar')
+    descricao_modo, alocar = ESTRATEGIAS_ALOCACAO[modo]
+    inicio = time.perf_counter()
+    escolhidos = alocar(pontuacoes, orientadores_com_vagas, preferencias_candidatos)
+    tempo_alocacao_ms = (time.perf_counter() - inicio) * 1000
+    pares_bloqueantes = contar_pares_bloqueantes(pontuacoes, escolhidos, orientadores_com_vagas, preferencias_candidatos)
+
+    reportar('gravar')
+    marcar_fase('gravar')
+    cursor = db.execute(
+        "INSERT INTO execucoes_alocacao (criada_em, data_processamento, configs_usadas, motor, modo_alocacao, tempo_alocacao_ms, pares_bloqueantes) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (now.isoformat(), timestamp_str, json.dumps(configs), nome_motor, descricao_modo, tempo_alocacao_ms, pares_bloqueantes)
+    )
+    execucao_id = cursor.lastrowid
+    db.executemany(
+        "INSERT INTO execucao_orientadores (execucao_id, orientador_id, nome, vagas) VALUES (?, ?, ?, ?)",
+        [(execucao_id, oid, o['nome'], o['vagas']) for oid, o in orientadores_com_vagas.items()]
+    )
+    db.executemany(
+        "INSERT INTO execucao_pontuacoes (execucao_id, candidato_id, orientador_id, ipc, iaoc, bonus, pontuacao_final) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        ((execucao_id, *linha) for linha in pontuacoes.linhas())
+    )
+    ids_candidatos, ids_orientadores = pontuacoes.id_candidato, pontuacoes.id_orientador
+    alocados = {
+        ids_candidatos[i]: (ids_orientadores[i], posicao, preferencias_candidatos.get(ids_candidatos[i], {}).get(ids_orientadores[i]))
+        for posicao, i in enumerate(escolhidos)
+    }
+    db.executemany(
+        "INSERT INTO execucao_alocacoes (execucao_id, candidato_id, nome_candidato, orientador_id, posicao, ordem_preferencia) VALUES (?, ?, ?, ?, ?, ?)",
+        ((execucao_id, cid, candidatos[cid]["nome"], *alocados.get(cid, (None, None, None))) for cid in sorted(candidatos_avaliados_ids) if cid in candidatos)
+    )
+    db.commit()
+    marcar_fase(None)
+    return execucao_id
+
+# --- TAREFAS DE ALOCAÇÃO EM SEGUNDO PLANO ---
+# Fase: (descrição, progresso no início da fase).
+FASES_ALOCACAO = {
+    'carregar': ("A carregar orientadores, candidatos e configurações", 0.05),
+    'pontuar': ("A calcular as pontuações dos pares", 0.2),
+    'alocar': ("A alocar os candidatos às vagas", 0.6),
+    'gravar': ("A gravar a execução", 0.9),
+}
+
+def processo_ativo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+TENTATIVAS_ESTADO_FINAL = 3
+
+def libertar_tarefas_interrompidas(db):
+    # Tarefas ativas de um processo que já terminou (ex.: worker reiniciado a meio), ou ativas há mais de
+    # TAREFA_ALOCACAO_MAX_S (ex.: o estado final não chegou a ser gravado), deixam de bloquear novas execuções.
+    agora = time.time()
+    for tarefa in db.execute("SELECT id, pid, COALESCE(iniciada_em, criada_em) AS inicio FROM tarefas_alocacao WHERE estado IN ('pendente', 'em_execucao')").fetchall():
+        if not processo_ativo(tarefa['pid']):
+            mensagem = "Interrompida: o processo que a executava terminou."
+        elif agora - tarefa['inicio'] > app.config['TAREFA_ALOCACAO_MAX_S']:
+            mensagem = f"Interrompida: sem estado final ao fim de {app.config['TAREFA_ALOCACAO_MAX_S']} s."
+        else:
+            continue
+        db.execute("UPDATE tarefas_alocacao SET estado = 'falhou', terminada_em = ?, mensagem = ? WHERE id = ?", (agora, mensagem, tarefa['id']))
+
+def tarefa_alocacao_ativa(db):
+    libertar_tarefas_interrompidas(db)
+    db.commit()
+    return db.execute("SELECT id FROM tarefas_alocacao WHERE estado IN ('pendente', 'em_execucao')").fetchone()
+
+def criar_tarefa_alocacao(db, modo, motor=None):
+    libertar_tarefas_interrompidas(db)
+    try:
+        cursor = db.execute("INSERT INTO tarefas_alocacao (estado, modo_alocacao, motor, pid, criada_em) VALUES ('pendente', ?, ?, ?, ?)",
+                            (modo, motor, os.getpid(), time.time()))
+    except sqlite3.IntegrityError:
+        db.rollback()
+        return None
+    db.commit()
+    return cursor.lastrowid
+
+def executar_tarefa_alocacao(tarefa_id, modo, motor=None):
+    db = get_db()
+    # O estado da tarefa é gravado numa ligação própria, com commits independentes da transação da alocação.
+    db_tarefa = abrir_conexao(db.caminho)
+    def atualizar(**campos):
+        db_tarefa.execute(f"UPDATE tarefas_alocacao SET {', '.join(f'{campo} = ?' for campo in campos)} WHERE id = ?", [*campos.values(), tarefa_id])
+        db_tarefa.commit()
+    # O estado final não pode ficar por gravar: a tarefa continuaria 'em_execucao' e, com o worker vivo, o índice
+    # único recusaria todas as alocações seguintes. Se a gravação falhar (ex.: "database is locked" ou ligação
+    # fechada), tenta de novo numa ligação nova.
+    def terminar(**campos):
+        nonlocal db_tarefa
+        for tentativa in range(TENTATIVAS_ESTADO_FINAL):
+            try:
+                if tentativa:
+                    time.sleep(0.5 * tentativa)
+                    db_tarefa.close()
+                    db_tarefa = abrir_conexao(db.caminho)
+                atualizar(**campos)
+                return
+            except sqlite3.Error:
+                app.logger.exception("Falha ao gravar o estado final da tarefa de alocação #%s (tentativa %s)", tarefa_id, tentativa + 1)
+    try:
+        atualizar(estado='em_execucao', iniciada_em=time.time())
+        execucao_id = executar_alocacao(db, motor, modo, reportar=lambda fase: atualizar(fase=fase, progresso=FASES_ALOCACAO[fase][1]))
+    except Exception as e:
+        app.logger.exception("Falha na tarefa de alocação #%s", tarefa_id)
+        try:
+            db.rollback()  # liberta o bloqueio de escrita antes de gravar o estado na outra ligação
+        except sqlite3.Error:
+            pass
+        terminar(estado='falhou', terminada_em=time.time(), mensagem=str(e) or type(e).__name__)
+        return None
+    else:
+        terminar(estado='concluida', fase=None, progresso=1.0, terminada_em=time.time(), execucao_id=execucao_id,
+                 mensagem=None if execucao_id else "Nenhuma avaliação foi submetida.")
+        return execucao_id
+    finally:
+        db_tarefa.close()
+
+def iniciar_tarefa_alocacao(tarefa_id, modo, motor=None):
+    processo = g.get('processo')
+    def executar():
+        with app.app_context():
+            g.processo = processo
+            executar_tarefa_alocacao(tarefa_id, modo, motor)
+    threading.Thread(target=executar, name=f"alocacao-{tarefa_id}", daemon=True).start()
+
+def descrever_tarefa(tarefa):
+    inicio = tarefa['iniciada_em'] or tarefa['criada_em']
+    return {
+        'id': tarefa['id'],
+        'estado': tarefa['estado'],
+        'fase': tarefa['fase'],
+        'descricao_fase': FASES_ALOCACAO[tarefa['fase']][0] if tarefa['fase'] in FASES_ALOCACAO else None,
+        'progresso': tarefa['progresso'],
+        'decorrido_s': round((tarefa['terminada_em'] or time.time()) - inicio, 1),
+        'execucao_id': tarefa['execucao_id'],
+        'mensagem': tarefa['mensagem'],
+    }
+
+def carregar_execucao(db, execucao_id=None):
+    if execucao_id is None:
+        execucao = db.execute("SELECT * FROM execucoes_alocacao ORDER BY id DESC LIMIT 1").fetchone()
+    else:
+        execucao = db.execute("SELECT * FROM execucoes_alocacao WHERE id = ?", (execucao_id,)).fetchone()
+    if execucao is None:
+        return None
+    configs_usadas = json.loads(execucao['configs_usadas'])
+    orientadores = {row['orientador_id']: {'id': row['orientador_id'], 'nome': row['nome'], 'vagas': row['vagas']} for row in db.execute(
+        "SELECT orientador_id, nome, vagas FROM execucao_orientadores WHERE execucao_id = ? ORDER BY orientador_id", (execucao['id'],))}
+
+    alocacao = {oid: [] for oid in orientadores}
+    nao_alocados = []
+    for row in db.execute(
+        "SELECT a.candidato_id, a.nome_candidato, a.orientador_id, a.ordem_preferencia, p.pontuacao_final, p.bonus FROM execucao_alocacoes a "
+        "LEFT JOIN execucao_pontuacoes p ON p.execucao_id = a.execucao_id AND p.candidato_id = a.candidato_id AND p.orientador_id = a.orientador_id "
+        "WHERE a.execucao_id = ? ORDER BY a.posicao, a.candidato_id", (execucao['id'],)):
+        if row['orientador_id'] is None:
+            nao_alocados.append({'id': row['candidato_id'], 'nome': row['nome_candidato']})
+        else:
+            alocacao[row['orientador_id']].append({
+                "id": row['candidato_id'],
+                "nome": row['nome_candidato'],
+                "pontuacao_alocacao": round(row['pontuacao_final'], 2),
+                "preferencia_indicada": row['bonus'] > 0 or row['ordem_preferencia'] is not None,
+                "ordem_preferencia": row['ordem_preferencia']
+            })
+
+    pontuacoes_por_candidato = defaultdict(list)
+    for row in db.execute("SELECT * FROM execucao_pontuacoes WHERE execucao_id = ? ORDER BY candidato_id, pontuacao_final DESC", (execucao['id'],)):
+        pontuacoes_por_candidato[row['candidato_id']].append({
+            'orientador_nome': orientadores[row['orientador_id']]['nome'],
+            'pontuacao': row['pontuacao_final'],
+            'detalhes': {
+                'ipc': row['ipc'],
+                'iaoc': row['iaoc'],
+                'peso_preparo': configs_usadas.get('peso_preparo', 0.5),
+                'peso_afinidade': configs_usadas.get('peso_afinidade', 0.5),
+                'bonus': row['bonus']
+            }
+        })
+
+    return {
+        'execucao_id': execucao['id'],
+        'alocacao': alocacao,
+        'nao_alocados': nao_alocados,
+        'orientadores': orientadores,
+        'pontuacoes_por_candidato': pontuacoes_por_candidato,
+        'configs_usadas': configs_usadas,
+        'data_processamento': execucao['data_processamento'],
+        'modo_alocacao': execucao['modo_alocacao'],
+        'tempo_alocacao_ms': execucao['tempo_alocacao_ms'],
+        'estabilidade': carregar_estabilidade(db, execucao),
+    }
+
+# Pares bloqueantes e distribuição da opção obtida pelos candidatos alocados (ordem_preferencia NULL = alocado a um
+# orientador que não indicou). Execuções anteriores às preferências ordenadas não têm estes dados.
+def carregar_estabilidade(db, execucao):
+    if execucao['pares_bloqueantes'] is None:
+        return None
+    return {
+        'pares_bloqueantes': execucao['pares_bloqueantes'],
+        'ordens_obtidas': [(row['ordem_preferencia'], row['total']) for row in db.execute(
+            "SELECT ordem_preferencia, COUNT(*) AS total FROM execucao_alocacoes WHERE execucao_id = ? AND orientador_id IS NOT NULL "
+            "GROUP BY ordem_preferencia ORDER BY ordem_preferencia IS NULL, ordem_preferencia", (execucao['id'],))],
+    }
+
+# --- RELATÓRIO POR PARTES ---
+# O resumo lê apenas os totais de cada orientador; as listas são lidas por orientador ou por páginas de candidato_id
+# (paginação por chave, sem OFFSET), sempre sobre as chaves primárias e o índice (execucao_id, orientador_id, posicao).
+TAMANHO_PAGINA_RELATORIO = 50
+
+def carregar_resumo_execucao(db, execucao_id=None):
+    execucao_id = obter_execucao_id(db, execucao_id)
+    if execucao_id is None:
+        return None
+    execucao = db.execute("SELECT * FROM execucoes_alocacao WHERE id = ?", (execucao_id,)).fetchone()
+    orientadores = [dict(row) for row in db.execute(
+        "SELECT o.orientador_id AS id, o.nome, o.vagas, "
+        "(SELECT COUNT(*) FROM execucao_alocacoes a WHERE a.execucao_id = o.execucao_id AND a.orientador_id = o.orientador_id) AS alocados "
+        "FROM execucao_orientadores o WHERE o.execucao_id = ? ORDER BY o.orientador_id", (execucao_id,))]
+    total_nao_alocados = db.execute("SELECT COUNT(*) FROM execucao_alocacoes WHERE execucao_id = ? AND orientador_id IS NULL", (execucao_id,)).fetchone()[0]
+    return {
+        'execucao_id': execucao_id,
+        'orientadores': orientadores,
+        'total_nao_alocados': total_nao_alocados,
+        'configs_usadas': json.loads(execucao['configs_usadas']),
+        'data_processamento': execucao['data_processamento'],
+        'modo_alocacao': execucao['modo_alocacao'],
+        'tempo_alocacao_ms': execucao['tempo_alocacao_ms'],
+        'estabilidade': carregar_estabilidade(db, execucao),
+    }
+
+def carregar_alocados_orientador(db, execucao_id, orientador_id):
+    return [{
+        "id": row['candidato_id'],
+        "nome": row['nome_candidato'],
+        "pontuacao_alocacao": round(row['pontuacao_final'], 2),
+        "preferencia_indicada": row['bonus'] > 0 or row['ordem_preferencia'] is not None,
+        "ordem_preferencia": row['ordem_preferencia']
+    } for row in db.execute(
+        "SELECT a.candidato_id, a.nome_candidato, a.ordem_preferencia, p.pontuacao_final, p.bonus FROM execucao_alocacoes a "
+        "JOIN execucao_pontuacoes p ON p.execucao_id = a.execucao_id AND p.candidato_id = a.candidato_id AND p.orientador_id = a.orientador_id "
+        "WHERE a.execucao_id = ? AND a.orientador_id = ? ORDER BY a.posicao", (execucao_id, orientador_id))]
+
+def carregar_pagina(db, sql, params, apos, tamanho=TAMANHO_PAGINA_RELATORIO):
+    # Lê uma linha a mais para saber se existe página seguinte; devolve (linhas, último id ou None).
+    linhas = [{'id': row[0], 'nome': row[1]} for row in db.execute(sql, list(params) + [apos, tamanho + 1])]
+    if len(linhas) > tamanho:
+        return linhas[:tamanho], linhas[tamanho - 1]['id']
+    return linhas, None
+
+def carregar_pagina_nao_alocados(db, execucao_id, apos=0):
+    return carregar_pagina(db,
+        "SELECT candidato_id, nome_candidato FROM execucao_alocacoes WHERE execucao_id = ? AND orientador_id IS NULL AND candidato_id > ? "
+        "ORDER BY candidato_id LIMIT ?", (execucao_id,), apos)
+
+def carregar_pagina_nao_avaliados(db, apos=0):
+    return carregar_pagina(db,
+        "SELECT c.id, c.nome FROM candidatos c WHERE NOT EXISTS (SELECT 1 FROM avaliacoes a WHERE a.candidato_id = c.id) AND c.id > ? "
+        "ORDER BY c.id LIMIT ?", (), apos)
+
+def contar_nao_avaliados(db):
+    return db.execute("SELECT COUNT(*) FROM candidatos c WHERE NOT EXISTS (SELECT 1 FROM avaliacoes a WHERE a.candidato_id = c.id)").fetchone()[0]
+
+def carregar_pontuacoes_candidato(db, execucao_id, candidato_id):
+    execucao = db.execute("SELECT configs_usadas FROM execucoes_alocacao WHERE id = ?", (execucao_id,)).fetchone()
+    configs_usadas = json.loads(execucao['configs_usadas']) if execucao else {}
+    return [{
+        'orientador_nome': row['nome'],
+        'pontuacao': row['pontuacao_final'],
+        'detalhes': {
+            'ipc': row['ipc'],
+            'iaoc': row['iaoc'],
+            'peso_preparo': configs_usadas.get('peso_preparo', 0.5),
+            'peso_afinidade': configs_usadas.get('peso_afinidade', 0.5),
+            'bonus': row['bonus']
+        }
+    } for row in db.execute(
+        "SELECT p.*, o.nome FROM execucao_pontuacoes p JOIN execucao_orientadores o ON o.execucao_id = p.execucao_id AND o.orientador_id = p.orientador_id "
+        "WHERE p.execucao_id = ? AND p.candidato_id = ? ORDER BY p.pontuacao_final DESC", (execucao_id, candidato_id))]
+
+def apagar_execucoes(db):
+    for tabela in ('execucao_pontuacoes', 'execucao_alocacoes', 'execucao_orientadores', 'execucoes_alocacao'):
+        db.execute(f"DELETE FROM {tabela}")
+
+# --- EXPORTAÇÃO DOS RESULTADOS ---
+# As exportações leem diretamente as tabelas da execução, pela ordem da chave primária, e são escritas em blocos à
+# medida que o cursor avança: a memória usada não depende do número de pares nem de candidatos.
+CONSULTAS_EXPORTACAO = {
+    'pontuacoes': (
+        "SELECT p.candidato_id, a.nome_candidato, p.orientador_id, o.nome AS nome_orientador, p.ipc, p.iaoc, p.bonus, p.pontuacao_final, "
+        "a.orientador_id IS p.orientador_id AS alocado FROM execucao_pontuacoes p "
+        "LEFT JOIN execucao_alocacoes a ON a.execucao_id = p.execucao_id AND a.candidato_id = p.candidato_id "
+        "LEFT JOIN execucao_orientadores o ON o.execucao_id = p.execucao_id AND o.orientador_id = p.orientador_id "
+        "WHERE p.execucao_id = ? ORDER BY p.candidato_id, p.orientador_id"
+    ),
+    'alocacao': (
+        "SELECT a.candidato_id, a.nome_candidato, a.orientador_id, o.nome AS nome_orientador, p.ipc, p.iaoc, p.bonus, p.pontuacao_final, "
+        "a.posicao, a.ordem_preferencia FROM execucao_alocacoes a "
+        "LEFT JOIN execucao_orientadores o ON o.execucao_id = a.execucao_id AND o.orientador_id = a.orientador_id "
+        "LEFT JOIN execucao_pontuacoes p ON p.execucao_id = a.execucao_id AND p.candidato_id = a.candidato_id AND p.orientador_id = a.orientador_id "
+        "WHERE a.execucao_id = ? AND a.orientador_id IS NOT NULL ORDER BY a.candidato_id"
+    ),
+    'nao-alocados': (
+        "SELECT a.candidato_id, a.nome_candidato, COUNT(p.orientador_id) AS pares_pontuados, MAX(p.pontuacao_final) AS melhor_pontuacao "
+        "FROM execucao_alocacoes a LEFT JOIN execucao_pontuacoes p ON p.execucao_id = a.execucao_id AND p.candidato_id = a.candidato_id "
+        "WHERE a.execucao_id = ? AND a.orientador_id IS NULL GROUP BY a.candidato_id ORDER BY a.candidato_id"
+    ),
+}
+FORMATOS_EXPORTACAO = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson; charset=utf-8'}
+
+def obter_execucao_id(db, execucao_id=None):
+    if execucao_id is None:
+        row = db.execute("SELECT id FROM execucoes_alocacao ORDER BY id DESC LIMIT 1").fetchone()
+    else:
+        row = db.execute("SELECT id FROM execucoes_alocacao WHERE id = ?", (execucao_id,)).fetchone()
+    return row['id'] if row else None
+
+def gerar_exportacao(db, execucao_id, conjunto, formato, tamanho_bloco=64 * 1024):
+    cursor = db.execute(CONSULTAS_EXPORTACAO[conjunto], (execucao_id,))
+    colunas = [descricao[0] for descricao in cursor.description]
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer) if formato == 'csv' else None
+    if escritor:
+        escritor.writerow(colunas)
+    for row in cursor:
+        if escritor:
+            escritor.writerow(tuple(row))
+        else:
+            buffer.write(json.dumps(dict(zip(colunas, row)), ensure_ascii=False) + "\n")
+        if buffer.tell() >= tamanho_bloco:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+@click.command('exportar')
+@click.argument('conjunto', type=click.Choice(list(CONSULTAS_EXPORTACAO)))
+@click.option('--formato', type=click.Choice(list(FORMATOS_EXPORTACAO)), default='csv', show_default=True)
+@click.option('--execucao', 'execucao_id', type=int, default=None, help='Por omissão, a execução mais recente.')
+@click.option('--saida', default='-', show_default=True, help='Ficheiro de destino ("-" para a saída padrão).')
+@with_appcontext
+@opcao_processo
+def exportar_command(conjunto, formato, execucao_id, saida):
+    db = get_db()
+    execucao_id = obter_execucao_id(db, execucao_id)
+    if execucao_id is None:
+        raise click.ClickException("Execução de alocação não encontrada.")
+    with click.open_file(saida, 'w', encoding='utf-8') as ficheiro:
+        for bloco in gerar_exportacao(db, execucao_id, conjunto, formato):
+            ficheiro.write(bloco)
+
+app.cli.add_command(exportar_command)
+
+@click.command('comparar-motores')
+@with_appcontext
+@opcao_processo
+def comparar_motores_command():
+    db = get_db()
+    orientadores, _, configs, preferencias_candidatos = carregar_dados_alocacao(db)
+    referencia = None
+    for nome in MOTORES_PONTUACAO:
+        if nome == 'numpy' and np is None:
+            click.echo("NumPy não está instalado; motor 'numpy' ignorado.")
+            continue
+        inicio = time.perf_counter()
+        resultado = list(MOTORES_PONTUACAO[nome](db, orientadores, configs, preferencias_candidatos).linhas())
+        click.echo(f"{nome}: {len(resultado)} pares em {(time.perf_counter() - inicio) * 1000:.1f} ms")
+        if referencia is None:
+            referencia = resultado
+        elif resultado != referencia:
+            click.echo(f"ATENÇÃO: o motor '{nome}' produziu resultados diferentes do cálculo original!")
+            return
+    click.echo('Resultados idênticos em todos os motores.')
+
+app.cli.add_command(comparar_motores_command)
+
+@click.command('listar-execucoes')
+@with_appcontext
+@opcao_processo
+def listar_execucoes_command():
+    for row in get_db().execute(
+        "SELECT e.id, e.data_processamento, e.motor, e.modo_alocacao, e.tempo_alocacao_ms, "
+        "(SELECT COUNT(*) FROM execucao_alocacoes a WHERE a.execucao_id = e.id AND a.orientador_id IS NOT NULL) AS alocados "
+        "FROM execucoes_alocacao e ORDER BY e.id"):
+        click.echo(f"#{row['id']}  {row['data_processamento']}  {row['modo_alocacao']} / motor {row['motor']}  {row['alocados']} alocados  ({row['tempo_alocacao_ms']:.1f} ms)")
+
+@click.command('comparar-execucoes')
+@click.argument('anterior', type=int)
+@click.argument('atual', type=int)
+@with_appcontext
+@opcao_processo
+def comparar_execucoes_command(anterior, atual):
+    # Uma única consulta sobre as chaves primárias (execucao_id, candidato_id) das duas execuções.
+    mudancas = get_db().execute(
+        "SELECT a.candidato_id, a.nome_candidato, a.orientador_id AS antes, b.orientador_id AS depois "
+        "FROM execucao_alocacoes a LEFT JOIN execucao_alocacoes b ON b.execucao_id = :atual AND b.candidato_id = a.candidato_id "
+        "WHERE a.execucao_id = :anterior AND b.orientador_id IS NOT a.orientador_id "
+        "UNION ALL "
+        "SELECT b.candidato_id, b.nome_candidato, NULL, b.orientador_id FROM execucao_alocacoes b "
+        "WHERE b.execucao_id = :atual AND b.orientador_id IS NOT NULL AND NOT EXISTS "
+        "(SELECT 1 FROM execucao_alocacoes a WHERE a.execucao_id = :anterior AND a.candidato_id = b.candidato_id) "
+        "ORDER BY 1",
+        {'anterior': anterior, 'atual': atual}
+    ).fetchall()
+    for row in mudancas:
+        antes = f"orientador {row['antes']}" if row['antes'] is not None else 'não alocado'
+        depois = f"orientador {row['depois']}" if row['depois'] is not None else 'não alocado'
+        click.echo(f"{row['nome_candidato']} (#{row['candidato_id']}): {antes} -> {depois}")
+    click.echo(f"{len(mudancas)} candidato(s) com alocação diferente entre as execuções #{anterior} e #{atual}.")
+
+app.cli.add_command(listar_execucoes_command)
+app.cli.add_command(comparar_execucoes_command)
 
-        if cid not in ipc_por_candidato:
+# --- VARRIMENTO DE PESOS ("E SE...?") ---
+# Avalia uma grelha de combinações de pesos sem gravar nada. O que não depende dos pesos (somas das notas de currículo
+# por candidato, respostas de entrevista/afinidade de cada par já filtradas pelas atribuições do orientador,
+# preferências e vagas) é lido uma única vez e enviado a cada processo do pool; cada ponto da grelha recalcula apenas
+# IPc, IAoc e pontuação final, com as mesmas somas dos motores, e corre a estratégia de alocação.
+def carregar_dados_varrimento(db):
+    orientadores = {row['id']: dict(row) for row in db.execute("SELECT * FROM orientadores WHERE vagas > 0")}
+    questionario = carregar_questionario(db)
+    preferencias = carregar_preferencias(db)
+    notas_curriculo = defaultdict(dict)
+    for row in db.execute("SELECT candidato_id, questao_id, soma, contagem FROM notas_curriculo_agregadas WHERE contagem > 0"):
+        notas_curriculo[row['candidato_id']][row['questao_id']] = (row['soma'], row['contagem'])
+    # Cada par guarda as respostas de afinidade que contam (notas e códigos das questões, pela ordem das questões).
+    # Os pares com a mesma combinação de questões partilham o tuplo de códigos, e a soma dos pesos de cada
+    # combinação é calculada uma só vez por ponto da grelha.
+    notas = carregar_notas(db, "WHERE a.orientador_id IN (SELECT id FROM orientadores WHERE vagas > 0)")
+    combinacoes, pares = {}, []
+    for av in db.execute("SELECT a.id, a.candidato_id, a.orientador_id FROM avaliacoes a JOIN orientadores o ON o.id = a.orientador_id WHERE o.vagas > 0 ORDER BY a.id"):
+        cid, oid = av['candidato_id'], av['orientador_id']
+        if cid not in notas_curriculo:
             continue
-        
-        ip_c = ipc_por_candidato[cid]
+        contam = [(questionario.por_id[qid]['codigo'], nota) for qid, nota in notas.get(av['id'], {}).items()
+                  if qid in questionario.por_id and questionario.por_id[qid]['indice'] == 'afinidade' and orientadores[oid][questionario.por_id[qid]['atribuicao']]]
+        codigos = tuple(codigo for codigo, _ in contam)
+        pares.append((cid, oid, tuple(nota for _, nota in contam), combinacoes.setdefault(codigos, codigos), oid in preferencias.get(cid, ())))
+    return {
+        'configs': ler_configuracoes(db),
+        'questionario': questionario,
+        'vagas': {oid: {'vagas': o['vagas']} for oid, o in orientadores.items()},
+        'preferencias': dict(preferencias),
+        'notas_curriculo': dict(notas_curriculo),
+        'pares': pares,
+    }
 
-        soma_ponderada_afinidade, soma_pesos_afinidade = 0, 0
-        
-        if orientador_atual['avalia_entrevista']:
-            for questao in QUESTIONARIO_ESTRUTURA["III. Avaliação da Entrevista"]:
-                qid = questao['id']
-                if avaliacao[qid] is not None:
-                    peso = configs.get(qid, 1.0)
-                    soma_ponderada_afinidade += avaliacao[qid] * peso
-                    soma_pesos_afinidade += peso
-
-        if orientador_atual['avalia_afinidade']:
-            for questao in QUESTIONARIO_ESTRUTURA["IV. Avaliação da Afinidade"]:
-                qid = questao['id']
-                if avaliacao[qid] is not None:
-                    peso = configs.get(qid, 1.0)
-                    soma_ponderada_afinidade += avaliacao[qid] * peso
-                    soma_pesos_afinidade += peso
-
-        ia_oc = soma_ponderada_afinidade / soma_pesos_afinidade if soma_pesos_afinidade > 0 else 0
+def configs_do_ponto(configs, ponto):
+    configs = dict(configs, **ponto)
+    if 'peso_preparo' in ponto:
+        configs['peso_afinidade'] = 1.0 - ponto['peso_preparo']  # Como no formulário de configurações.
+    return configs
 
+# IPc por candidato e IAoc de cada par (na ordem de dados['pares']): só dependem dos pesos das questões.
+def calcular_indices_varrimento(dados, configs):
+    ipc_por_candidato = {cid: calcular_ipc(dados['questionario'], notas, configs) for cid, notas in dados['notas_curriculo'].items()}
+    pesos_por_combinacao = {}
+    iaoc_por_par = []
+    for _, _, respostas, codigos, _ in dados['pares']:
+        if codigos not in pesos_por_combinacao:
+            pesos = [configs.get(codigo, 1.0) for codigo in codigos]
+            pesos_por_combinacao[codigos] = (pesos, sum(pesos))
+        pesos, soma_pesos = pesos_por_combinacao[codigos]
+        iaoc_por_par.append(sum(map(operator.mul, respostas, pesos)) / soma_pesos if soma_pesos > 0 else 0)
+    return ipc_por_candidato, iaoc_por_par
+
+# Devolve ({candidato: orientador}, soma das pontuações dos pares escolhidos).
+def alocar_com_pesos(dados, configs, modo, indices=None):
+    ipc_por_candidato, iaoc_por_par = indices or calcular_indices_varrimento(dados, configs)
+    peso_preparo_geral = configs.get('peso_preparo', 0.5)
+    peso_afinidade_geral = configs.get('peso_afinidade', 0.5)
+    bonus_preferencia_config = configs.get('peso_preferencia_candidato', 0.0)
+    pontuacoes = PontuacoesPares(peso_preparo_geral, peso_afinidade_geral)
+    acrescentar = pontuacoes.acrescentar
+    for (cid, oid, _, _, preferido), ia_oc in zip(dados['pares'], iaoc_por_par):
+        ip_c = ipc_por_candidato[cid]
         p_oc = (peso_preparo_geral * ip_c) + (peso_afinidade_geral * ia_oc)
-        
         bonus_aplicado = 0
-        if oid in preferencias_candidatos.get(cid, set()):
+        if preferido:
             p_oc += bonus_preferencia_config
             bonus_aplicado = bonus_preferencia_config
+        acrescentar(cid, oid, ip_c, ia_oc, bonus_aplicado, p_oc)
+    escolhidos = ESTRATEGIAS_ALOCACAO[modo][1](pontuacoes, dados['vagas'], dados['preferencias'])
+    ids_candidatos, ids_orientadores = pontuacoes.id_candidato, pontuacoes.id_orientador
+    return {ids_candidatos[i]: ids_orientadores[i] for i in escolhidos}, sum(pontuacoes.pontuacao_final[i] for i in escolhidos)
 
-        pontuacoes.append({
-            "id_candidato": cid,
-            "id_orientador": oid,
-            "pontuacao_final": p_oc,
-            "detalhes": {
-                "ipc": ip_c,
-                "iaoc": ia_oc,
-                "peso_preparo": peso_preparo_geral,
-                "peso_afinidade": peso_afinidade_geral,
-                "bonus": bonus_aplicado
-            }
-        })
+# Estado de cada processo do pool, preenchido pelo initializer para não reenviar os dados a cada ponto. Guarda
+# também os índices do último conjunto de pesos das questões, reaproveitados pelos pontos seguintes.
+_VARRIMENTO = {}
 
-    DADOS_SESSAO["todas_pontuacoes"] = pontuacoes
+def iniciar_processo_varrimento(dados, modo, base):
+    _VARRIMENTO.clear()
+    _VARRIMENTO.update(dados=dados, modo=modo, base=base)
 
-    pontuacoes.sort(key=lambda x: x["pontuacao_final"], reverse=True)
-    candidatos_alocados_ids, vagas_preenchidas = set(), {o_id: 0 for o_id in orientadores_com_vagas}
-    alocacao = {o_id: [] for o_id in orientadores_com_vagas}
-    for par in pontuacoes:
-        id_c, id_o = par["id_candidato"], par["id_orientador"]
-        if id_o in orientadores_com_vagas and id_c not in candidatos_alocados_ids and vagas_preenchidas[id_o] < orientadores_com_vagas[id_o]["vagas"]:
-            alocacao[id_o].append({
-                "id": id_c,
-                "nome": candidatos[id_c]["nome"],
-                "pontuacao_alocacao": round(par["pontuacao_final"], 2),
-                "preferencia_indicada": par["detalhes"]["bonus"] > 0
-            })
-            vagas_preenchidas[id_o] += 1
-            candidatos_alocados_ids.add(id_c)
+def avaliar_ponto_varrimento(ponto):
+    dados, base = _VARRIMENTO['dados'], _VARRIMENTO['base']
+    configs = configs_do_ponto(dados['configs'], ponto)
+    chave = tuple(configs.get(questao['codigo'], 1.0) for questao in dados['questionario'].questoes)
+    if _VARRIMENTO.get('chave_indices') != chave:
+        _VARRIMENTO.update(chave_indices=chave, indices=calcular_indices_varrimento(dados, configs))
+    alocacao, total = alocar_com_pesos(dados, configs, _VARRIMENTO['modo'], _VARRIMENTO['indices'])
+    mudancas = sum(1 for cid in base.keys() | alocacao.keys() if base.get(cid) != alocacao.get(cid))
+    return {'pesos': ponto, 'alocados': len(alocacao), 'mudancas': mudancas, 'pontuacao_total': total}
+
+# intervalos: {chave de configuração: [valores]}; a última chave varia mais depressa. Cada processo recebe blocos de
+# pontos consecutivos, pelo que, com os pesos das questões à frente, a maioria dos pontos reaproveita os índices.
+# A base de comparação é a alocação com os pesos atuais.
+def executar_varrimento(dados, intervalos, modo, processos=None):
+    pontos = [dict(zip(intervalos, valores)) for valores in itertools.product(*intervalos.values())]
+    base, _ = alocar_com_pesos(dados, dados['configs'], modo)
+    if processos == 1 or len(pontos) < 2:
+        iniciar_processo_varrimento(dados, modo, base)
+        return base, [avaliar_ponto_varrimento(ponto) for ponto in pontos]
+    processos = processos or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=processos, initializer=iniciar_processo_varrimento, initargs=(dados, modo, base)) as executor:
+        return base, list(executor.map(avaliar_ponto_varrimento, pontos, chunksize=max(1, len(pontos) // (4 * processos))))
+
+def ler_intervalo(ctx, param, texto):
+    # "0.3:0.7:0.1" (início:fim:passo, com o fim incluído), "0,0.2,0.5" ou um único valor.
+    if texto is None:
+        return None
+    try:
+        if ':' in texto:
+            inicio, fim, passo = (float(x) for x in texto.split(':'))
+            if passo <= 0 or fim < inicio:
+                raise ValueError
+            return [round(inicio + i * passo, 10) for i in range(int(round((fim - inicio) / passo, 10)) + 1)]
+        return [float(x) for x in texto.split(',')]
+    except ValueError:
+        raise click.BadParameter(f"intervalo inválido: {texto!r} (use início:fim:passo, valores separados por vírgulas ou um único valor)")
 
-    candidatos_avaliados_ids = {av['candidato_id'] for av in avaliacoes}
-    nao_alocados_ids = candidatos_avaliados_ids - candidatos_alocados_ids
-    DADOS_SESSAO["alocacao_final"] = alocacao
-    DADOS_SESSAO["nao_alocados"] = [candidatos[cid] for cid in nao_alocados_ids]
-    flash("Processo de alocação executado com sucesso!", "success")
+# Os códigos das questões só são validados no comando, contra o questionário da base de dados.
+def ler_intervalos_questoes(ctx, param, textos):
+    intervalos = {}
+    for texto in textos:
+        codigo, _, valores = texto.partition('=')
+        intervalos[codigo] = ler_intervalo(ctx, param, valores)
+    return intervalos
+
+@click.command('varrimento-pesos')
+@click.option('--peso-preparo', callback=ler_intervalo, help='Valores de peso_preparo (o peso da afinidade passa a 1 - peso_preparo), ex.: 0.3:0.7:0.1')
+@click.option('--bonus', callback=ler_intervalo, help='Valores de peso_preferencia_candidato, ex.: 0,0.2,0.5')
+@click.option('--questao', 'questoes', multiple=True, callback=ler_intervalos_questoes, metavar='CODIGO=VALORES', help='Pesos de uma questão, ex.: s3_1=0.5:2:0.5 (pode repetir-se).')
+@click.option('--modo', type=click.Choice(list(ESTRATEGIAS_ALOCACAO)), default=None, help='Por omissão, o modo pré-selecionado no painel.')
+@click.option('--processos', type=click.IntRange(min=1), default=None, help='Processos do pool (por omissão, um por CPU; 1 corre tudo neste processo).')
+@click.option('--formato', type=click.Choice(['texto', 'json']), default='texto', show_default=True)
+@with_appcontext
+@opcao_processo
+def varrimento_pesos_command(peso_preparo, bonus, questoes, modo, processos, formato):
+    intervalos = dict(questoes)
+    if peso_preparo:
+        intervalos['peso_preparo'] = peso_preparo
+    if bonus:
+        intervalos['peso_preferencia_candidato'] = bonus
+    if not intervalos:
+        raise click.UsageError("Indique pelo menos um intervalo (--peso-preparo, --bonus ou --questao).")
+    modo = modo or app.config['MODO_ALOCACAO']
+    codigos = carregar_questionario(get_db()).por_codigo
+    for codigo in questoes:
+        if codigo not in codigos:
+            raise click.BadParameter(f"questão desconhecida: {codigo!r} (use {', '.join(sorted(codigos))})", param_hint="'--questao'")
+    inicio = time.perf_counter()
+    dados = carregar_dados_varrimento(get_db())
+    if not dados['pares']:
+        click.echo("Ainda não há avaliações para alocar.")
+        return
+    base, resultados = executar_varrimento(dados, intervalos, modo, processos)
+    tempo = time.perf_counter() - inicio
+    if formato == 'json':
+        click.echo(json.dumps({'modo': modo, 'configs_atuais': dados['configs'], 'alocados_base': len(base), 'tempo_s': tempo, 'pontos': resultados}, ensure_ascii=False, indent=2))
+        return
+    click.echo(f"Base (pesos atuais, modo {modo}): {len(base)} alocados.")
+    for r in resultados:
+        pesos = '  '.join(f"{chave}={valor:g}" for chave, valor in r['pesos'].items())
+        click.echo(f"{pesos}  ->  {r['mudancas']} candidato(s) com alocação diferente, {r['alocados']} alocados")
+    click.echo(f"{len(resultados)} combinação(ões) avaliada(s) em {tempo:.2f} s.")
+
+app.cli.add_command(varrimento_pesos_command)
 
 # --- 4. TEMPLATES HTML ---
-TPL_BASE_HEAD = """<!doctype html><html lang="pt-br"><head><meta charset="utf-8"><meta name="viewport" content="width=device-width, initial-scale=1, shrink-to-fit=no"><link rel="stylesheet" href="https://stackpath.bootstrapcdn.com/bootstrap/4.5.2/css/bootstrap.min.css"><title>SASAC v5.3</title><script src="https://polyfill.io/v3/polyfill.min.js?features=es6"></script><script id="MathJax-script" async src="https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-mml-chtml.js"></script><style>
+TPL_BASE_HEAD = """<!doctype html><html lang="pt-br"><head><meta charset="utf-8"><meta name="viewport" content="width=device-width, initial-scale=1, shrink-to-fit=no"><link rel="stylesheet" href="{{ ativo_estatico('bootstrap.min.css') }}"><title>SASAC v5.3</title><style>
     @media print {
         .no-print { display: none !important; }
         .card { border: 1px solid #ccc !important; box-shadow: none !important; page-break-inside: avoid; }
@@ -241,10 +2715,11 @@ TPL_BASE_HEAD = """<!doctype html><html lang="pt-br"><head><meta charset="utf-8"
         margin-top: 5px;
     }
 </style></head><body><div class="container mt-4">"""
-TPL_HEADER_ADMIN = TPL_BASE_HEAD + """<nav class="navbar navbar-expand-lg navbar-light bg-light mb-4 no-print"><a class="navbar-brand" href="/">SASAC v5.3</a><div class="collapse navbar-collapse"><ul class="navbar-nav mr-auto"><li class="nav-item"><a class="nav-link" href="/admin">Painel Administrativo</a></li><li class="nav-item"><a class="nav-link" href="/orientadores">Orientadores</a></li><li class="nav-item"><a class="nav-link" href="/candidatos">Candidatos</a></li><li class="nav-item"><a class="nav-link" href="/avaliar">Avaliar</a></li><li class="nav-item"><a class="nav-link" href="/ajuda">Ajuda</a></li></ul><ul class="navbar-nav"><li class="nav-item"><a class="nav-link" href="{{ url_for('logout') }}">Logout</a></li></ul></div></nav>{% with messages = get_flashed_messages(with_categories=true) %}<div class="no-print">{% if messages %}{% for category, message in messages %}<div class="alert alert-{{ category }}" role="alert">{{ message }}</div>{% endfor %}{% endif %}</div>{% endwith %}"""
+TPL_HEADER_ADMIN = TPL_BASE_HEAD + """<nav class="navbar navbar-expand-lg navbar-light bg-light mb-4 no-print"><a class="navbar-brand" href="{{ request.script_root }}/">SASAC v5.3{% if g.processo %} &middot; {{ g.processo }}{% endif %}</a><div class="collapse navbar-collapse"><ul class="navbar-nav mr-auto"><li class="nav-item"><a class="nav-link" href="{{ request.script_root }}/admin">Painel Administrativo</a></li><li class="nav-item"><a class="nav-link" href="{{ request.script_root }}/orientadores">Orientadores</a></li><li class="nav-item"><a class="nav-link" href="{{ request.script_root }}/candidatos">Candidatos</a></li><li class="nav-item"><a class="nav-link" href="{{ request.script_root }}/avaliar">Avaliar</a></li><li class="nav-item"><a class="nav-link" href="{{ request.script_root }}/ajuda">Ajuda</a></li></ul><ul class="navbar-nav"><li class="nav-item"><a class="nav-link" href="{{ request.script_root }}/processos">Processos seletivos</a></li><li class="nav-item"><a class="nav-link" href="{{ url_for('logout') }}">Logout</a></li></ul></div></nav>{% with messages = get_flashed_messages(with_categories=true) %}<div class="no-print">{% if messages %}{% for category, message in messages %}<div class="alert alert-{{ category }}" role="alert">{{ message }}</div>{% endfor %}{% endif %}</div>{% endwith %}"""
 TPL_HEADER_AVALIACAO = TPL_BASE_HEAD + """<nav class="navbar navbar-light bg-light mb-4 no-print"><span class="navbar-brand">SASAC v5.3 - Portal de Avaliação</span></nav>{% with messages = get_flashed_messages(with_categories=true) %}<div class="no-print">{% if messages %}{% for category, message in messages %}<div class="alert alert-{{ category }}" role="alert">{{ message }}</div>{% endfor %}{% endif %}</div>{% endwith %}"""
 TPL_HEADER_LOGIN = TPL_BASE_HEAD + """<nav class="navbar navbar-light bg-light mb-4 no-print"><span class="navbar-brand">SASAC v5.3 - Acesso Administrativo</span></nav>{% with messages = get_flashed_messages(with_categories=true) %}<div class="no-print">{% if messages %}{% for category, message in messages %}<div class="alert alert-{{ category }}" role="alert">{{ message }}</div>{% endfor %}{% endif %}</div>{% endwith %}"""
-TPL_FOOTER = "</div></body></html>"
+# O MathJax só é carregado pelas páginas com fórmulas: basta que o template (ou a rota) defina formulas = true.
+TPL_FOOTER = """</div>{% if formulas %}<script id="MathJax-script" async src="{{ ativo_estatico('""" + MATHJAX_PRINCIPAL + """') }}"></script>{% endif %}</body></html>"""
 
 TPL_LOGIN_CONTENT = """
 <div class="row justify-content-center">
@@ -291,12 +2766,12 @@ TPL_ADMIN_CONTENT = """
                 </div>
                 <div class="col-md-6">
                     <h5>Pesos Individuais das Questões</h5>
-                    {% for secao, questoes in questionario.items() %}
-                        <strong>{{ secao }}</strong>
-                        {% for questao in questoes %}
+                    {% for secao in questionario.secoes %}
+                        <strong>{{ secao.titulo }}</strong>
+                        {% for questao in secao.questoes %}
                         <div class="form-group row">
-                            <label for="{{ questao.id }}" class="col-sm-8 col-form-label-sm">{{ questao.texto }}</label>
-                            <div class="col-sm-4"><input type="number" step="0.1" class="form-control form-control-sm" name="{{ questao.id }}" id="{{ questao.id }}" value="{{ configs.get(questao.id, 1.0) }}"></div>
+                            <label for="{{ questao.codigo }}" class="col-sm-8 col-form-label-sm">{{ questao.texto }}</label>
+                            <div class="col-sm-4"><input type="number" step="0.1" class="form-control form-control-sm" name="{{ questao.codigo }}" id="{{ questao.codigo }}" value="{{ configs.get(questao.codigo, 1.0) }}"></div>
                         </div>
                         {% endfor %}
                     {% endfor %}
@@ -308,8 +2783,45 @@ TPL_ADMIN_CONTENT = """
     </form>
     <div class="card mb-4"><div class="card-body">
         <h5 class="card-title">Ações do Sistema</h5>
-        <form action="{{ url_for('processar') }}" method="post" class="d-inline mb-2"><button type="submit" class="btn btn-primary">Executar Alocação</button></form>
-        <a href="/" class="btn btn-secondary">Ver Último Relatório</a>
+        <form action="{{ url_for('processar') }}" method="post" class="form-inline d-inline-flex mb-2">
+            <select name="modo_alocacao" class="form-control mr-2" title="Algoritmo de alocação">
+                {% for chave, (descricao, _) in estrategias.items() %}<option value="{{ chave }}" {% if chave == modo_padrao %}selected{% endif %}>{{ descricao }}</option>{% endfor %}
+            </select>
+            <button type="submit" class="btn btn-primary" {% if tarefa and tarefa.estado in ('pendente', 'em_execucao') %}disabled{% endif %}>Executar Alocação</button>
+        </form>
+        <a href="{{ request.script_root }}/" class="btn btn-secondary">Ver Último Relatório</a>
+        {% if tarefa %}
+        <div id="tarefa-alocacao" class="mt-3" data-tarefa="{{ tarefa.id }}" data-estado="{{ tarefa.estado }}">
+            <div class="progress mb-1"><div class="progress-bar{% if tarefa.estado == 'falhou' %} bg-danger{% elif tarefa.estado == 'concluida' %} bg-success{% else %} progress-bar-striped progress-bar-animated{% endif %}" role="progressbar" style="width: {{ (tarefa.progresso * 100)|round|int }}%"></div></div>
+            <small class="text-muted" id="tarefa-alocacao-estado">
+                Alocação #{{ tarefa.id }}:
+                {% if tarefa.estado == 'concluida' %}concluída em {{ tarefa.decorrido_s }} s{% if tarefa.mensagem %} ({{ tarefa.mensagem }}){% endif %}.
+                {% elif tarefa.estado == 'falhou' %}falhou após {{ tarefa.decorrido_s }} s: {{ tarefa.mensagem }}
+                {% else %}{{ tarefa.descricao_fase or 'A aguardar início' }} ({{ tarefa.decorrido_s }} s){% endif %}
+            </small>
+        </div>
+        <script>
+        (function () {
+            var painel = document.getElementById('tarefa-alocacao');
+            if (painel.dataset.estado !== 'pendente' && painel.dataset.estado !== 'em_execucao') { return; }
+            var barra = painel.querySelector('.progress-bar'), texto = document.getElementById('tarefa-alocacao-estado');
+            function consultar() {
+                fetch('{{ request.script_root }}/tarefas/' + painel.dataset.tarefa, {credentials: 'same-origin'}).then(function (resposta) { return resposta.json(); }).then(function (tarefa) {
+                    barra.style.width = Math.round(tarefa.progresso * 100) + '%';
+                    if (tarefa.estado === 'concluida' && tarefa.execucao_id) {
+                        window.location = '{{ request.script_root }}/';
+                    } else if (tarefa.estado === 'concluida' || tarefa.estado === 'falhou') {
+                        window.location.reload();
+                    } else {
+                        texto.textContent = 'Alocação #' + tarefa.id + ': ' + (tarefa.descricao_fase || 'A aguardar início') + ' (' + tarefa.decorrido_s + ' s)';
+                        setTimeout(consultar, 1000);
+                    }
+                }).catch(function () { setTimeout(consultar, 3000); });
+            }
+            setTimeout(consultar, 500);
+        })();
+        </script>
+        {% endif %}
     </div></div>
     <div class="card border-danger mb-4"><div class="card-header bg-danger text-white">Ações Destrutivas</div><div class="card-body">
         <p>A ação abaixo permite recomeçar a rodada de avaliações, apagando todas as notas já submetidas mas preservando os orientadores e candidatos.</p>
@@ -331,8 +2843,28 @@ TPL_ADMIN_CONTENT = """
 """
 TPL_ADMIN = TPL_HEADER_ADMIN + TPL_ADMIN_CONTENT + TPL_FOOTER
 
+TPL_PROCESSOS = TPL_HEADER_ADMIN + """
+<h2>Processos Seletivos</h2>
+<p class="text-muted">Cada processo seletivo tem a sua própria base de dados: orientadores, candidatos, avaliações, configurações e execuções da alocação são independentes.</p>
+<table class="table">
+    <thead><tr><th>Processo</th><th>Endereço</th><th></th></tr></thead>
+    <tbody>
+    <tr{% if not g.processo %} class="table-active"{% endif %}><td>Principal</td><td><code>{{ endereco_processo() }}/</code></td><td><a href="{{ endereco_processo() }}/admin" class="btn btn-sm btn-primary">Abrir</a></td></tr>
+    {% for nome in processos %}
+    <tr{% if g.processo == nome %} class="table-active"{% endif %}><td>{{ nome }}</td><td><code>{{ endereco_processo(nome) }}/</code></td><td><a href="{{ endereco_processo(nome) }}/admin" class="btn btn-sm btn-primary">Abrir</a></td></tr>
+    {% endfor %}
+    </tbody>
+</table>
+<h4 class="mt-4">Novo Processo Seletivo</h4>
+<form action="{{ request.script_root }}/processos" method="post" class="form-inline">
+    <input type="text" name="nome" class="form-control mr-2" placeholder="ex.: mestrado-2026" pattern="[a-z0-9][a-z0-9_-]{0,63}" required>
+    <button type="submit" class="btn btn-success">Criar</button>
+</form>
+<small class="form-text text-muted">Letras minúsculas, algarismos, '-' e '_'. O processo é criado com as configurações padrão.</small>
+""" + TPL_FOOTER
+
 TPL_ORIENTADOR_LIST = TPL_HEADER_ADMIN + """
-<div class="d-flex justify-content-between align-items-center mb-3"><h2>Avaliadores e Orientadores</h2><a href="/orientadores/add" class="btn btn-success">Adicionar Novo</a></div>
+<div class="d-flex justify-content-between align-items-center mb-3"><h2>Avaliadores e Orientadores</h2><a href="{{ request.script_root }}/orientadores/add" class="btn btn-success">Adicionar Novo</a></div>
 <table class="table">
     <thead><tr><th>Nome</th><th>Atribuições</th><th>Vagas</th><th>Ações</th></tr></thead>
     <tbody>
@@ -348,8 +2880,8 @@ TPL_ORIENTADOR_LIST = TPL_HEADER_ADMIN + """
         </td>
         <td>{{ o.vagas }}</td>
         <td>
-            <a href="/orientadores/edit/{{ o.id }}" class="btn btn-sm btn-warning">Editar</a>
-            <form action="/orientadores/delete/{{ o.id }}" method="post" class="d-inline">
+            <a href="{{ request.script_root }}/orientadores/edit/{{ o.id }}" class="btn btn-sm btn-warning">Editar</a>
+            <form action="{{ request.script_root }}/orientadores/delete/{{ o.id }}" method="post" class="d-inline">
                 <button type="submit" class="btn btn-sm btn-danger" onclick="return confirm('Tem certeza?');">Apagar</button>
             </form>
         </td>
@@ -386,11 +2918,11 @@ TPL_ORIENTADOR_FORM = TPL_HEADER_ADMIN + """
         <small class="form-text text-muted">Defina como 0 se for apenas um avaliador sem vagas de orientação.</small>
     </div>
     <button type="submit" class="btn btn-primary">Salvar</button>
-    <a href="/orientadores" class="btn btn-secondary">Cancelar</a>
+    <a href="{{ request.script_root }}/orientadores" class="btn btn-secondary">Cancelar</a>
 </form>
 """ + TPL_FOOTER
 
-TPL_CANDIDATO_LIST = TPL_HEADER_ADMIN + """<div class="d-flex justify-content-between align-items-center mb-3"><h2>Candidatos</h2><a href="/candidatos/add" class="btn btn-success">Adicionar Novo</a></div><table class="table"><thead><tr><th>Nome</th><th>Ações</th></tr></thead><tbody>{% for c in candidatos %}<tr><td>{{ c.nome }}</td><td><a href="/candidatos/edit/{{ c.id }}" class="btn btn-sm btn-warning">Editar</a> <form action="/candidatos/delete/{{ c.id }}" method="post" class="d-inline"><button type="submit" class="btn btn-sm btn-danger" onclick="return confirm('Tem certeza?');">Apagar</button></form></td></tr>{% endfor %}</tbody></table>""" + TPL_FOOTER
+TPL_CANDIDATO_LIST = TPL_HEADER_ADMIN + """<div class="d-flex justify-content-between align-items-center mb-3"><h2>Candidatos</h2><a href="{{ request.script_root }}/candidatos/add" class="btn btn-success">Adicionar Novo</a></div><table class="table"><thead><tr><th>Nome</th><th>Ações</th></tr></thead><tbody>{% for c in candidatos %}<tr><td>{{ c.nome }}</td><td><a href="{{ request.script_root }}/candidatos/edit/{{ c.id }}" class="btn btn-sm btn-warning">Editar</a> <form action="{{ request.script_root }}/candidatos/delete/{{ c.id }}" method="post" class="d-inline"><button type="submit" class="btn btn-sm btn-danger" onclick="return confirm('Tem certeza?');">Apagar</button></form></td></tr>{% endfor %}</tbody></table>""" + TPL_FOOTER
 
 TPL_CANDIDATO_FORM = TPL_HEADER_ADMIN + """
 <h2>{{ titulo }}</h2>
@@ -401,9 +2933,11 @@ TPL_CANDIDATO_FORM = TPL_HEADER_ADMIN + """
     </div>
     <div class="form-group">
         <label>Preferência de Orientadores (opcional)</label>
+        <small class="form-text text-muted mt-0 mb-2">Indique a ordem de preferência (1 = preferido). Os orientadores assinalados sem ordem ficam depois dos restantes, pela ordem da lista.</small>
         {% for orientador in orientadores %}
-        <div class="form-check">
+        <div class="form-check d-flex align-items-center mb-1">
             <input class="form-check-input" type="checkbox" name="preferencias" value="{{ orientador.id }}" id="pref_{{ orientador.id }}" {% if orientador.id in preferencias_atuais %}checked{% endif %}>
+            <input type="number" min="1" name="ordem_{{ orientador.id }}" class="form-control form-control-sm mr-2" style="width: 5em;" placeholder="Ordem" title="Ordem de preferência" value="{{ preferencias_atuais.get(orientador.id, '') }}">
             <label class="form-check-label" for="pref_{{ orientador.id }}">{{ orientador.nome }}</label>
         </div>
         {% endfor %}
@@ -412,7 +2946,7 @@ TPL_CANDIDATO_FORM = TPL_HEADER_ADMIN + """
         {% endif %}
     </div>
     <button type="submit" class="btn btn-primary">Salvar</button> 
-    <a href="/candidatos" class="btn btn-secondary">Cancelar</a>
+    <a href="{{ request.script_root }}/candidatos" class="btn btn-secondary">Cancelar</a>
 </form>
 """ + TPL_FOOTER
 
@@ -456,88 +2990,70 @@ function copiarLink(elementId, button) {
 </script>
 """
 TPL_AVALIAR_INDEX = TPL_HEADER_ADMIN + TPL_AVALIAR_INDEX_CONTENT + TPL_FOOTER
-TPL_LISTA_CANDIDATOS = TPL_HEADER_AVALIACAO + """<h3>Página de Avaliação de {{ orientador.nome }}</h3><p>Selecione um candidato para avaliar ou para modificar uma avaliação existente.</p><table class="table"><thead><tr><th>Candidato</th><th>Ação</th></tr></thead><tbody>{% for c in candidatos %}<tr><td>{{ c.nome }}</td><td>{% if c.id in avaliados %}<a href="/avaliar/{{ orientador.token }}/{{ c.id }}" class="btn btn-sm btn-warning">Modificar Avaliação</a>{% else %}<a href="/avaliar/{{ orientador.token }}/{{ c.id }}" class="btn btn-sm btn-outline-primary">Avaliar</a>{% endif %}</td></tr>{% endfor %}</tbody></table>""" + TPL_FOOTER
+TPL_LISTA_CANDIDATOS = TPL_HEADER_AVALIACAO + """<h3>Página de Avaliação de {{ orientador.nome }}</h3><p>Selecione um candidato para avaliar ou para modificar uma avaliação existente, ou <a href="{{ request.script_root }}/avaliar/{{ orientador.token }}/lote">avalie vários candidatos de uma só vez na grelha</a>.</p><table class="table"><thead><tr><th>Candidato</th><th>Ação</th></tr></thead><tbody>{% for c in candidatos %}<tr><td>{{ c.nome }}</td><td>{% if c.id in avaliados %}<a href="{{ request.script_root }}/avaliar/{{ orientador.token }}/{{ c.id }}" class="btn btn-sm btn-warning">Modificar Avaliação</a>{% else %}<a href="{{ request.script_root }}/avaliar/{{ orientador.token }}/{{ c.id }}" class="btn btn-sm btn-outline-primary">Avaliar</a>{% endif %}</td></tr>{% endfor %}</tbody></table>""" + TPL_FOOTER
 
 TPL_FORM_AVALIACAO = TPL_HEADER_AVALIACAO + """
 <h4>Avaliando: {{ candidato.nome }}</h4>
 <p>Avaliador: {{ orientador.nome }}</p>
 <form method="post">
-    {% if not orientador.avalia_curriculo and not orientador.avalia_entrevista and not orientador.avalia_afinidade %}
+    {% set secoes = questionario.secoes_do_orientador(orientador) %}
+    {% if not secoes %}
         <div class="alert alert-warning">Este avaliador não possui nenhuma atribuição de avaliação configurada.</div>
     {% endif %}
 
-    {% if orientador.avalia_curriculo %}
-    <h5>{{ questionario.keys()|list|first }}</h5>
-    {% for item in questionario["II. Avaliação do Currículo"] %}
-    <div class="form-group">
-        <label>{{ item.texto }}</label>
-        <div>
-        {% for val, label in [(-2, '-2: Discordo Totalmente'), (-1, '-1: Discordo'), (0, '0: Neutro'), (1, '+1: Concordo'), (2, '+2: Concordo Totalmente')] %}
-            <div class="form-check form-check-inline">
-                <input class="form-check-input" type="radio" name="{{ item.id }}" id="{{ item.id }}_{{ val }}" value="{{ val }}" {% if avaliacao_existente and avaliacao_existente[item.id] == val %}checked{% endif %} required>
-                <label class="form-check-label" for="{{ item.id }}_{{ val }}">{{ label }}</label>
-            </div>
-        {% endfor %}
-        </div>
-    </div>
-    {% endfor %}
-    {% endif %}
-
-    {% if orientador.avalia_entrevista %}
-    <h5 class="mt-4">{{ (questionario.keys()|list)[1] }}</h5>
-    {% for item in questionario["III. Avaliação da Entrevista"] %}
+    {% for secao in secoes %}
+    <h5{% if secao.id != questionario.secoes[0].id %} class="mt-4"{% endif %}>{{ secao.titulo }}</h5>
+    {% for item in secao.questoes %}
     <div class="form-group">
         <label>{{ item.texto }}</label>
         <div>
         {% for val, label in [(-2, '-2: Discordo Totalmente'), (-1, '-1: Discordo'), (0, '0: Neutro'), (1, '+1: Concordo'), (2, '+2: Concordo Totalmente')] %}
             <div class="form-check form-check-inline">
-                <input class="form-check-input" type="radio" name="{{ item.id }}" id="{{ item.id }}_{{ val }}" value="{{ val }}" {% if avaliacao_existente and avaliacao_existente[item.id] == val %}checked{% endif %} required>
-                <label class="form-check-label" for="{{ item.id }}_{{ val }}">{{ label }}</label>
+                <input class="form-check-input" type="radio" name="{{ item.codigo }}" id="{{ item.codigo }}_{{ val }}" value="{{ val }}" {% if avaliacao_existente and avaliacao_existente.get(item.codigo) == val %}checked{% endif %} required>
+                <label class="form-check-label" for="{{ item.codigo }}_{{ val }}">{{ label }}</label>
             </div>
         {% endfor %}
         </div>
     </div>
     {% endfor %}
-    {% endif %}
-
-    {% if orientador.avalia_afinidade %}
-    <h5 class="mt-4">{{ questionario.keys()|list|last }}</h5>
-    {% for item in questionario["IV. Avaliação da Afinidade"] %}
-    <div class="form-group">
-        <label>{{ item.texto }}</label>
-        <div>
-        {% for val, label in [(-2, '-2: Discordo Totalmente'), (-1, '-1: Discordo'), (0, '0: Neutro'), (1, '+1: Concordo'), (2, '+2: Concordo Totalmente')] %}
-            <div class="form-check form-check-inline">
-                <input class="form-check-input" type="radio" name="{{ item.id }}" id="{{ item.id }}_{{ val }}" value="{{ val }}" {% if avaliacao_existente and avaliacao_existente[item.id] == val %}checked{% endif %} required>
-                <label class="form-check-label" for="{{ item.id }}_{{ val }}">{{ label }}</label>
-            </div>
-        {% endfor %}
-        </div>
-    </div>
     {% endfor %}
-    {% endif %}
     
-    {% if orientador.avalia_curriculo or orientador.avalia_entrevista or orientador.avalia_afinidade %}
+    {% if secoes %}
     <button type="submit" class="btn btn-success mt-3">{% if avaliacao_existente %}Atualizar Avaliação{% else %}Enviar Avaliação{% endif %}</button>
     {% endif %}
 </form>""" + TPL_FOOTER
 
-# ALTERADO: Template do relatório para exibir o detalhamento completo da pontuação.
-TPL_RELATORIO = TPL_HEADER_ADMIN + """
+# Grelha com todos os candidatos do orientador, submetida de uma só vez para /avaliar/<token>/lote.
+TPL_GRELHA_AVALIACAO = TPL_HEADER_AVALIACAO + """
 <div class="d-flex justify-content-between align-items-center mb-3">
-    <h3>Relatório de Alocação Final</h3>
-    {% if alocacao %}
-    <button onclick="window.print();" class="btn btn-info no-print">Imprimir Relatório</button>
-    {% endif %}
+    <h3>Avaliação em grelha: {{ orientador.nome }}</h3>
+    <a href="{{ request.script_root }}/avaliar/{{ orientador.token }}" class="btn btn-secondary">Voltar à lista</a>
 </div>
-{% if data_processamento %}<p class="text-muted mb-4">Data e hora do servidor: {{ data_processamento }}</p>{% endif %}
+{% if not questoes %}
+    <div class="alert alert-warning">Este avaliador não possui nenhuma atribuição de avaliação configurada.</div>
+{% else %}
+<p>Preencha as notas (-2 a +2) dos candidatos que pretende avaliar; as linhas deixadas em branco são ignoradas. Todas as avaliações são gravadas de uma só vez.</p>
+<form method="post">
+<table class="table table-sm table-bordered">
+    <thead class="thead-light"><tr><th>Candidato</th>{% for q in questoes %}<th title="{{ q.texto }}">{{ q.texto.split(' ')[0] }}</th>{% endfor %}</tr></thead>
+    <tbody>
+    {% for c in candidatos %}{% set notas = notas_atuais.get(c.id, {}) %}
+    <tr><td>{{ c.nome }}</td>{% for q in questoes %}<td><select class="form-control form-control-sm" name="{{ c.id }}-{{ q.codigo }}"><option value=""></option>{% for n in notas_validas %}<option value="{{ n }}"{% if notas.get(q.codigo)|string == n|string %} selected{% endif %}>{{ '%+d'|format(n) if n else '0' }}</option>{% endfor %}</select></td>{% endfor %}</tr>
+    {% endfor %}
+    </tbody>
+</table>
+<button type="submit" class="btn btn-success">Gravar todas as avaliações</button>
+</form>
+{% endif %}""" + TPL_FOOTER
 
-{% macro render_detalhes_candidato(c, pontuacoes_por_candidato, orientadores) %}
-    {% if pontuacoes_por_candidato[c.id] %}
+# Blocos partilhados pelo relatório completo e pelos fragmentos que o resumo carrega a pedido.
+TPL_RELATORIO_FRAGMENTOS = """
+{% macro detalhes_pontuacoes(pontuacoes) %}
+    {% if pontuacoes %}
         <small class="form-text text-muted">
             <u>Avaliações recebidas (de orientadores com vagas):</u>
             <ul class="list-unstyled mb-0 mt-2">
-            {% for p in pontuacoes_por_candidato[c.id] %}
+            {% for p in pontuacoes %}
                 <li class="mb-2">
                     <strong>{{ p.orientador_nome }}: {{ "%.2f"|format(p.pontuacao) }}</strong>
                     <div class="detalhe-nota">
@@ -551,6 +3067,83 @@ TPL_RELATORIO = TPL_HEADER_ADMIN + """
     {% endif %}
 {% endmacro %}
 
+{% macro botao_detalhes(execucao_id, c) %}
+    <button class="btn btn-sm btn-link p-0 ml-2 no-print" data-fragmento="{{ request.script_root }}/relatorio/{{ execucao_id }}/candidato/{{ c.id }}" data-alvo="detalhes-{{ c.id }}">Ver pontuações</button><div id="detalhes-{{ c.id }}"></div>
+{% endmacro %}
+
+{% macro badge_preferencia(c) %}
+    {% if c.preferencia_indicada %}<span class="badge badge-info ml-2">Preferência Indicada{% if c.ordem_preferencia %} ({{ c.ordem_preferencia }}ª opção){% endif %}</span>{% endif %}
+{% endmacro %}
+
+{% macro estabilidade(dados) %}
+    {% if dados %}
+    <p class="mb-1"><strong>Pares bloqueantes:</strong> {{ dados.pares_bloqueantes }}
+        <small class="text-muted">(candidato e orientador que prefeririam ficar juntos a manter a alocação obtida)</small></p>
+    <p class="mb-4"><strong>Opção obtida pelos alocados:</strong>
+        {% for ordem, total in dados.ordens_obtidas %}{% if ordem %}{{ ordem }}ª opção{% else %}sem preferência indicada{% endif %}: {{ total }}{% if not loop.last %} &middot; {% endif %}{% else %}nenhum candidato alocado{% endfor %}</p>
+    {% endif %}
+{% endmacro %}
+
+{% macro lista_alocados(alocados, execucao_id) %}
+    {% for c in alocados %}
+    <li class="list-group-item">
+        {{ c.nome }} (<b>Pontuação de alocação: {{ c.pontuacao_alocacao }}</b>)
+        {{ badge_preferencia(c) }}
+        {{ botao_detalhes(execucao_id, c) }}
+    </li>
+    {% endfor %}
+{% endmacro %}
+
+{% macro lista_candidatos(candidatos, execucao_id=None) %}
+    {% for c in candidatos %}<li class="list-group-item">{{ c.nome }}{% if execucao_id %}{{ botao_detalhes(execucao_id, c) }}{% endif %}</li>{% endfor %}
+{% endmacro %}
+
+{% macro pesos_utilizados(configs_usadas, questionario) %}
+    <div class="row">
+        <div class="col-md-6">
+            <h5>Pesos Gerais</h5>
+            <p><strong>Peso do Preparo (CV):</strong> {{ (configs_usadas.get('peso_preparo', 0.5) * 100)|round|int }}%</p>
+            <p><strong>Peso da Afinidade (Entrevista + Afinidade):</strong> {{ (configs_usadas.get('peso_afinidade', 0.5) * 100)|round|int }}%</p>
+            <p><strong>Bônus por Preferência do Candidato:</strong> +{{ configs_usadas.get('peso_preferencia_candidato', 0.0) }} pontos</p>
+        </div>
+        <div class="col-md-6">
+            <h5>Pesos Individuais das Questões</h5>
+            <table class="table table-sm table-bordered">
+            {% for secao in questionario.secoes %}
+                <thead class="thead-light"><tr><th colspan="2">{{ secao.titulo }}</th></tr></thead>
+                <tbody>
+                {% for questao in secao.questoes %}
+                <tr><td>{{ questao.texto }}</td><td class="text-right" style="width: 20%;">{{ configs_usadas.get(questao.codigo, 1.0) }}</td></tr>
+                {% endfor %}
+                </tbody>
+            {% endfor %}
+            </table>
+        </div>
+    </div>
+{% endmacro %}
+"""
+
+# ALTERADO: Template do relatório para exibir o detalhamento completo da pontuação.
+TPL_RELATORIO = TPL_HEADER_ADMIN + """
+<div class="d-flex justify-content-between align-items-center mb-3">
+    <h3>Relatório de Alocação Final</h3>
+    {% if alocacao %}
+    <div class="no-print">
+        <div class="btn-group mr-2">
+            <a href="{{ request.script_root }}/exportar/pontuacoes.csv?execucao={{ execucao_id }}" class="btn btn-outline-secondary">Pontuações (CSV)</a>
+            <a href="{{ request.script_root }}/exportar/alocacao.csv?execucao={{ execucao_id }}" class="btn btn-outline-secondary">Alocação (CSV)</a>
+            <a href="{{ request.script_root }}/exportar/nao-alocados.csv?execucao={{ execucao_id }}" class="btn btn-outline-secondary">Não alocados (CSV)</a>
+        </div>
+        <button onclick="window.print();" class="btn btn-info">Imprimir Relatório</button>
+    </div>
+    {% endif %}
+</div>
+{% if data_processamento %}<p class="text-muted mb-4">Data e hora do servidor: {{ data_processamento }}{% if modo_alocacao %}<br>Algoritmo de alocação: {{ modo_alocacao }} (executado em {{ "%.1f"|format(tempo_alocacao_ms) }} ms){% endif %}</p>{% endif %}
+
+{% from 'relatorio_fragmentos.html' import detalhes_pontuacoes, pesos_utilizados, badge_preferencia, estabilidade as mostrar_estabilidade %}
+{{ mostrar_estabilidade(estabilidade) }}
+{% macro render_detalhes_candidato(c, pontuacoes_por_candidato, orientadores) %}{{ detalhes_pontuacoes(pontuacoes_por_candidato[c.id]) }}{% endmacro %}
+
 {% if alocacao %}
     {% for o_id, alocados in alocacao.items() %}
     <div class="card mb-3">
@@ -560,7 +3153,7 @@ TPL_RELATORIO = TPL_HEADER_ADMIN + """
                 {% for c in alocados %}
                 <li class="list-group-item">
                     {{ c.nome }} (<b>Pontuação de alocação: {{ c.pontuacao_alocacao }}</b>)
-                    {% if c.preferencia_indicada %}<span class="badge badge-info ml-2">Preferência Indicada</span>{% endif %}
+                    {{ badge_preferencia(c) }}
                     {{ render_detalhes_candidato(c, pontuacoes_por_candidato, orientadores) }}
                 </li>
                 {% endfor %}
@@ -591,33 +3184,83 @@ TPL_RELATORIO = TPL_HEADER_ADMIN + """
     <hr class="mt-4">
     <h4 class="mt-4">Pesos Utilizados na Alocação</h4>
     {% if configs_usadas %}
-        <div class="row">
-            <div class="col-md-6">
-                <h5>Pesos Gerais</h5>
-                <p><strong>Peso do Preparo (CV):</strong> {{ (configs_usadas.get('peso_preparo', 0.5) * 100)|round|int }}%</p>
-                <p><strong>Peso da Afinidade (Entrevista + Afinidade):</strong> {{ (configs_usadas.get('peso_afinidade', 0.5) * 100)|round|int }}%</p>
-                <p><strong>Bônus por Preferência do Candidato:</strong> +{{ configs_usadas.get('peso_preferencia_candidato', 0.0) }} pontos</p>
-            </div>
-            <div class="col-md-6">
-                <h5>Pesos Individuais das Questões</h5>
-                <table class="table table-sm table-bordered">
-                {% for secao, questoes in questionario.items() %}
-                    <thead class="thead-light"><tr><th colspan="2">{{ secao }}</th></tr></thead>
-                    <tbody>
-                    {% for questao in questoes %}
-                    <tr><td>{{ questao.texto }}</td><td class="text-right" style="width: 20%;">{{ configs_usadas.get(questao.id, 1.0) }}</td></tr>
-                    {% endfor %}
-                    </tbody>
-                {% endfor %}
-                </table>
-            </div>
-        </div>
+        {{ pesos_utilizados(configs_usadas, questionario) }}
     {% else %}<p class="text-muted">Nenhuma alocação foi executada para exibir os pesos utilizados.</p>{% endif %}
 {% else %}
     <div class="alert alert-info no-print">O processo de alocação ainda não foi executado.</div>
 {% endif %}
 """ + TPL_FOOTER
 
+# Resumo do relatório: só os totais da execução. As listas de cada orientador, os não alocados, os não avaliados e o
+# detalhe das pontuações de cada candidato são pedidos (em JSON) quando o utilizador os abre.
+TPL_RELATORIO_RESUMO = TPL_HEADER_ADMIN + """
+{% from 'relatorio_fragmentos.html' import pesos_utilizados, estabilidade %}
+<div class="d-flex justify-content-between align-items-center mb-3">
+    <h3>Relatório de Alocação Final</h3>
+    {% if resumo %}
+    <div class="no-print">
+        <div class="btn-group mr-2">
+            <a href="{{ request.script_root }}/exportar/pontuacoes.csv?execucao={{ resumo.execucao_id }}" class="btn btn-outline-secondary">Pontuações (CSV)</a>
+            <a href="{{ request.script_root }}/exportar/alocacao.csv?execucao={{ resumo.execucao_id }}" class="btn btn-outline-secondary">Alocação (CSV)</a>
+            <a href="{{ request.script_root }}/exportar/nao-alocados.csv?execucao={{ resumo.execucao_id }}" class="btn btn-outline-secondary">Não alocados (CSV)</a>
+        </div>
+        <a href="{{ request.script_root }}/relatorio/completo?execucao={{ resumo.execucao_id }}" class="btn btn-info">Versão completa para impressão</a>
+    </div>
+    {% endif %}
+</div>
+{% if resumo %}
+    <p class="text-muted mb-4">Data e hora do servidor: {{ resumo.data_processamento }}<br>Algoritmo de alocação: {{ resumo.modo_alocacao }} (executado em {{ "%.1f"|format(resumo.tempo_alocacao_ms) }} ms)</p>
+    {{ estabilidade(resumo.estabilidade) }}
+    {% for o in resumo.orientadores %}
+    <div class="card mb-3">
+        <div class="card-header d-flex justify-content-between align-items-center">
+            <span><strong>{{ o.nome }}</strong> (Vagas: {{ o.vagas }}) &middot; {{ o.alocados }} alocado(s)</span>
+            {% if o.alocados %}<button class="btn btn-sm btn-outline-primary" data-fragmento="{{ request.script_root }}/relatorio/{{ resumo.execucao_id }}/orientador/{{ o.id }}" data-alvo="orientador-{{ o.id }}">Mostrar candidatos</button>{% endif %}
+        </div>
+        <ul class="list-group list-group-flush" id="orientador-{{ o.id }}">{% if not o.alocados %}<li class="list-group-item">Nenhum candidato alocado.</li>{% endif %}</ul>
+    </div>
+    {% endfor %}
+    <h4 class="mt-4">Candidatos Não Alocados ({{ resumo.total_nao_alocados }})</h4>
+    {% if resumo.total_nao_alocados %}
+        <ul class="list-group" id="nao-alocados"></ul>
+        <button class="btn btn-sm btn-outline-primary mt-2" data-fragmento="{{ request.script_root }}/relatorio/{{ resumo.execucao_id }}/nao-alocados" data-alvo="nao-alocados" data-paginado>Mostrar</button>
+    {% else %}
+        <p>Todos os candidatos avaliados foram alocados.</p>
+    {% endif %}
+    <hr class="mt-4">
+    <h4 class="mt-4">Candidatos não selecionados ({{ total_nao_avaliados }})</h4>
+    <p class="text-muted">Os candidatos abaixo não receberam nenhuma avaliação e, portanto, não participaram do processo de alocação.</p>
+    {% if total_nao_avaliados %}
+        <ul class="list-group" id="nao-avaliados"></ul>
+        <button class="btn btn-sm btn-outline-primary mt-2" data-fragmento="{{ request.script_root }}/relatorio/nao-avaliados" data-alvo="nao-avaliados" data-paginado>Mostrar</button>
+    {% else %}<p>Todos os candidatos registados foram avaliados.</p>{% endif %}
+    <hr class="mt-4">
+    <h4 class="mt-4">Pesos Utilizados na Alocação</h4>
+    {{ pesos_utilizados(resumo.configs_usadas, questionario) }}
+    <script>
+    document.addEventListener('click', function (evento) {
+        var botao = evento.target.closest('[data-fragmento]');
+        if (!botao) { return; }
+        evento.preventDefault();
+        var url = botao.dataset.fragmento + (botao.dataset.apos ? '?apos=' + botao.dataset.apos : '');
+        botao.disabled = true;
+        fetch(url, {credentials: 'same-origin'}).then(function (resposta) { return resposta.json(); }).then(function (dados) {
+            document.getElementById(botao.dataset.alvo).insertAdjacentHTML('beforeend', dados.html);
+            if ('paginado' in botao.dataset && dados.proximo !== null) {
+                botao.dataset.apos = dados.proximo;
+                botao.textContent = 'Carregar mais';
+                botao.disabled = false;
+            } else {
+                botao.remove();
+            }
+        }).catch(function () { botao.disabled = false; });
+    });
+    </script>
+{% else %}
+    <div class="alert alert-info no-print">O processo de alocação ainda não foi executado.</div>
+{% endif %}
+""" + TPL_FOOTER
+
 TPL_AJUDA_CONTENT = r"""
 <div class="card"><div class="card-body">
 <h2 class="card-title">Sistema de Apoio à Seleção e Alocação de Candidatos (SASAC)</h2><hr>
@@ -654,55 +3297,741 @@ TPL_AJUDA_CONTENT = r"""
     <li>Se ambas as condições forem satisfeitas (candidato livre e orientador com vagas), o candidato <em>c</em> é permanentemente alocado ao orientador <em>o</em>. O contador de vagas do orientador é decrementado e o candidato é marcado como alocado.</li>
     <li>O processo continua até que a lista seja percorrida por completo.</li>
 </ol>
+<p>Em alternativa, o administrador pode escolher a <b>alocação ótima</b>. Neste modo, a alocação é resolvida exatamente como um problema de fluxo de custo mínimo: escolhe-se, respeitando as vagas de cada orientador, a alocação com a maior soma de pontuações finais. Um candidato pode ficar por alocar se isso aumentar a soma (por exemplo, quando a sua única vaga possível rende mais a outro candidato, ou quando as suas pontuações são negativas). A variante <b>ótima com cobertura</b> maximiza primeiro o número de candidatos alocados e, entre todas as soluções com esse número de alocados, escolhe a que tem a maior soma de pontuações finais. Ao contrário do algoritmo guloso, uma escolha feita no início nunca impede uma solução globalmente melhor. O relatório indica qual dos algoritmos foi executado e quanto tempo demorou.</p>
+<p>A terceira opção é a <b>alocação estável</b>, por aceitação diferida (algoritmo de Gale–Shapley, com os candidatos a propor). Cada candidato ordena os orientadores que indicou como preferidos (1 = preferido) e, depois destes, os restantes orientadores que o avaliaram, por pontuação final decrescente. Cada orientador ordena os candidatos pela pontuação final do par. Em cada ronda, os candidatos livres propõem ao orientador seguinte da sua lista; o orientador aceita provisoriamente os melhores até ao número de vagas e rejeita os restantes, que passam a propor ao orientador seguinte. O processo termina quando nenhum candidato livre tem orientadores por propor.</p>
+<p>Um <b>par bloqueante</b> é um candidato <em>c</em> e um orientador <em>o</em> que prefeririam ficar juntos à alocação obtida: <em>c</em> prefere <em>o</em> ao orientador que recebeu (ou ficou por alocar) e <em>o</em> tem uma vaga livre ou prefere <em>c</em> ao pior candidato que aceitou. A alocação estável não tem pares bloqueantes; os algoritmos guloso e ótimos não o garantem. O relatório mostra, em cada execução, o número de <b>pares bloqueantes</b> e a <b>opção obtida</b>, ou seja, a posição do orientador atribuído na ordem indicada pelo candidato (1.ª, 2.ª, ...; sem valor se o orientador não estava entre os indicados). O bónus de preferência continua a somar-se à pontuação final em todos os algoritmos.</p>
 </div></div>
 """
 TPL_AJUDA = TPL_HEADER_ADMIN + TPL_AJUDA_CONTENT + TPL_FOOTER
 
+# --- CACHE DE TEMPLATES ---
+# Os templates continuam definidos como constantes, mas são servidos por um loader do Jinja: cada um é compilado
+# uma única vez (no arranque) e reutilizado em todos os pedidos, em vez de ser recompilado por render_template_string.
+TEMPLATES = {
+    'relatorio.html': TPL_RELATORIO,
+    'relatorio_resumo.html': TPL_RELATORIO_RESUMO,
+    'relatorio_fragmentos.html': TPL_RELATORIO_FRAGMENTOS,
+    'login.html': TPL_LOGIN,
+    'ajuda.html': TPL_AJUDA,
+    'admin.html': TPL_ADMIN,
+    'processos.html': TPL_PROCESSOS,
+    'orientadores.html': TPL_ORIENTADOR_LIST,
+    'orientador_form.html': TPL_ORIENTADOR_FORM,
+    'candidatos.html': TPL_CANDIDATO_LIST,
+    'candidato_form.html': TPL_CANDIDATO_FORM,
+    'avaliar_index.html': TPL_AVALIAR_INDEX,
+    'lista_candidatos.html': TPL_LISTA_CANDIDATOS,
+    'form_avaliacao.html': TPL_FORM_AVALIACAO,
+    'grelha_avaliacao.html': TPL_GRELHA_AVALIACAO,
+}
+
+class CarregadorTemplatesConstantes(BaseLoader):
+    def __init__(self, templates):
+        self.templates = templates
+
+    def get_source(self, environment, template):
+        if template not in self.templates:
+            raise TemplateNotFound(template)
+        return self.templates[template], None, lambda: True
+
+    def list_templates(self):
+        return sorted(self.templates)
+
+app.jinja_loader = CarregadorTemplatesConstantes(TEMPLATES)
+
+def aquecer_templates():
+    for nome in TEMPLATES:
+        app.jinja_env.get_template(nome)
+
+aquecer_templates()
+
+# Microbenchmark das páginas do portal de avaliação (as mais acedidas): compilação a cada pedido vs. template em cache.
+@click.command('bench-templates')
+@click.option('--repeticoes', default=500, show_default=True)
+@click.option('--candidatos', default=200, show_default=True)
+def bench_templates_command(repeticoes, candidatos):
+    orientador = {'id': 1, 'nome': 'Orientador de Teste', 'token': 'token-de-teste', 'avalia_curriculo': 1, 'avalia_entrevista': 1, 'avalia_afinidade': 1}
+    lista = [{'id': i, 'nome': f'Candidato {i}'} for i in range(1, candidatos + 1)]
+    paginas = {
+        'lista_candidatos.html': dict(orientador=orientador, candidatos=lista, avaliados={c['id'] for c in lista[::2]}),
+        'form_avaliacao.html': dict(orientador=orientador, candidato=lista[0], questionario=questionario_padrao(), avaliacao_existente=None),
+    }
+    with app.test_request_context():
+        for nome, contexto in paginas.items():
+            tempos = {}
+            for rotulo, renderizar in (('render_template_string', lambda: render_template_string(TEMPLATES[nome], **contexto)), ('cache', lambda: render_template(nome, **contexto))):
+                renderizar()
+                inicio = time.perf_counter()
+                for _ in range(repeticoes):
+                    renderizar()
+                tempos[rotulo] = (time.perf_counter() - inicio) / repeticoes * 1000
+            click.echo(f"{nome}: {tempos['render_template_string']:.3f} ms -> {tempos['cache']:.3f} ms por página ({tempos['render_template_string'] / tempos['cache']:.1f}x)")
+
+app.cli.add_command(bench_templates_command)
+
+# --- DADOS SINTÉTICOS E BENCHMARKS ---
+# Probabilidade de cada atribuição, pela ordem de ATRIBUICOES (currículo, entrevista, afinidade).
+MISTURAS_ATRIBUICOES = {
+    'todas': (1.0, 1.0, 1.0),
+    'mista': (0.4, 0.7, 0.7),
+    'esparsa': (0.15, 0.4, 0.4),
+}
+
+def gerar_coorte(db, candidatos, orientadores, densidade, mistura='mista', vagas_max=3, preferencias=3, semente=None):
+    rnd = random.Random(semente)
+    primeiro_orientador, primeiro_candidato = proximo_id(db, 'orientadores'), proximo_id(db, 'candidatos')
+    ids_orientadores = range(primeiro_orientador, primeiro_orientador + orientadores)
+    ids_candidatos = range(primeiro_candidato, primeiro_candidato + candidatos)
+    gerados = []
+    for oid in ids_orientadores:
+        orientador = {'id': oid, 'nome': f"Orientador sintético {oid}", 'vagas': rnd.randint(0, vagas_max), 'token': secrets.token_urlsafe(16)}
+        orientador.update((atribuicao, int(rnd.random() < p)) for atribuicao, p in zip(ATRIBUICOES, MISTURAS_ATRIBUICOES[mistura]))
+        gerados.append(orientador)
+    db.executemany(
+        "INSERT INTO orientadores (id, nome, vagas, token, avalia_curriculo, avalia_entrevista, avalia_afinidade) "
+        "VALUES (:id, :nome, :vagas, :token, :avalia_curriculo, :avalia_entrevista, :avalia_afinidade)",
+        gerados
+    )
+    db.executemany("INSERT INTO candidatos (id, nome) VALUES (?, ?)", ((cid, f"Candidato sintético {cid}") for cid in ids_candidatos))
+    linhas_preferencias = [
+        (cid, oid, ordem) for cid in ids_candidatos for ordem, oid in enumerate(rnd.sample(ids_orientadores, min(preferencias, orientadores)), 1)
+    ]
+    db.executemany("INSERT INTO preferencias_candidatos (candidato_id, orientador_id, ordem) VALUES (?, ?, ?)", linhas_preferencias)
+    # Cada orientador avalia uma amostra dos candidatos e responde apenas às questões das suas secções, como no formulário.
+    questionario = carregar_questionario(db)
+    primeira_avaliacao = proximo_id(db, 'avaliacoes')
+    linhas_avaliacoes, linhas_respostas = [], []
+    for orientador in gerados:
+        questoes = [q['id'] for q in questionario.do_orientador(orientador)]
+        if not questoes:
+            continue
+        for cid in sorted(rnd.sample(ids_candidatos, round(densidade * candidatos))):
+            avaliacao_id = primeira_avaliacao + len(linhas_avaliacoes)
+            linhas_avaliacoes.append((avaliacao_id, orientador['id'], cid))
+            linhas_respostas.extend((avaliacao_id, qid, rnd.choice(NOTAS_VALIDAS)) for qid in questoes)
+    db.executemany("INSERT INTO avaliacoes (id, orientador_id, candidato_id) VALUES (?, ?, ?)", linhas_avaliacoes)
+    db.executemany("INSERT INTO respostas (avaliacao_id, questao_id, nota) VALUES (?, ?, ?)", linhas_respostas)
+    reconstruir_indices(db)
+    db.commit()
+    return {'orientadores': orientadores, 'candidatos': candidatos, 'preferencias': len(linhas_preferencias), 'avaliacoes': len(linhas_avaliacoes)}
+
+@click.command('gerar-dados')
+@click.option('--candidatos', default=1000, show_default=True)
+@click.option('--orientadores', default=100, show_default=True)
+@click.option('--densidade', type=click.FloatRange(0, 1), default=0.1, show_default=True, help='Fração dos candidatos avaliada por cada orientador.')
+@click.option('--mistura', type=click.Choice(list(MISTURAS_ATRIBUICOES)), default='mista', show_default=True, help='Distribuição das atribuições dos orientadores.')
+@click.option('--vagas-max', default=3, show_default=True, help='Vagas por orientador, sorteadas entre 0 e este valor.')
+@click.option('--preferencias', default=3, show_default=True, help='Orientadores preferidos por candidato.')
+@click.option('--semente', type=int, default=None, help='Semente do gerador, para repetir a mesma coorte.')
+@click.option('--limpar', is_flag=True, help='Reinicializa a base de dados antes de gerar.')
+@with_appcontext
+@opcao_processo
+def gerar_dados_command(candidatos, orientadores, densidade, mistura, vagas_max, preferencias, semente, limpar):
+    if limpar:
+        init_db_logic()
+    elif not base_inicializada(get_db()):
+        click.echo('A base de dados ainda não foi inicializada. Execute "flask init-db" ou use --limpar.')
+        return
+    inicio = time.perf_counter()
+    n = gerar_coorte(get_db(), candidatos, orientadores, densidade, mistura, vagas_max, preferencias, semente)
+    click.echo(f"Gerados {n['orientadores']} orientadores, {n['candidatos']} candidatos, {n['preferencias']} preferências e {n['avaliacoes']} avaliações em {time.perf_counter() - inicio:.1f} s.")
+
+app.cli.add_command(gerar_dados_command)
+
+ESCALAS_BENCHMARK = {
+    '100': dict(candidatos=100, orientadores=20, densidade=0.3),
+    '1k': dict(candidatos=1000, orientadores=100, densidade=0.1),
+    '10k': dict(candidatos=10000, orientadores=500, densidade=0.02),
+}
+
+def medir(funcao, repeticoes):
+    funcao()  # Aquecimento (caches do SQLite, templates).
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return {'mediana_ms': median(tempos), 'minimo_ms': min(tempos), 'maximo_ms': max(tempos)}
+
+# Cenários medidos, pela ordem em que correm: a página inicial precisa de uma execução já gravada.
+def cenarios_benchmark(db, rnd):
+    orientador = db.execute(
+        "SELECT * FROM orientadores WHERE avalia_curriculo OR avalia_entrevista OR avalia_afinidade ORDER BY id LIMIT 1"
+    ).fetchone()
+    questoes = [q['codigo'] for q in carregar_questionario(db).do_orientador(orientador)]
+    proximo_candidato = itertools.cycle([row['id'] for row in db.execute("SELECT id FROM candidatos ORDER BY id")])
+    # O portal de avaliação não usa sessão: sem cookies, as mensagens flash das submissões não se acumulam.
+    administrador, portal = app.test_client(), app.test_client(use_cookies=False)
+    with administrador.session_transaction() as sessao:
+        sessao['logged_in'] = True
+
+    def pedido(cliente, metodo, url, estado_esperado, dados=None):
+        resposta = cliente.open(url, method=metodo, data=dados)
+        if resposta.status_code != estado_esperado:
+            raise click.ClickException(f"{metodo} {url} devolveu {resposta.status_code}")
+
+    return {
+        'executar_alocacao[guloso]': lambda: executar_alocacao(db, modo='guloso'),
+        'executar_alocacao[otimo]': lambda: executar_alocacao(db, modo='otimo'),
+        'home': lambda: pedido(administrador, 'GET', '/', 200),
+        'avaliar_home': lambda: pedido(portal, 'GET', f"/avaliar/{orientador['token']}", 200),
+        'submeter_avaliacao': lambda: pedido(
+            portal, 'POST', f"/avaliar/{orientador['token']}/{next(proximo_candidato)}", 302,
+            {qid: str(rnd.choice(NOTAS_VALIDAS)) for qid in questoes}
+        ),
+    }
+
+def versao_do_codigo():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Corre sobre bases temporárias, geradas de novo em cada escala; a base configurada não é tocada.
+@click.command('benchmark')
+@click.option('--escala', 'escalas', multiple=True, type=click.Choice(list(ESCALAS_BENCHMARK)), help='Pode repetir-se (por omissão, 100 e 1k).')
+@click.option('--mistura', type=click.Choice(list(MISTURAS_ATRIBUICOES)), default='mista', show_default=True)
+@click.option('--repeticoes', default=5, show_default=True)
+@click.option('--semente', default=42, show_default=True)
+@click.option('--saida', type=click.Path(dir_okay=False), default=None, help='Ficheiro JSON onde gravar os resultados.')
+@click.option('--comparar', type=click.Path(exists=True, dir_okay=False), default=None, help='JSON de um benchmark anterior, para comparar as medianas.')
+def benchmark_command(escalas, mistura, repeticoes, semente, saida, comparar):
+    escalas = escalas or ('100', '1k')
+    anterior = {}
+    if comparar:
+        with open(comparar, encoding='utf-8') as f:
+            anterior = {(r['escala'], r['cenario']): r['mediana_ms'] for r in json.load(f)['resultados']}
+    resultados = []
+    caminho_original = app.config['DATABASE']
+    with tempfile.TemporaryDirectory() as pasta:
+        try:
+            for escala in escalas:
+                app.config['DATABASE'] = os.path.join(pasta, f'benchmark-{escala}.db')
+                with app.app_context():
+                    init_db_logic()
+                    db = get_db()
+                    inicio = time.perf_counter()
+                    n = gerar_coorte(db, mistura=mistura, semente=semente, **ESCALAS_BENCHMARK[escala])
+                    click.echo(f"Escala {escala}: {n['orientadores']} orientadores, {n['candidatos']} candidatos, {n['avaliacoes']} avaliações (geradas em {time.perf_counter() - inicio:.1f} s)")
+                    cenarios = cenarios_benchmark(db, random.Random(semente))
+                    for cenario, funcao in cenarios.items():
+                        medida = {'escala': escala, 'cenario': cenario, **medir(funcao, repeticoes)}
+                        resultados.append(medida)
+                        linha = f"  {cenario}: mediana {medida['mediana_ms']:.2f} ms (mín. {medida['minimo_ms']:.2f}, máx. {medida['maximo_ms']:.2f})"
+                        if (escala, cenario) in anterior:
+                            linha += f"  | antes {anterior[escala, cenario]:.2f} ms ({medida['mediana_ms'] / anterior[escala, cenario]:.2f}x)"
+                        click.echo(linha)
+                descartar_base_de_dados(app.config['DATABASE'])
+        finally:
+            app.config['DATABASE'] = caminho_original
+    if saida:
+        relatorio = {
+            'commit': versao_do_codigo(),
+            'criado_em': datetime.now().astimezone().isoformat(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'numpy': np.__version__ if np is not None else None,
+            'motor': app.config['MOTOR_PONTUACAO'],
+            'mistura': mistura,
+            'repeticoes': repeticoes,
+            'semente': semente,
+            'escalas': {escala: ESCALAS_BENCHMARK[escala] for escala in escalas},
+            'resultados': resultados,
+        }
+        with open(saida, 'w', encoding='utf-8') as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2)
+        click.echo(f"Resultados gravados em {saida}.")
+
+app.cli.add_command(benchmark_command)
+
+# Leituras integrais intencionais, tal como a aplicação as escreve, com o motivo de cada uma. A comparação é feita
+# sobre a forma normalizada da instrução inteira: qualquer outro SCAN sem índice nas instruções registadas é assinalado.
+LEITURAS_INTEGRAIS = {normalizar_instrucao(sql): motivo for sql, motivo in [
+    ("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'orientadores'", "catálogo do esquema (uma linha por tabela, índice ou trigger)"),
+    ("SELECT * FROM configuracoes", "todas as configurações, lidas de uma vez para a cache"),
+    ("SELECT * FROM secoes ORDER BY ordem, id", "questionário completo, lido de uma vez para a cache"),
+    ("SELECT q.*, s.atribuicao, s.indice FROM questoes q JOIN secoes s ON s.id = q.secao_id ORDER BY q.id", "questionário completo, lido de uma vez para a cache"),
+    # Só a primeira linha é lida: o SCAN segue a ordem do rowid, sem B-tree temporária, e pára no LIMIT.
+    ("SELECT * FROM execucoes_alocacao ORDER BY id DESC LIMIT 1", "última execução (pára na primeira linha)"),
+    ("SELECT id FROM execucoes_alocacao ORDER BY id DESC LIMIT 1", "última execução (pára na primeira linha)"),
+    ("SELECT * FROM tarefas_alocacao ORDER BY id DESC LIMIT 1", "última tarefa de alocação (pára na primeira linha)"),
+    ("SELECT MAX(m) FROM (SELECT COALESCE(MAX(id), 0) AS m FROM orientadores UNION ALL SELECT seq FROM sqlite_sequence WHERE name = ?)", "sqlite_sequence tem uma linha por tabela"),
+    ("SELECT MAX(m) FROM (SELECT COALESCE(MAX(id), 0) AS m FROM candidatos UNION ALL SELECT seq FROM sqlite_sequence WHERE name = ?)", "sqlite_sequence tem uma linha por tabela"),
+    ("SELECT COUNT(*) FROM candidatos c WHERE NOT EXISTS (SELECT 1 FROM avaliacoes a WHERE a.candidato_id = c.id)", "contagem sobre todos os candidatos (resumo)"),
+    ("SELECT * FROM candidatos", "alocação e relatório completo: todos os candidatos"),
+    ("SELECT * FROM orientadores", "alocação: todos os orientadores"),
+    ("SELECT id, orientador_id, candidato_id FROM avaliacoes", "motor 'python': todas as avaliações"),
+    ("SELECT r.avaliacao_id, r.questao_id, r.nota FROM avaliacoes a JOIN respostas r ON r.avaliacao_id = a.id  ORDER BY r.avaliacao_id, r.questao_id", "motor 'python': todas as notas"),
+    ("SELECT id, candidato_id, orientador_id FROM avaliacoes ORDER BY id", "motor 'numpy': todas as avaliações"),
+    ("SELECT avaliacao_id, questao_id, nota FROM respostas ORDER BY avaliacao_id, questao_id", "motor 'numpy': todas as notas"),
+    ("SELECT ia.candidato_id, ia.orientador_id, ip.ipc, ia.iaoc FROM indices_afinidade ia JOIN indices_preparo ip ON ip.candidato_id = ia.candidato_id "
+     "JOIN orientadores o ON o.id = ia.orientador_id WHERE o.vagas > 0 ORDER BY ia.avaliacao_id", "motor 'indices': todos os pares"),
+    (montar_sql_pontuacoes(1), "motor 'sql': todas as notas"),
+    ("SELECT candidato_id, questao_id, soma, contagem FROM notas_curriculo_agregadas ", "reconstrução dos índices de preparo de todos os candidatos"),
+    (f"INSERT INTO notas_curriculo_agregadas (candidato_id, questao_id, soma, contagem) SELECT a.candidato_id, q.codigo, SUM(r.nota), COUNT(*) FROM avaliacoes a "
+     f"JOIN orientadores o ON o.id = a.orientador_id JOIN respostas r ON r.avaliacao_id = a.id JOIN questoes q ON q.id = r.questao_id JOIN secoes s ON s.id = q.secao_id "
+     f"WHERE s.indice = 'preparo' AND {SQL_RESPOSTA_VALIDA}  GROUP BY a.candidato_id, q.id", "reconstrução dos índices de preparo de todos os candidatos"),
+    (f"SELECT a.id, a.orientador_id, a.candidato_id, {', '.join(f'o.{a}' for a in ATRIBUICOES)} FROM avaliacoes a JOIN orientadores o ON o.id = a.orientador_id ",
+     "reconstrução dos índices de afinidade de todos os pares"),
+    ("SELECT * FROM orientadores WHERE vagas > 0", "varrimento de pesos: todos os orientadores com vagas"),
+    ("SELECT a.id, a.candidato_id, a.orientador_id FROM avaliacoes a JOIN orientadores o ON o.id = a.orientador_id WHERE o.vagas > 0 ORDER BY a.id", "varrimento de pesos: todos os pares"),
+    ("SELECT r.avaliacao_id, r.questao_id, r.nota FROM avaliacoes a JOIN respostas r ON r.avaliacao_id = a.id WHERE a.orientador_id IN (SELECT id FROM orientadores WHERE vagas > 0) ORDER BY r.avaliacao_id, r.questao_id",
+     "varrimento de pesos: todas as notas"),
+    ("SELECT candidato_id, questao_id, soma, contagem FROM notas_curriculo_agregadas WHERE contagem > 0", "varrimento de pesos: notas de currículo de todos os candidatos"),
+    ("SELECT e.id, e.data_processamento, e.motor, e.modo_alocacao, e.tempo_alocacao_ms, (SELECT COUNT(*) FROM execucao_alocacoes a WHERE a.execucao_id = e.id AND a.orientador_id IS NOT NULL) AS alocados "
+     "FROM execucoes_alocacao e ORDER BY e.id", "listar-execucoes: todas as execuções"),
+    # Com triggers na tabela, o SQLite apaga linha a linha em vez de esvaziar a tabela de uma vez.
+    ("DELETE FROM respostas", "apagar todas as avaliações"),
+    ("DELETE FROM avaliacoes", "apagar todas as avaliações"),
+    ("DELETE FROM execucoes_alocacao", "apagar todas as execuções"),
+    ("SELECT id, codigo FROM questoes ORDER BY id", "migração 9: todas as questões"),
+    ("UPDATE preferencias_candidatos SET ordem = (SELECT COUNT(*) FROM preferencias_candidatos p WHERE p.candidato_id = preferencias_candidatos.candidato_id "
+     "AND p.orientador_id <= preferencias_candidatos.orientador_id) WHERE ordem IS NULL", "migração 7: numerar as preferências existentes"),
+]}
+
+# Percorre a aplicação sobre a coorte gerada: a alocação com todos os motores e modos, todas as páginas e formulários
+# (como administrador e no portal de avaliação) e os comandos que leem ou gravam dados. As operações que apagam dados
+# ficam para o fim. Os ids usados no percurso são lidos pela ligação auxiliar, sem trace, para que essas consultas
+# não entrem no registo.
+def percorrer_aplicacao(db, auxiliar, rnd, pasta):
+    for motor in MOTORES_PONTUACAO:
+        for modo in ESTRATEGIAS_ALOCACAO:
+            executar_alocacao(db, motor, modo)
+    administrador, portal = app.test_client(), app.test_client(use_cookies=False)
+
+    def pedido(cliente, metodo, url, dados=None, json=None):
+        resposta = cliente.open(url, method=metodo, data=dados, json=json)
+        resposta.get_data()  # As exportações só consultam a base de dados à medida que a resposta é lida.
+        resposta.close()
+        if resposta.status_code >= 400:
+            raise click.ClickException(f"{metodo} {url} devolveu {resposta.status_code}")
+        return resposta
+
+    def comando(*args):
+        resultado = app.test_cli_runner().invoke(args=list(args))
+        if resultado.exit_code != 0:
+            raise click.ClickException(f"flask {' '.join(args)} terminou com o código {resultado.exit_code}: {resultado.output}")
+
+    pedido(administrador, 'GET', '/login')
+    pedido(administrador, 'POST', '/login', {'password': app.config['ADMIN_PASSWORD']})
+    orientador = auxiliar.execute("SELECT * FROM orientadores WHERE avalia_curriculo OR avalia_entrevista OR avalia_afinidade ORDER BY avalia_curriculo + avalia_entrevista + avalia_afinidade DESC, id LIMIT 1").fetchone()
+    questoes = [q['codigo'] for q in carregar_questionario(db).do_orientador(orientador)]
+    candidatos = [row['id'] for row in auxiliar.execute("SELECT id FROM candidatos ORDER BY id")]
+    execucoes = [row['id'] for row in auxiliar.execute("SELECT id FROM execucoes_alocacao ORDER BY id")]
+    execucao_id, candidato_id, token = execucoes[-1], candidatos[0], orientador['token']
+    alocado = auxiliar.execute("SELECT orientador_id FROM execucao_alocacoes WHERE execucao_id = ? AND orientador_id IS NOT NULL LIMIT 1", (execucao_id,)).fetchone()
+    paginas = [
+        '/', '/ajuda', '/admin', '/processos', '/orientadores', '/orientadores/add', f"/orientadores/edit/{orientador['id']}",
+        '/candidatos', '/candidatos/add', f"/candidatos/edit/{candidato_id}",
+        '/relatorio/completo', f"/relatorio/completo?execucao={execucoes[0]}", '/relatorio/nao-avaliados', f"/relatorio/nao-avaliados?apos={candidato_id}",
+        f"/relatorio/{execucao_id}/orientador/{alocado['orientador_id'] if alocado else orientador['id']}",
+        f"/relatorio/{execucao_id}/nao-alocados", f"/relatorio/{execucao_id}/nao-alocados?apos={candidato_id}",
+        f"/relatorio/{execucao_id}/candidato/{candidato_id}",
+    ] + [f"/exportar/{conjunto}.{formato}?execucao={execucao_id}" for conjunto in CONSULTAS_EXPORTACAO for formato in FORMATOS_EXPORTACAO]
+    for url in paginas:
+        pedido(administrador, 'GET', url)
+    for url in ('/avaliar', f"/avaliar/{token}", f"/avaliar/{token}/{candidato_id}", f"/avaliar/{token}/lote"):
+        pedido(portal, 'GET', url)
+
+    notas = lambda: {codigo: str(rnd.choice(NOTAS_VALIDAS)) for codigo in questoes}
+    pedido(portal, 'POST', f"/avaliar/{token}/{candidatos[1]}", notas())
+    pedido(portal, 'POST', f"/avaliar/{token}/lote", json={'avaliacoes': [{'candidato_id': cid, **notas()} for cid in candidatos[:3]]})
+    pedido(portal, 'POST', f"/avaliar/{token}/lote", {f"{cid}-{codigo}": valor for cid in candidatos[3:5] for codigo, valor in notas().items()})
+    pedido(administrador, 'POST', '/configuracoes', {'peso_preparo': '60', 'peso_preferencia_candidato': '0.4'})
+    for modo in ESTRATEGIAS_ALOCACAO:
+        pedido(administrador, 'POST', '/processar', {'modo_alocacao': modo})
+        tarefa_id = auxiliar.execute("SELECT MAX(id) FROM tarefas_alocacao").fetchone()[0]
+        while pedido(administrador, 'GET', f"/tarefas/{tarefa_id}").get_json()['estado'] in ('pendente', 'em_execucao'):
+            time.sleep(0.05)
+
+    pedido(administrador, 'POST', '/orientadores/add', {'nome': 'Orientador de teste', 'vagas': '2', 'avalia_curriculo': '1', 'avalia_afinidade': '1'})
+    novo_orientador = auxiliar.execute("SELECT MAX(id) FROM orientadores").fetchone()[0]
+    pedido(administrador, 'POST', f"/orientadores/edit/{novo_orientador}", {'nome': 'Orientador de teste', 'vagas': '3', 'avalia_entrevista': '1'})
+    pedido(administrador, 'POST', '/candidatos/add', {'nome': 'Candidato de teste', 'preferencias': [str(orientador['id']), str(novo_orientador)], f"ordem_{novo_orientador}": '1'})
+    novo_candidato = auxiliar.execute("SELECT MAX(id) FROM candidatos").fetchone()[0]
+    pedido(administrador, 'POST', f"/candidatos/edit/{novo_candidato}", {'nome': 'Candidato de teste', 'preferencias': [str(orientador['id'])]})
+    pedido(administrador, 'POST', f"/orientadores/delete/{orientador['id']}")
+    pedido(administrador, 'POST', f"/candidatos/delete/{candidatos[-1]}")
+
+    ficheiro_orientadores, ficheiro_candidatos = os.path.join(pasta, 'orientadores.jsonl'), os.path.join(pasta, 'candidatos.jsonl')
+    with open(ficheiro_orientadores, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'nome': 'Importado', 'vagas': 1, 'avalia_afinidade': True, 'token': 'importado'}) + '\n')
+    with open(ficheiro_candidatos, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'nome': 'Importado', 'preferencias': [novo_orientador]}) + '\n')
+    for ficheiro, nome in ((ficheiro_orientadores, 'import-orientadores'), (ficheiro_candidatos, 'import-candidatos')):
+        comando(nome, ficheiro, '--dry-run')
+        comando(nome, ficheiro)
+    comando('listar-questionario')
+    comando('listar-execucoes')
+    comando('comparar-execucoes', str(execucoes[0]), str(execucao_id))
+    comando('comparar-motores')
+    comando('varrimento-pesos', '--peso-preparo', '0.4,0.6', '--processos', '1')
+    for conjunto in CONSULTAS_EXPORTACAO:
+        comando('exportar', conjunto, '--saida', os.path.join(pasta, f"{conjunto}.csv"))
+    pedido(administrador, 'POST', '/processos', {'nome': 'explain'})
+    pedido(administrador, 'GET', '/p/explain/admin')
+    descartar_base_de_dados(caminho_processo('explain'))
+
+    pedido(administrador, 'POST', '/avaliacoes/clear')
+    pedido(administrador, 'POST', '/admin/reset-db')
+    pedido(administrador, 'GET', '/logout')
+
+# EXPLAIN QUERY PLAN de cada instrução distinta registada ao percorrer a aplicação numa base temporária. O plano não
+# depende dos valores (o esquema não tem índices parciais nem estatísticas de colunas), pelo que basta um exemplo.
+@click.command('explain-consultas')
+@click.option('--escala', type=click.Choice(list(ESCALAS_BENCHMARK)), default='100', show_default=True, help='Dimensão da coorte gerada.')
+@click.option('--semente', default=42, show_default=True)
+@click.option('--todas', is_flag=True, help='Mostra também as instruções sem varrimentos completos.')
+def explain_consultas_command(escala, semente, todas):
+    global _REGISTO_SQL
+    caminho_original, pasta_processos = app.config['DATABASE'], app.config['PASTA_PROCESSOS']
+    with tempfile.TemporaryDirectory() as pasta:
+        app.config['DATABASE'], app.config['PASTA_PROCESSOS'] = os.path.join(pasta, 'explain.db'), os.path.join(pasta, 'processos')
+        try:
+            with app.app_context():
+                init_db_logic()
+                gerar_coorte(get_db(), semente=semente, **ESCALAS_BENCHMARK[escala])
+                # A ligação é reaberta com o registo ativo (o trace é instalado ao abrir a ligação).
+                descartar_base_de_dados(app.config['DATABASE'])
+                g.pop('db', None)
+                auxiliar = abrir_conexao(app.config['DATABASE'])
+                _REGISTO_SQL = {}
+                try:
+                    percorrer_aplicacao(get_db(), auxiliar, random.Random(semente), pasta)
+                finally:
+                    registo, _REGISTO_SQL = _REGISTO_SQL, None
+                    auxiliar.close()
+                db = get_db()
+                db.set_trace_callback(None)
+                # As tabelas temporárias (ex.: as chaves do import --dry-run) são recriadas, vazias, nesta ligação.
+                for instrucao, exemplo in registo.items():
+                    if instrucao.upper().startswith('CREATE TEMP TABLE'):
+                        db.execute(exemplo)
+                # O plano dos triggers não aparece no da instrução que os dispara: as instruções do corpo de cada trigger
+                # são explicadas à parte, com um valor no lugar de OLD.coluna e NEW.coluna.
+                for (sql,) in db.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger'").fetchall():
+                    corpo = sql[sql.upper().index('BEGIN') + len('BEGIN'):sql.upper().rindex('END')]
+                    for instrucao in corpo.split(';'):
+                        instrucao = re.sub(r"\b(?:OLD|NEW)\.\w+", '0', instrucao).strip()
+                        if instrucao:
+                            registo.setdefault(normalizar_instrucao(instrucao), instrucao)
+                inesperados = esperados = 0
+                for instrucao, exemplo in sorted(registo.items()):
+                    if instrucao.split(' ', 1)[0].upper() not in ('SELECT', 'WITH', 'INSERT', 'REPLACE', 'UPDATE', 'DELETE'):
+                        continue
+                    plano = [row['detail'] for row in db.execute("EXPLAIN QUERY PLAN " + exemplo).fetchall()]
+                    # "SCAN tabela" sem índice é um varrimento completo da tabela; SEARCH e SCAN ... USING INDEX usam índices.
+                    # "SCAN n CONSTANT ROWS" percorre as linhas de um VALUES, não uma tabela.
+                    varrimentos = [p for p in plano if p.startswith('SCAN') and 'USING' not in p and 'CONSTANT ROW' not in p]
+                    motivo = LEITURAS_INTEGRAIS.get(instrucao) if varrimentos else None
+                    if varrimentos and motivo is None:
+                        inesperados += 1
+                        estado = 'VARRIMENTO COMPLETO'
+                    elif motivo:
+                        esperados += 1
+                        estado = f"leitura integral esperada: {motivo}"
+                    elif todas:
+                        estado = 'ok'
+                    else:
+                        continue
+                    click.echo(f"[{estado}]\n    {instrucao}")
+                    for linha in plano:
+                        click.echo(f"      {linha}")
+                descartar_base_de_dados(app.config['DATABASE'])
+        finally:
+            app.config['DATABASE'], app.config['PASTA_PROCESSOS'] = caminho_original, pasta_processos
+    click.echo(f"{len(registo)} instrução(ões) distinta(s) registada(s); {esperados} leitura(s) integral(is) esperada(s); {inesperados} com varrimento completo inesperado.")
+
+app.cli.add_command(explain_consultas_command)
+
+# --- TESTE DE CARGA DO PORTAL DE AVALIAÇÃO ---
+# Simula o pico de submissões: cada avaliador é uma thread que percorre o ciclo do portal (lista de candidatos,
+# formulário, tempo de reflexão, submissão e regresso à lista). Por omissão corre com o cliente de testes do Flask
+# sobre uma coorte gerada numa base temporária; com --url, corre contra um servidor local já em execução (ex.:
+# gunicorn com vários workers), usando a base configurada para obter os tokens. Um 503 é um "database is locked"
+# (ver base_de_dados_ocupada). As pausas seguem uma distribuição exponencial, para que os avaliadores não submetam
+# todos ao mesmo ritmo.
+ROTA_LISTA, ROTA_FORMULARIO, ROTA_SUBMISSAO = 'GET /avaliar/<token>', 'GET /avaliar/<token>/<candidate_id>', 'POST /avaliar/<token>/<candidate_id>'
+
+def percentil(ordenados, p):
+    return ordenados[min(len(ordenados) - 1, int(p / 100 * len(ordenados)))] if ordenados else None
+
+def cliente_carga_teste():
+    cliente = app.test_client(use_cookies=False)
+    def enviar(metodo, caminho, dados=None):
+        resposta = cliente.open(caminho, method=metodo, data=dados)
+        resposta.close()
+        return resposta.status_code
+    return enviar
+
+# Uma ligação HTTP persistente por avaliador; uma falha de rede conta como estado 0 e a ligação é reaberta.
+def cliente_carga_http(url):
+    partes = urllib.parse.urlsplit(url)
+    ligacao = (http.client.HTTPSConnection if partes.scheme == 'https' else http.client.HTTPConnection)(partes.netloc, timeout=60)
+    prefixo = partes.path.rstrip('/')
+    def enviar(metodo, caminho, dados=None):
+        corpo = urllib.parse.urlencode(dados) if dados else None
+        cabecalhos = {'Content-Type': 'application/x-www-form-urlencoded'} if dados else {}
+        try:
+            ligacao.request(metodo, prefixo + caminho, body=corpo, headers=cabecalhos)
+            resposta = ligacao.getresponse()
+            resposta.read()
+            return resposta.status
+        except (OSError, http.client.HTTPException):
+            ligacao.close()
+            return 0
+    return enviar
+
+def simular_avaliador(enviar, orientador, candidatos, avaliacoes, pensar, fim, rnd):
+    medidas = defaultdict(list)  # {rota: [(ms, estado), ...]}
+    def pedido(rota, metodo, caminho, dados=None):
+        inicio = time.perf_counter()
+        estado = enviar(metodo, caminho, dados)
+        medidas[rota].append(((time.perf_counter() - inicio) * 1000, estado))
+    pausa = lambda: time.sleep(rnd.expovariate(1 / pensar)) if pensar > 0 else None
+    token, questoes = orientador['token'], orientador['questoes']
+    time.sleep(rnd.uniform(0, pensar))  # Chegadas escalonadas.
+    pedido(ROTA_LISTA, 'GET', f"/avaliar/{token}")
+    for cid in rnd.sample(candidatos, min(avaliacoes, len(candidatos))):
+        if fim is not None and time.perf_counter() >= fim:
+            break
+        pedido(ROTA_FORMULARIO, 'GET', f"/avaliar/{token}/{cid}")
+        pausa()
+        pedido(ROTA_SUBMISSAO, 'POST', f"/avaliar/{token}/{cid}", {qid: str(rnd.choice(NOTAS_VALIDAS)) for qid in questoes})
+        pedido(ROTA_LISTA, 'GET', f"/avaliar/{token}")
+    return medidas
+
+def executar_teste_carga(enviar_por_avaliador, orientadores, candidatos, avaliadores, avaliacoes, pensar, duracao, semente, ao_terminar=None):
+    def avaliador(i):
+        try:
+            rnd = random.Random(semente * 1000003 + i)
+            return simular_avaliador(enviar_por_avaliador(), orientadores[i % len(orientadores)], candidatos, avaliacoes, pensar, fim, rnd)
+        finally:
+            if ao_terminar:
+                ao_terminar()
+    inicio = time.perf_counter()
+    fim = inicio + duracao if duracao else None
+    with ThreadPoolExecutor(max_workers=avaliadores) as executor:
+        resultados = list(executor.map(avaliador, range(avaliadores)))
+    decorrido = time.perf_counter() - inicio
+    esperado = {ROTA_LISTA: 200, ROTA_FORMULARIO: 200, ROTA_SUBMISSAO: 302}
+    rotas = {}
+    for rota in (ROTA_LISTA, ROTA_FORMULARIO, ROTA_SUBMISSAO):
+        medidas = [m for r in resultados for m in r[rota]]
+        tempos = sorted(ms for ms, _ in medidas)
+        rotas[rota] = {
+            'pedidos': len(medidas),
+            'ok': sum(estado == esperado[rota] for _, estado in medidas),
+            'bloqueios': sum(estado == 503 for _, estado in medidas),
+            'erros': sum(estado not in (esperado[rota], 503) for _, estado in medidas),
+            'p50_ms': percentil(tempos, 50), 'p95_ms': percentil(tempos, 95), 'p99_ms': percentil(tempos, 99), 'maximo_ms': tempos[-1] if tempos else None,
+            'pedidos_por_segundo': len(medidas) / decorrido,
+        }
+    return {'duracao_s': decorrido, 'avaliacoes_gravadas_por_segundo': rotas[ROTA_SUBMISSAO]['ok'] / decorrido, 'rotas': rotas}
+
+@click.command('teste-carga')
+@click.option('--avaliadores', default=20, show_default=True, help='Avaliadores em simultâneo (um por thread).')
+@click.option('--avaliacoes', default=10, show_default=True, help='Avaliações submetidas por avaliador.')
+@click.option('--pensar', type=click.FloatRange(0), default=1.0, show_default=True, help='Tempo médio (s) entre abrir o formulário e submeter; 0 = sem pausas.')
+@click.option('--duracao', type=float, default=None, help='Termina ao fim deste número de segundos, mesmo que faltem avaliações.')
+@click.option('--escala', type=click.Choice(list(ESCALAS_BENCHMARK)), default='1k', show_default=True, help='Coorte gerada (ignorada com --url).')
+@click.option('--busy-timeout', type=int, default=None, help='SQLITE_BUSY_TIMEOUT (ms) a usar no teste; ignorado com --url.')
+@click.option('--escrita-em-grupo/--escrita-direta', default=None, help='Liga ou desliga ESCRITA_EM_GRUPO durante o teste (por omissão, a configuração atual); ignorado com --url.')
+@click.option('--url', default=None, help='Servidor em execução (ex.: http://127.0.0.1:8000), que use a mesma base de dados.')
+@click.option('--semente', default=42, show_default=True)
+@click.option('--saida', type=click.Path(dir_okay=False), default=None, help='Ficheiro JSON onde gravar os resultados.')
+@with_appcontext
+@opcao_processo
+def teste_carga_command(avaliadores, avaliacoes, pensar, duracao, escala, busy_timeout, escrita_em_grupo, url, semente, saida):
+    def carregar_coorte(db):
+        questionario = carregar_questionario(db)
+        orientadores = [dict(row, questoes=[q['codigo'] for q in questionario.do_orientador(row)]) for row in db.execute("SELECT * FROM orientadores ORDER BY id")]
+        return [o for o in orientadores if o['questoes']], [row['id'] for row in db.execute("SELECT id FROM candidatos ORDER BY id")]
+
+    opcoes = dict(avaliadores=avaliadores, avaliacoes=avaliacoes, pensar=pensar, duracao=duracao, semente=semente)
+    if url:
+        orientadores, candidatos = carregar_coorte(get_db())
+        if not orientadores or not candidatos:
+            raise click.ClickException('A base de dados não tem avaliadores com atribuições ou candidatos (ver "flask gerar-dados").')
+        base = url.rstrip('/') + (f"/p/{g.processo}" if g.get('processo') else '')
+        click.echo(f"{avaliadores} avaliadores contra {base} ({len(orientadores)} orientadores com atribuições, {len(candidatos)} candidatos).")
+        resultado = executar_teste_carga(lambda: cliente_carga_http(base), orientadores, candidatos, **opcoes)
+    else:
+        originais = {chave: app.config[chave] for chave in ('DATABASE', 'SQLITE_BUSY_TIMEOUT', 'ESCRITA_EM_GRUPO')}
+        with tempfile.TemporaryDirectory() as pasta:
+            try:
+                app.config['DATABASE'] = os.path.join(pasta, 'teste-carga.db')
+                if busy_timeout is not None:
+                    app.config['SQLITE_BUSY_TIMEOUT'] = busy_timeout
+                if escrita_em_grupo is not None:
+                    app.config['ESCRITA_EM_GRUPO'] = escrita_em_grupo
+                with app.app_context():
+                    init_db_logic()
+                    gerar_coorte(get_db(), mistura='mista', semente=semente, **ESCALAS_BENCHMARK[escala])
+                    orientadores, candidatos = carregar_coorte(get_db())
+                escrita = 'escrita em grupo' if app.config['ESCRITA_EM_GRUPO'] else 'escrita direta'
+                click.echo(f"{avaliadores} avaliadores, cliente de testes, {escrita}, escala {escala} ({len(orientadores)} orientadores com atribuições, {len(candidatos)} candidatos).")
+                resultado = executar_teste_carga(
+                    cliente_carga_teste, orientadores, candidatos, ao_terminar=partial(descartar_base_de_dados, app.config['DATABASE']), **opcoes
+                )
+            finally:
+                descartar_base_de_dados(app.config['DATABASE'])
+                app.config.update(originais)
+    formatar = lambda v: f"{v:.1f}" if v is not None else '-'
+    for rota, r in resultado['rotas'].items():
+        click.echo(
+            f"  {rota}: {r['pedidos']} pedidos, {r['pedidos_por_segundo']:.1f}/s, p50 {formatar(r['p50_ms'])} ms, p95 {formatar(r['p95_ms'])} ms, "
+            f"p99 {formatar(r['p99_ms'])} ms, máx. {formatar(r['maximo_ms'])} ms | {r['bloqueios']} bloqueios (503), {r['erros']} outros erros"
+        )
+    click.echo(f"{resultado['avaliacoes_gravadas_por_segundo']:.1f} avaliações gravadas por segundo em {resultado['duracao_s']:.1f} s.")
+    if saida:
+        relatorio = {
+            'commit': versao_do_codigo(),
+            'criado_em': datetime.now().astimezone().isoformat(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'alvo': url or f"cliente de testes, escala {escala}",
+            **opcoes,
+            'busy_timeout_ms': None if url else (busy_timeout if busy_timeout is not None else app.config['SQLITE_BUSY_TIMEOUT']),
+            'escrita_em_grupo': None if url else (escrita_em_grupo if escrita_em_grupo is not None else app.config['ESCRITA_EM_GRUPO']),
+            **resultado,
+        }
+        with open(saida, 'w', encoding='utf-8') as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2)
+        click.echo(f"Resultados gravados em {saida}.")
+
+app.cli.add_command(teste_carga_command)
+
 # --- 5. ROTAS DA APLICAÇÃO ---
-# ALTERADO: Rota principal para processar e passar os dados detalhados para o template.
+# Medição de cada pedido (ver INSTRUMENTAÇÃO). Termina quando o servidor fecha a resposta, para que as respostas
+# em streaming (ex.: exportações) contem o envio completo e as consultas feitas durante o envio.
+@app.before_request
+def iniciar_medicao_pedido():
+    if instrumentacao_ativa():
+        _MEDICAO_PEDIDO.inicio, _MEDICAO_PEDIDO.sql = time.perf_counter(), [0, 0.0]
+
+@app.after_request
+def agendar_fim_medicao_pedido(resposta):
+    if getattr(_MEDICAO_PEDIDO, 'sql', None) is not None:
+        rota = request.url_rule.rule if request.url_rule else '(sem rota)'
+        resposta.call_on_close(partial(terminar_medicao_pedido, rota, request.method, request.full_path.rstrip('?'), resposta.status_code))
+    return resposta
+
+def terminar_medicao_pedido(rota, metodo, caminho, estado):
+    sql = getattr(_MEDICAO_PEDIDO, 'sql', None)
+    if sql is None:
+        return
+    duracao = time.perf_counter() - _MEDICAO_PEDIDO.inicio
+    _MEDICAO_PEDIDO.sql = None
+    if app.config['METRICAS']:
+        rotulos = {'rota': rota, 'metodo': metodo}
+        METRICAS.observar('sasac_pedido_duracao_segundos', rotulos, duracao)
+        METRICAS.observar('sasac_pedido_sql_consultas', rotulos, sql[0])
+        METRICAS.observar('sasac_pedido_sql_segundos', rotulos, sql[1])
+        METRICAS.incrementar('sasac_pedidos_total', {**rotulos, 'estado': estado})
+    limiar = app.config['LIMIAR_PEDIDO_LENTO_MS']
+    if limiar is not None and duracao * 1000 >= limiar:
+        app.logger.warning(
+            "Pedido lento: %s %s (rota %s, estado %d) em %.1f ms, %d instruções SQL em %.1f ms",
+            metodo, caminho, rota, estado, duracao * 1000, sql[0], sql[1] * 1000
+        )
+
+# Com a escrita ocupada por outra ligação durante mais de SQLITE_BUSY_TIMEOUT, o SQLite desiste com "database is
+# locked" (ou a fila de escrita em grupo não grava a tempo). O pedido recebe 503 com Retry-After, em vez de um 500
+# genérico; os restantes erros seguem o caminho normal.
+@app.errorhandler(sqlite3.OperationalError)
+@app.errorhandler(FilaEscritaOcupada)
+def base_de_dados_ocupada(e):
+    if isinstance(e, sqlite3.OperationalError) and 'locked' not in str(e) and 'busy' not in str(e):
+        raise e
+    app.logger.warning("Base de dados ocupada: %s %s (%s)", request.method, request.path, e)
+    return Response("Base de dados ocupada. Tente novamente dentro de instantes.", status=503, headers={'Retry-After': '1'})
+
+# A avaliação pode ter sido gravada: um 503 levaria o avaliador a repeti-la sem necessidade.
+# A aplicação não migra o esquema por si (ver atualizar_esquema): até ao `flask upgrade-db`, os pedidos recebem 503.
+@app.errorhandler(EsquemaDesatualizado)
+def esquema_desatualizado(e):
+    app.logger.error("%s", e.message)
+    return Response("A base de dados tem de ser atualizada pelo administrador (flask upgrade-db).", status=503)
+
+@app.errorhandler(EscritaIncerta)
+def escrita_incerta(e):
+    app.logger.warning("Gravação sem confirmação: %s %s (%s)", request.method, request.path, e)
+    return Response("A gravação da avaliação começou mas não foi confirmada a tempo. Verifique no portal se ficou registada antes de a submeter de novo.", status=504)
+
+@app.route("/metrics")
+def metricas():
+    if not app.config['METRICAS']:
+        return "Métricas desligadas (app.config['METRICAS']).", 404
+    return Response(METRICAS.exportar(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# Página inicial: resumo da última execução, com as listas carregadas a pedido.
 @app.route("/")
 @login_required
+@com_etag
 def home():
     db = get_db()
-    orientadores = {row['id']: dict(row) for row in db.execute("SELECT * FROM orientadores").fetchall()}
-    candidatos_total = db.execute("SELECT * FROM candidatos").fetchall()
+    return render_template('relatorio_resumo.html', resumo=carregar_resumo_execucao(db), total_nao_avaliados=contar_nao_avaliados(db), questionario=carregar_questionario(db))
 
-    alocacao = DADOS_SESSAO.get("alocacao_final")
-    nao_alocados = DADOS_SESSAO.get("nao_alocados")
-    todas_pontuacoes = DADOS_SESSAO.get("todas_pontuacoes")
-    configs_usadas = DADOS_SESSAO.get("configs_usadas")
-    data_processamento = DADOS_SESSAO.get("data_processamento")
-
-    pontuacoes_por_candidato = defaultdict(list)
-    if todas_pontuacoes:
-        for p in todas_pontuacoes:
-            cid = p['id_candidato']
-            oid = p['id_orientador']
-            if oid in orientadores:
-                pontuacoes_por_candidato[cid].append({
-                    'orientador_nome': orientadores[oid]['nome'],
-                    'pontuacao': p['pontuacao_final'],
-                    'detalhes': p['detalhes']
-                })
-    
-    for cid in pontuacoes_por_candidato:
-        pontuacoes_por_candidato[cid].sort(key=lambda x: x['pontuacao'], reverse=True)
+# Relatório completo (todas as listas e o detalhe de todas as pontuações), apenas quando pedido para impressão.
+@app.route("/relatorio/completo")
+@login_required
+@com_etag
+def relatorio_completo():
+    db = get_db()
+    execucao = carregar_execucao(db, request.args.get('execucao', type=int)) or {}
 
     candidatos_avaliados_ids = set(row['candidato_id'] for row in db.execute("SELECT DISTINCT candidato_id FROM avaliacoes").fetchall())
-    candidatos_nao_avaliados = [c for c in candidatos_total if c['id'] not in candidatos_avaliados_ids]
-
-    return render_template_string(
-        TPL_RELATORIO,
-        alocacao=alocacao,
-        nao_alocados=nao_alocados,
-        orientadores=orientadores,
-        pontuacoes_por_candidato=pontuacoes_por_candidato,
+    candidatos_nao_avaliados = [c for c in db.execute("SELECT * FROM candidatos").fetchall() if c['id'] not in candidatos_avaliados_ids]
+
+    return render_template(
+        'relatorio.html',
+        alocacao=execucao.get('alocacao'),
+        nao_alocados=execucao.get('nao_alocados'),
+        orientadores=execucao.get('orientadores', {}),
+        pontuacoes_por_candidato=execucao.get('pontuacoes_por_candidato', {}),
         candidatos_nao_avaliados=candidatos_nao_avaliados,
-        configs_usadas=configs_usadas,
-        questionario=QUESTIONARIO_ESTRUTURA,
-        data_processamento=data_processamento
+        configs_usadas=execucao.get('configs_usadas'),
+        questionario=carregar_questionario(db),
+        data_processamento=execucao.get('data_processamento'),
+        modo_alocacao=execucao.get('modo_alocacao'),
+        tempo_alocacao_ms=execucao.get('tempo_alocacao_ms'),
+        estabilidade=execucao.get('estabilidade'),
+        execucao_id=execucao.get('execucao_id')
     )
 
+# Fragmentos do relatório em JSON: {"html": ..., "proximo": <candidato_id a partir do qual continuar, ou null>}.
+def fragmento_relatorio(macro, *args, proximo=None):
+    return {"html": str(get_template_attribute('relatorio_fragmentos.html', macro)(*args)), "proximo": proximo}
+
+@app.route("/relatorio/<int:execucao_id>/orientador/<int:orientador_id>")
+@login_required
+@com_etag
+def relatorio_orientador(execucao_id, orientador_id):
+    return fragmento_relatorio('lista_alocados', carregar_alocados_orientador(get_db(), execucao_id, orientador_id), execucao_id)
+
+@app.route("/relatorio/<int:execucao_id>/nao-alocados")
+@login_required
+@com_etag
+def relatorio_nao_alocados(execucao_id):
+    candidatos, proximo = carregar_pagina_nao_alocados(get_db(), execucao_id, request.args.get('apos', 0, type=int))
+    return fragmento_relatorio('lista_candidatos', candidatos, execucao_id, proximo=proximo)
+
+@app.route("/relatorio/nao-avaliados")
+@login_required
+@com_etag
+def relatorio_nao_avaliados():
+    candidatos, proximo = carregar_pagina_nao_avaliados(get_db(), request.args.get('apos', 0, type=int))
+    return fragmento_relatorio('lista_candidatos', candidatos, proximo=proximo)
+
+@app.route("/relatorio/<int:execucao_id>/candidato/<int:candidato_id>")
+@login_required
+@com_etag
+def relatorio_candidato(execucao_id, candidato_id):
+    return fragmento_relatorio('detalhes_pontuacoes', carregar_pontuacoes_candidato(get_db(), execucao_id, candidato_id))
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -713,7 +4042,7 @@ def login():
             return redirect(next_url or url_for('home'))
         else:
             flash('Senha incorreta.', 'danger')
-    return render_template_string(TPL_LOGIN)
+    return render_template('login.html')
 
 @app.route('/logout')
 def logout():
@@ -724,14 +4053,30 @@ def logout():
 @app.route("/ajuda")
 @login_required
 def ajuda():
-    return render_template_string(TPL_AJUDA)
+    return render_template('ajuda.html')
+
+@app.route("/processos", methods=['GET', 'POST'])
+@login_required
+def processos():
+    if request.method == 'POST':
+        nome = request.form.get('nome', '').strip()
+        try:
+            criar_processo(nome)
+        except ValueError as e:
+            flash(str(e), "danger")
+            return redirect(url_for('processos'))
+        flash(f"Processo seletivo '{nome}' criado.", "success")
+        return redirect(endereco_processo(nome) + "/admin")
+    return render_template('processos.html', processos=listar_processos())
 
 @app.route("/admin")
 @login_required
 def admin():
     db = get_db()
-    configs = {row['chave']: float(row['valor']) for row in db.execute("SELECT * FROM configuracoes").fetchall()}
-    return render_template_string(TPL_ADMIN, configs=configs, questionario=QUESTIONARIO_ESTRUTURA)
+    configs = ler_configuracoes(db)
+    ultima_tarefa = db.execute("SELECT * FROM tarefas_alocacao ORDER BY id DESC LIMIT 1").fetchone()
+    tarefa = descrever_tarefa(ultima_tarefa) if ultima_tarefa else None
+    return render_template('admin.html', configs=configs, questionario=carregar_questionario(db), estrategias=ESTRATEGIAS_ALOCACAO, modo_padrao=app.config['MODO_ALOCACAO'], tarefa=tarefa)
 
 @app.route('/configuracoes', methods=['POST'])
 @login_required
@@ -741,17 +4086,13 @@ def salvar_configuracoes():
     peso_preparo_percent = int(request.form.get('peso_preparo', 50))
     peso_preparo = peso_preparo_percent / 100.0
     peso_afinidade = 1.0 - peso_preparo
-    db.execute("UPDATE configuracoes SET valor = ? WHERE chave = ?", (str(peso_preparo), 'peso_preparo'))
-    db.execute("UPDATE configuracoes SET valor = ? WHERE chave = ?", (str(peso_afinidade), 'peso_afinidade'))
-
     peso_preferencia = request.form.get('peso_preferencia_candidato', '0.5')
-    db.execute("UPDATE configuracoes SET valor = ? WHERE chave = ?", (peso_preferencia, 'peso_preferencia_candidato'))
+    valores = [(str(peso_preparo), 'peso_preparo'), (str(peso_afinidade), 'peso_afinidade'), (peso_preferencia, 'peso_preferencia_candidato')]
+    valores += [(request.form.get(questao['codigo'], '1.0'), questao['codigo']) for questao in carregar_questionario(db).questoes]
 
-    for secao in QUESTIONARIO_ESTRUTURA.values():
-        for questao in secao:
-            peso_valor = request.form.get(questao['id'], '1.0')
-            db.execute("UPDATE configuracoes SET valor = ? WHERE chave = ?", (peso_valor, questao['id']))
-    
+    # Uma única transação: os triggers incrementam a versão das configurações e os índices são recalculados com os novos pesos.
+    db.executemany("UPDATE configuracoes SET valor = ? WHERE chave = ?", valores)
+    reconstruir_indices(db)
     db.commit()
     flash("Configurações de avaliação salvas com sucesso!", "success")
     return redirect(url_for('admin'))
@@ -759,32 +4100,70 @@ def salvar_configuracoes():
 @app.route("/processar", methods=['POST'])
 @login_required
 def processar():
-    executar_alocacao()
+    modo = request.form.get('modo_alocacao', app.config['MODO_ALOCACAO'])
+    if modo not in ESTRATEGIAS_ALOCACAO:
+        flash("Modo de alocação inválido.", "danger")
+        return redirect(url_for('admin'))
+    db = get_db()
+    tarefa_id = criar_tarefa_alocacao(db, modo)
+    if tarefa_id is None:
+        flash("Já existe uma alocação em curso. Aguarde que termine antes de iniciar outra.", "warning")
+        return redirect(url_for('admin'))
+    if app.config['ALOCACAO_EM_SEGUNDO_PLANO']:
+        iniciar_tarefa_alocacao(tarefa_id, modo)
+        flash("Processo de alocação iniciado. O progresso é atualizado abaixo.", "info")
+        return redirect(url_for('admin'))
+    executar_tarefa_alocacao(tarefa_id, modo)
+    tarefa = db.execute("SELECT * FROM tarefas_alocacao WHERE id = ?", (tarefa_id,)).fetchone()
+    if tarefa['estado'] == 'falhou':
+        flash(f"A alocação falhou: {tarefa['mensagem']}", "danger")
+        return redirect(url_for('admin'))
+    if tarefa['execucao_id'] is None:
+        flash("Nenhuma avaliação foi submetida.", "warning")
+    else:
+        flash("Processo de alocação executado com sucesso!", "success")
     return redirect(url_for('home'))
 
+@app.route("/tarefas/<int:tarefa_id>")
+@login_required
+def estado_tarefa(tarefa_id):
+    tarefa = get_db().execute("SELECT * FROM tarefas_alocacao WHERE id = ?", (tarefa_id,)).fetchone()
+    if tarefa is None:
+        return {"erro": "Tarefa não encontrada."}, 404
+    return descrever_tarefa(tarefa)
+
 @app.route("/avaliacoes/clear", methods=['POST'])
 @login_required
 def clear_evaluations():
     db = get_db()
+    db.execute("DELETE FROM respostas")
     db.execute("DELETE FROM avaliacoes")
+    db.execute("DELETE FROM notas_curriculo_agregadas")
+    db.execute("DELETE FROM indices_preparo")
+    db.execute("DELETE FROM indices_afinidade")
+    apagar_execucoes(db)
     db.commit()
-    for key in DADOS_SESSAO: DADOS_SESSAO[key] = None
     flash('Todas as avaliações foram apagadas com sucesso. Pode iniciar uma nova rodada.', 'warning')
     return redirect(url_for('admin'))
 
 @app.route("/admin/reset-db", methods=['POST'])
 @login_required
 def reset_database():
+    # Uma alocação em curso gravaria o resultado (ou o estado final) na base de dados acabada de recriar.
+    tarefa = tarefa_alocacao_ativa(get_db())
+    if tarefa:
+        flash(f"A alocação #{tarefa['id']} ainda está em curso. Aguarde que termine antes de reinicializar a base de dados.", 'warning')
+        return redirect(url_for('admin'))
     init_db_logic()
-    for key in DADOS_SESSAO: DADOS_SESSAO[key] = None
     flash('A base de dados foi completamente reinicializada com sucesso!', 'danger')
     return redirect(url_for('admin'))
 
 @app.route("/orientadores")
 @login_required
+@com_etag
 def orientadores_list():
     orientadores = get_db().execute("SELECT * FROM orientadores ORDER BY nome").fetchall()
-    return render_template_string(TPL_ORIENTADOR_LIST, orientadores=orientadores)
+    return render_template('orientadores.html', orientadores=orientadores)
 
 @app.route("/orientadores/add", methods=['GET', 'POST'])
 @login_required
@@ -804,7 +4183,7 @@ def orientadores_add():
         db.commit()
         flash("Registo adicionado com sucesso!", "success")
         return redirect(url_for('orientadores_list'))
-    return render_template_string(TPL_ORIENTADOR_FORM, orientador=None, titulo="Adicionar Avaliador/Orientador")
+    return render_template('orientador_form.html', orientador=None, titulo="Adicionar Avaliador/Orientador")
 
 @app.route("/orientadores/edit/<int:id>", methods=['GET', 'POST'])
 @login_required
@@ -816,30 +4195,60 @@ def orientadores_edit(id):
         avalia_curriculo = 1 if 'avalia_curriculo' in request.form else 0
         avalia_entrevista = 1 if 'avalia_entrevista' in request.form else 0
         avalia_afinidade = 1 if 'avalia_afinidade' in request.form else 0
+        anterior = db.execute("SELECT * FROM orientadores WHERE id = ?", (id,)).fetchone()
         db.execute(
             "UPDATE orientadores SET nome = ?, vagas = ?, avalia_curriculo = ?, avalia_entrevista = ?, avalia_afinidade = ? WHERE id = ?",
             (nome, vagas, avalia_curriculo, avalia_entrevista, avalia_afinidade, id)
         )
+        # Mudanças nas atribuições alteram quais das respostas já submetidas por este orientador contam para os índices.
+        if anterior and (anterior['avalia_curriculo'], anterior['avalia_entrevista'], anterior['avalia_afinidade']) != (avalia_curriculo, avalia_entrevista, avalia_afinidade):
+            avaliados = [row['candidato_id'] for row in db.execute("SELECT candidato_id FROM avaliacoes WHERE orientador_id = ?", (id,)).fetchall()]
+            reconstruir_notas_curriculo(db, ler_configuracoes(db), avaliados)
+            reconstruir_indices_afinidade(db, ler_configuracoes(db), id)
         db.commit()
         flash("Registo atualizado com sucesso!", "success")
         return redirect(url_for('orientadores_list'))
     orientador = db.execute("SELECT * FROM orientadores WHERE id = ?", (id,)).fetchone()
-    return render_template_string(TPL_ORIENTADOR_FORM, orientador=orientador, titulo="Editar Avaliador/Orientador")
+    return render_template('orientador_form.html', orientador=orientador, titulo="Editar Avaliador/Orientador")
 
 @app.route("/orientadores/delete/<int:id>", methods=['POST'])
 @login_required
 def orientadores_delete(id):
     db = get_db()
+    avaliados = [row['candidato_id'] for row in db.execute("SELECT candidato_id FROM avaliacoes WHERE orientador_id = ?", (id,)).fetchall()]
     db.execute("DELETE FROM orientadores WHERE id = ?", (id,))
+    # As chaves estrangeiras não estão ativas no SQLite por omissão: remove-se explicitamente o que dependia do registo.
+    db.execute("DELETE FROM avaliacoes WHERE orientador_id = ?", (id,))
+    db.execute("DELETE FROM preferencias_candidatos WHERE orientador_id = ?", (id,))
+    db.execute("DELETE FROM indices_afinidade WHERE orientador_id = ?", (id,))
+    reconstruir_notas_curriculo(db, ler_configuracoes(db), avaliados)
     db.commit()
     flash("Registo apagado com sucesso!", "danger")
     return redirect(url_for('orientadores_list'))
 
 @app.route("/candidatos")
 @login_required
+@com_etag
 def candidatos_list():
     candidatos = get_db().execute("SELECT * FROM candidatos ORDER BY nome").fetchall()
-    return render_template_string(TPL_CANDIDATO_LIST, candidatos=candidatos)
+    return render_template('candidatos.html', candidatos=candidatos)
+
+# Preferências do formulário: os orientadores assinalados, ordenados pela ordem indicada (os que não têm ordem ficam
+# no fim, pela ordem da lista) e gravados com a ordem renumerada a partir de 1.
+def gravar_preferencias(db, candidato_id, formulario):
+    assinalados = [int(oid) for oid in formulario.getlist('preferencias')]
+    def ordem_indicada(posicao_e_id):
+        valor = formulario.get(f'ordem_{posicao_e_id[1]}', '').strip()
+        return (0, int(valor), posicao_e_id[0]) if valor.isdigit() else (1, 0, posicao_e_id[0])
+    ordenados = [oid for _, oid in sorted(enumerate(assinalados), key=ordem_indicada)]
+    db.executemany(
+        "INSERT INTO preferencias_candidatos (candidato_id, orientador_id, ordem) VALUES (?, ?, ?)",
+        [(candidato_id, oid, ordem) for ordem, oid in enumerate(ordenados, 1)]
+    )
+
+def carregar_preferencias_candidato(db, candidato_id):
+    linhas = db.execute("SELECT orientador_id FROM preferencias_candidatos WHERE candidato_id = ? ORDER BY ordem, orientador_id", (candidato_id,))
+    return {row['orientador_id']: ordem for ordem, row in enumerate(linhas, 1)}
 
 @app.route("/candidatos/add", methods=['GET', 'POST'])
 @login_required
@@ -851,16 +4260,14 @@ def candidatos_add():
         cursor.execute("INSERT INTO candidatos (nome) VALUES (?)", (nome,))
         new_candidato_id = cursor.lastrowid
         
-        preferencias_ids = request.form.getlist('preferencias')
-        for orientador_id in preferencias_ids:
-            db.execute("INSERT INTO preferencias_candidatos (candidato_id, orientador_id) VALUES (?, ?)", (new_candidato_id, int(orientador_id)))
+        gravar_preferencias(db, new_candidato_id, request.form)
 
         db.commit()
         flash("Candidato adicionado com sucesso!", "success")
         return redirect(url_for('candidatos_list'))
     
     orientadores = db.execute("SELECT id, nome FROM orientadores ORDER BY nome").fetchall()
-    return render_template_string(TPL_CANDIDATO_FORM, candidato=None, titulo="Adicionar Candidato", orientadores=orientadores, preferencias_atuais=[])
+    return render_template('candidato_form.html', candidato=None, titulo="Adicionar Candidato", orientadores=orientadores, preferencias_atuais={})
 
 @app.route("/candidatos/edit/<int:id>", methods=['GET', 'POST'])
 @login_required
@@ -871,9 +4278,7 @@ def candidatos_edit(id):
         db.execute("UPDATE candidatos SET nome = ? WHERE id = ?", (nome, id))
         
         db.execute("DELETE FROM preferencias_candidatos WHERE candidato_id = ?", (id,))
-        preferencias_ids = request.form.getlist('preferencias')
-        for orientador_id in preferencias_ids:
-            db.execute("INSERT INTO preferencias_candidatos (candidato_id, orientador_id) VALUES (?, ?)", (id, int(orientador_id)))
+        gravar_preferencias(db, id, request.form)
             
         db.commit()
         flash("Candidato atualizado com sucesso!", "success")
@@ -881,25 +4286,29 @@ def candidatos_edit(id):
     
     candidato = db.execute("SELECT * FROM candidatos WHERE id = ?", (id,)).fetchone()
     orientadores = db.execute("SELECT id, nome FROM orientadores ORDER BY nome").fetchall()
-    preferencias_atuais = {row['orientador_id'] for row in db.execute("SELECT orientador_id FROM preferencias_candidatos WHERE candidato_id = ?", (id,)).fetchall()}
-    return render_template_string(TPL_CANDIDATO_FORM, candidato=candidato, titulo="Editar Candidato", orientadores=orientadores, preferencias_atuais=preferencias_atuais)
+    preferencias_atuais = carregar_preferencias_candidato(db, id)
+    return render_template('candidato_form.html', candidato=candidato, titulo="Editar Candidato", orientadores=orientadores, preferencias_atuais=preferencias_atuais)
 
 @app.route("/candidatos/delete/<int:id>", methods=['POST'])
 @login_required
 def candidatos_delete(id):
     db = get_db()
     db.execute("DELETE FROM candidatos WHERE id = ?", (id,))
+    for tabela in ('avaliacoes', 'preferencias_candidatos', 'notas_curriculo_agregadas', 'indices_preparo', 'indices_afinidade'):
+        db.execute(f"DELETE FROM {tabela} WHERE candidato_id = ?", (id,))
     db.commit()
     flash("Candidato apagado com sucesso!", "danger")
     return redirect(url_for('candidatos_list'))
 
 @app.route("/avaliar")
 @login_required
+@com_etag
 def avaliar_index():
     orientadores = get_db().execute("SELECT id, nome, token FROM orientadores ORDER BY nome").fetchall()
-    return render_template_string(TPL_AVALIAR_INDEX, orientadores=orientadores)
+    return render_template('avaliar_index.html', orientadores=orientadores)
 
 @app.route("/avaliar/<token>")
+@com_etag
 def avaliar_home(token):
     db = get_db()
     orientador = db.execute("SELECT * FROM orientadores WHERE token = ?", (token,)).fetchone()
@@ -907,9 +4316,10 @@ def avaliar_home(token):
         return "Token de acesso inválido.", 404
     candidatos = db.execute("SELECT * FROM candidatos ORDER BY nome").fetchall()
     avaliados_ids = {row['candidato_id'] for row in db.execute("SELECT candidato_id FROM avaliacoes WHERE orientador_id = ?", (orientador['id'],)).fetchall()}
-    return render_template_string(TPL_LISTA_CANDIDATOS, orientador=orientador, candidatos=candidatos, avaliados=avaliados_ids)
+    return render_template('lista_candidatos.html', orientador=orientador, candidatos=candidatos, avaliados=avaliados_ids)
 
 @app.route("/avaliar/<token>/<int:candidate_id>", methods=['GET', 'POST'])
+@com_etag
 def avaliar_candidato(token, candidate_id):
     db = get_db()
     orientador = db.execute("SELECT * FROM orientadores WHERE token = ?", (token,)).fetchone()
@@ -917,52 +4327,120 @@ def avaliar_candidato(token, candidate_id):
     if not orientador or not candidato:
         return "Acesso inválido.", 404
 
+    questionario = carregar_questionario(db)
     avaliacao_existente = db.execute(
-        "SELECT * FROM avaliacoes WHERE orientador_id = ? AND candidato_id = ?",
+        "SELECT id FROM avaliacoes WHERE orientador_id = ? AND candidato_id = ?",
         (orientador['id'], candidate_id)
     ).fetchone()
+    if avaliacao_existente:
+        avaliacao_existente = notas_por_codigo(questionario, carregar_notas(db, "WHERE a.id = ?", (avaliacao_existente['id'],))[avaliacao_existente['id']])
 
     if request.method == 'POST':
-        valores = {}
-        if orientador['avalia_curriculo']:
-            valores["s2_1"] = int(request.form["s2_1"])
-            valores["s2_2"] = int(request.form["s2_2"])
-        if orientador['avalia_entrevista']:
-            valores["s3_1"] = int(request.form["s3_1"])
-            valores["s3_2"] = int(request.form["s3_2"])
-        if orientador['avalia_afinidade']:
-            valores["s4_1"] = int(request.form["s4_1"])
-            valores["s4_2"] = int(request.form["s4_2"])
-        
-        if not valores:
+        if not questionario.do_orientador(orientador):
             flash("Este avaliador não possui atribuições para submeter uma avaliação.", "warning")
             return redirect(url_for('avaliar_home', token=token))
+        try:
+            valores = validar_notas(questionario, orientador, request.form)
+        except ValueError as e:
+            flash(f"Avaliação não gravada: {e}.", "danger")
+            return redirect(url_for('avaliar_candidato', token=token, candidate_id=candidate_id))
 
+        gravar_avaliacoes_submetidas(db, orientador, {candidate_id: valores})
         if avaliacao_existente:
-            set_clause = ', '.join([f"{col} = ?" for col in valores.keys()])
-            query = f"UPDATE avaliacoes SET {set_clause} WHERE id = ?"
-            db.execute(query, list(valores.values()) + [avaliacao_existente['id']])
             flash(f"Avaliação para {candidato['nome']} atualizada com sucesso!", "success")
         else:
-            valores['orientador_id'] = orientador['id']
-            valores['candidato_id'] = candidate_id
-            cols = ', '.join(valores.keys())
-            placeholders = ', '.join(['?'] * len(valores))
-            query = f"INSERT INTO avaliacoes ({cols}) VALUES ({placeholders})"
-            db.execute(query, list(valores.values()))
             flash(f"Avaliação para {candidato['nome']} enviada com sucesso!", "success")
-
-        db.commit()
         return redirect(url_for('avaliar_home', token=token))
 
-    return render_template_string(
-        TPL_FORM_AVALIACAO,
+    return render_template(
+        'form_avaliacao.html',
         orientador=orientador,
         candidato=candidato,
-        questionario=QUESTIONARIO_ESTRUTURA,
+        questionario=questionario,
         avaliacao_existente=avaliacao_existente
     )
 
+# Submissão em lote: aceita JSON ({"avaliacoes": [{"candidato_id": 1, "s3_1": 2, ...}, ...]}) ou o formulário da grelha
+# (campos "<candidato_id>-<código da questão>"). Ou todas as avaliações são válidas e gravadas numa só transação, ou nenhuma é.
+@app.route("/avaliar/<token>/lote", methods=['GET', 'POST'])
+@com_etag
+def avaliar_lote(token):
+    db = get_db()
+    orientador = db.execute("SELECT * FROM orientadores WHERE token = ?", (token,)).fetchone()
+    if not orientador:
+        return "Token de acesso inválido.", 404
+    questionario = carregar_questionario(db)
+    questoes = questionario.do_orientador(orientador)
+    candidatos = db.execute("SELECT id, nome FROM candidatos ORDER BY nome").fetchall()
+    notas = carregar_notas(db, "WHERE a.orientador_id = ?", (orientador['id'],))
+    notas_atuais = {row['candidato_id']: notas_por_codigo(questionario, notas.get(row['id'], {})) for row in db.execute("SELECT id, candidato_id FROM avaliacoes WHERE orientador_id = ?", (orientador['id'],))}
+
+    if request.method == 'POST':
+        submetidas = []
+        if request.is_json:
+            dados = request.get_json(silent=True)
+            itens = dados.get('avaliacoes') if isinstance(dados, dict) else dados
+            if not isinstance(itens, list):
+                return {"erros": ["o corpo deve ser uma lista de avaliações ou um objeto com a chave 'avaliacoes'"]}, 400
+            for posicao, item in enumerate(itens):
+                candidato_id = item.get('candidato_id') if isinstance(item, dict) else None
+                submetidas.append((f"avaliação {posicao}", candidato_id, item if isinstance(item, dict) else {}))
+        else:
+            notas_atuais = {}
+            for c in candidatos:
+                campos = {q['codigo']: request.form.get(f"{c['id']}-{q['codigo']}", '').strip() for q in questoes}
+                notas_atuais[c['id']] = campos
+                if any(campos.values()):
+                    submetidas.append((c['nome'], c['id'], campos))
+
+        erros, notas_por_candidato = [], {}
+        if not questoes:
+            erros.append("Este avaliador não possui atribuições para submeter uma avaliação.")
+        ids_validos, vistos = {c['id'] for c in candidatos}, set()
+        for referencia, candidato_id, dados in submetidas:
+            if isinstance(candidato_id, bool) or not isinstance(candidato_id, int) or candidato_id not in ids_validos:
+                erros.append(f"{referencia}: candidato {candidato_id!r} não existe")
+            elif candidato_id in vistos:
+                erros.append(f"{referencia}: candidato {candidato_id} repetido")
+            else:
+                vistos.add(candidato_id)
+                try:
+                    notas_por_candidato[candidato_id] = validar_notas(questionario, orientador, dados)
+                except ValueError as e:
+                    erros.append(f"{referencia}: {e}")
+
+        if erros:
+            if request.is_json:
+                return {"erros": erros}, 400
+            for erro in erros:
+                flash(erro, "danger")
+            return render_template('grelha_avaliacao.html', orientador=orientador, questoes=questoes, candidatos=candidatos, notas_atuais=notas_atuais, notas_validas=NOTAS_VALIDAS), 400
+
+        anteriores = gravar_avaliacoes_submetidas(db, orientador, notas_por_candidato)
+        resumo = {"gravadas": len(notas_por_candidato), "novas": len(notas_por_candidato) - len(anteriores), "atualizadas": len(anteriores)}
+        if request.is_json:
+            return resumo
+        flash(f"{resumo['gravadas']} avaliação(ões) gravada(s): {resumo['novas']} nova(s) e {resumo['atualizadas']} atualizada(s).", "success")
+        return redirect(url_for('avaliar_home', token=token))
+
+    return render_template('grelha_avaliacao.html', orientador=orientador, questoes=questoes, candidatos=candidatos, notas_atuais=notas_atuais, notas_validas=NOTAS_VALIDAS)
+
+@app.route("/exportar/<conjunto>.<formato>")
+@login_required
+def exportar(conjunto, formato):
+    if conjunto not in CONSULTAS_EXPORTACAO or formato not in FORMATOS_EXPORTACAO:
+        return "Exportação desconhecida.", 404
+    db = get_db()
+    execucao_id = obter_execucao_id(db, request.args.get('execucao', type=int))
+    if execucao_id is None:
+        flash("Execução de alocação não encontrada.", "warning")
+        return redirect(url_for('home'))
+    return Response(
+        stream_with_context(gerar_exportacao(db, execucao_id, conjunto, formato)),
+        mimetype=FORMATOS_EXPORTACAO[formato],
+        headers={'Content-Disposition': f'attachment; filename=sasac_execucao{execucao_id}_{conjunto}.{formato}'}
+    )
+
 # --- 6. PONTO DE ENTRADA DA APLICAÇÃO ---
 if __name__ == '__main__':
     # Nota: Antes de executar pela primeira vez, é necessário criar a base de dados.
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_app import app, descartar_base_de_dados, gerar_coorte, get_db, init_db_logic
+
+
+# Cada teste corre numa base de dados própria, numa pasta temporária; a base configurada não é tocada.
+@pytest.fixture
+def base_vazia(tmp_path):
+    configuracao_original = dict(app.config)
+    app.config.update(DATABASE=str(tmp_path / 'sasac.db'), PASTA_PROCESSOS=str(tmp_path / 'processos'), ALOCACAO_EM_SEGUNDO_PLANO=False)
+    try:
+        with app.app_context():
+            yield
+            descartar_base_de_dados(app.config['DATABASE'])
+    finally:
+        app.config.clear()
+        app.config.update(configuracao_original)
+
+
+@pytest.fixture
+def db(base_vazia):
+    init_db_logic()
+    return get_db()
+
+
+@pytest.fixture
+def coorte(db):
+    gerar_coorte(db, candidatos=60, orientadores=12, densidade=0.4, semente=7)
+    return db
+
+
+@pytest.fixture
+def administrador():
+    cliente = app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['logged_in'] = True
+    return cliente
@@ -0,0 +1,138 @@
+import sqlite3
+
+import pytest
+
+from flask_app import (
+    VERSAO_ESQUEMA, EsquemaDesatualizado, app, atualizar_esquema, calcular_pontuacoes_python, carregar_dados_alocacao,
+    carregar_questionario, conexao_processo, descartar_base_de_dados, get_db, init_db_logic, reconstruir_indices, verificar_esquema,
+)
+from test_pontuacoes import indices
+
+# Esquema da primeira versão da aplicação (antes de PRAGMA user_version): as notas em colunas da tabela avaliacoes e
+# as preferências sem ordem.
+ESQUEMA_ORIGINAL_SQL = """
+CREATE TABLE orientadores (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    nome TEXT NOT NULL,
+    vagas INTEGER NOT NULL DEFAULT 0,
+    token TEXT NOT NULL UNIQUE,
+    avalia_curriculo INTEGER NOT NULL DEFAULT 0,
+    avalia_entrevista INTEGER NOT NULL DEFAULT 0,
+    avalia_afinidade INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE candidatos ( id INTEGER PRIMARY KEY AUTOINCREMENT, nome TEXT NOT NULL );
+CREATE TABLE preferencias_candidatos (
+    candidato_id INTEGER NOT NULL,
+    orientador_id INTEGER NOT NULL,
+    FOREIGN KEY (candidato_id) REFERENCES candidatos(id) ON DELETE CASCADE,
+    FOREIGN KEY (orientador_id) REFERENCES orientadores(id) ON DELETE CASCADE,
+    PRIMARY KEY (candidato_id, orientador_id)
+);
+CREATE TABLE avaliacoes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, orientador_id INTEGER NOT NULL, candidato_id INTEGER NOT NULL,
+    s2_1 INTEGER, s2_2 INTEGER, s3_1 INTEGER, s3_2 INTEGER, s4_1 INTEGER, s4_2 INTEGER,
+    FOREIGN KEY (orientador_id) REFERENCES orientadores(id) ON DELETE CASCADE,
+    FOREIGN KEY (candidato_id) REFERENCES candidatos(id) ON DELETE CASCADE,
+    UNIQUE(orientador_id, candidato_id)
+);
+CREATE TABLE configuracoes ( chave TEXT PRIMARY KEY, valor TEXT NOT NULL );
+"""
+CODIGOS = ('s2_1', 's2_2', 's3_1', 's3_2', 's4_1', 's4_2')
+ORIENTADORES = [
+    (1, 'Ana', 2, 'tok-ana', 1, 1, 1),
+    (2, 'Bruno', 1, 'tok-bruno', 1, 0, 0),
+    (3, 'Carla', 1, 'tok-carla', 0, 1, 1),
+    (4, 'Duarte', 0, 'tok-duarte', 0, 0, 1),
+]
+CANDIDATOS = [(1, 'Eva'), (2, 'Filipe'), (3, 'Gil'), (4, 'Helena'), (5, 'Inês')]
+PREFERENCIAS = [(1, 3), (1, 1), (2, 2), (3, 4), (3, 1), (3, 3), (5, 2)]
+CONFIGURACOES = [('peso_preparo', '0.6'), ('peso_afinidade', '0.4'), ('peso_preferencia_candidato', '0.25'),
+                 ('s2_1', '2.0'), ('s2_2', '1.0'), ('s3_1', '0.5'), ('s3_2', '1.0'), ('s4_1', '1.0'), ('s4_2', '1.5')]
+# Só as colunas das secções atribuídas ao orientador têm nota, como no formulário da versão original.
+AVALIACOES = [
+    (1, 1, 1, (2, 1, 0, -1, 2, 2)),
+    (2, 1, 2, (-2, 0, 1, 1, 0, -1)),
+    (3, 2, 1, (1, 2, None, None, None, None)),
+    (4, 2, 3, (0, -1, None, None, None, None)),
+    (5, 3, 1, (None, None, 2, 2, 1, 0)),
+    (6, 3, 4, (None, None, -1, 0, 2, 1)),
+    (7, 4, 3, (None, None, None, None, 1, -2)),
+]
+
+
+def criar_base_original(caminho):
+    db = sqlite3.connect(caminho)
+    db.executescript(ESQUEMA_ORIGINAL_SQL)
+    db.executemany("INSERT INTO orientadores VALUES (?, ?, ?, ?, ?, ?, ?)", ORIENTADORES)
+    db.executemany("INSERT INTO candidatos VALUES (?, ?)", CANDIDATOS)
+    db.executemany("INSERT INTO preferencias_candidatos VALUES (?, ?)", PREFERENCIAS)
+    db.executemany("INSERT INTO configuracoes VALUES (?, ?)", CONFIGURACOES)
+    db.executemany(f"INSERT INTO avaliacoes (id, orientador_id, candidato_id, {', '.join(CODIGOS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                   [(aid, oid, cid, *notas) for aid, oid, cid, notas in AVALIACOES])
+    db.commit()
+    db.close()
+
+
+# Os mesmos dados gravados diretamente no esquema atual, como a aplicação os grava hoje.
+def criar_base_atual():
+    init_db_logic()
+    db = get_db()
+    questoes = carregar_questionario(db).por_codigo
+    db.executemany("INSERT INTO orientadores VALUES (?, ?, ?, ?, ?, ?, ?)", ORIENTADORES)
+    db.executemany("INSERT INTO candidatos VALUES (?, ?)", CANDIDATOS)
+    db.executemany("INSERT INTO preferencias_candidatos (candidato_id, orientador_id, ordem) VALUES (?, ?, ?)", preferencias_numeradas())
+    db.executemany("UPDATE configuracoes SET valor = ? WHERE chave = ?", [(valor, chave) for chave, valor in CONFIGURACOES])
+    db.executemany("INSERT INTO avaliacoes (id, orientador_id, candidato_id) VALUES (?, ?, ?)", [(aid, oid, cid) for aid, oid, cid, _ in AVALIACOES])
+    db.executemany("INSERT INTO respostas (avaliacao_id, questao_id, nota) VALUES (?, ?, ?)",
+                   [(aid, questoes[codigo]['id'], nota) for aid, _, _, notas in AVALIACOES for codigo, nota in zip(CODIGOS, notas) if nota is not None])
+    reconstruir_indices(db)
+    db.commit()
+    return db
+
+
+# A migração 7 numera as preferências antigas pela ordem do id do orientador.
+def preferencias_numeradas():
+    return [(cid, oid, sum(1 for c, o in PREFERENCIAS if c == cid and o <= oid)) for cid, oid in PREFERENCIAS]
+
+
+def test_base_original_migrada_preserva_os_dados(base_vazia, tmp_path):
+    criar_base_original(app.config['DATABASE'])
+    db = conexao_processo()
+    with pytest.raises(EsquemaDesatualizado):
+        verificar_esquema(db)
+
+    atualizar_esquema(db)
+
+    assert db.execute("PRAGMA user_version").fetchone()[0] == VERSAO_ESQUEMA
+    assert verificar_esquema(db)
+    assert [tuple(row) for row in db.execute("SELECT * FROM orientadores ORDER BY id")] == ORIENTADORES
+    assert [tuple(row) for row in db.execute("SELECT * FROM candidatos ORDER BY id")] == CANDIDATOS
+    assert sorted(tuple(row) for row in db.execute("SELECT candidato_id, orientador_id, ordem FROM preferencias_candidatos")) == sorted(preferencias_numeradas())
+    configuracoes = {row['chave']: row['valor'] for row in db.execute("SELECT * FROM configuracoes")}
+    assert configuracoes.items() >= dict(CONFIGURACOES).items()
+    assert [row['name'] for row in db.execute("PRAGMA table_info(avaliacoes)")] == ['id', 'orientador_id', 'candidato_id']
+    assert [tuple(row) for row in db.execute("SELECT id, orientador_id, candidato_id FROM avaliacoes ORDER BY id")] == [(aid, oid, cid) for aid, oid, cid, _ in AVALIACOES]
+    respostas = {(row['avaliacao_id'], row['codigo']): row['nota'] for row in db.execute("SELECT r.avaliacao_id, q.codigo, r.nota FROM respostas r JOIN questoes q ON q.id = r.questao_id")}
+    assert respostas == {(aid, codigo): nota for aid, _, _, notas in AVALIACOES for codigo, nota in zip(CODIGOS, notas) if nota is not None}
+
+    # Os índices preenchidos pela migração e as pontuações coincidem com os da mesma base criada no esquema atual.
+    migrados = indices(db)
+    orientadores, _, configs, preferencias = carregar_dados_alocacao(db)
+    pontuacoes_migradas = list(calcular_pontuacoes_python(db, orientadores, configs, preferencias).linhas())
+    descartar_base_de_dados(app.config['DATABASE'])
+    app.config['DATABASE'] = str(tmp_path / 'atual.db')
+    atual = criar_base_atual()
+    orientadores, _, configs, preferencias = carregar_dados_alocacao(atual)
+    assert migrados == indices(atual)
+    assert pontuacoes_migradas == list(calcular_pontuacoes_python(atual, orientadores, configs, preferencias).linhas())
+    assert pontuacoes_migradas
+
+
+def test_migracao_ja_aplicada_nao_volta_a_correr(base_vazia):
+    criar_base_original(app.config['DATABASE'])
+    db = conexao_processo()
+    atualizar_esquema(db)
+    antes = indices(db), db.execute("SELECT COUNT(*) FROM respostas").fetchone()[0]
+    atualizar_esquema(db)
+    assert (indices(db), db.execute("SELECT COUNT(*) FROM respostas").fetchone()[0]) == antes
+    assert db.execute("PRAGMA user_version").fetchone()[0] == VERSAO_ESQUEMA
@@ -0,0 +1,74 @@
+import pytest
+
+from flask_app import (
+    MISTURAS_ATRIBUICOES, MOTORES_PONTUACAO, NOTAS_VALIDAS, app, carregar_dados_alocacao, carregar_questionario,
+    gerar_coorte, np, reconstruir_indices,
+)
+
+MOTORES = [nome for nome in MOTORES_PONTUACAO if nome != 'numpy' or np is not None]
+TABELAS_INDICES = {
+    'notas_curriculo_agregadas': "SELECT candidato_id, questao_id, soma, contagem FROM notas_curriculo_agregadas ORDER BY candidato_id, questao_id",
+    'indices_preparo': "SELECT candidato_id, ipc FROM indices_preparo ORDER BY candidato_id",
+    'indices_afinidade': "SELECT avaliacao_id, orientador_id, candidato_id, iaoc FROM indices_afinidade ORDER BY avaliacao_id",
+}
+
+
+def pontuacoes(db, motor):
+    orientadores, _, configs, preferencias = carregar_dados_alocacao(db)
+    return list(MOTORES_PONTUACAO[motor](db, orientadores, configs, preferencias).linhas())
+
+
+def indices(db):
+    return {tabela: [tuple(row) for row in db.execute(sql)] for tabela, sql in TABELAS_INDICES.items()}
+
+
+@pytest.mark.parametrize('mistura', list(MISTURAS_ATRIBUICOES))
+def test_motores_dao_as_mesmas_pontuacoes(db, mistura):
+    gerar_coorte(db, candidatos=80, orientadores=40, densidade=0.35, mistura=mistura, semente=3)
+    referencia = pontuacoes(db, 'python')
+    assert referencia
+    for motor in MOTORES:
+        assert pontuacoes(db, motor) == referencia, motor
+
+
+def test_motores_dao_as_mesmas_pontuacoes_com_pesos_alterados(coorte):
+    coorte.executemany("UPDATE configuracoes SET valor = ? WHERE chave = ?", [('0.7', 'peso_preparo'), ('0.3', 'peso_afinidade'), ('1.5', 's2_1'), ('0.25', 's4_2'), ('0', 's3_1')])
+    reconstruir_indices(coorte)
+    coorte.commit()
+    referencia = pontuacoes(coorte, 'python')
+    for motor in MOTORES:
+        assert pontuacoes(coorte, motor) == referencia, motor
+
+
+@pytest.mark.parametrize('escrita_em_grupo', [False, True], ids=['escrita-direta', 'escrita-em-grupo'])
+def test_indices_incrementais_iguais_a_reconstrucao(coorte, administrador, escrita_em_grupo):
+    app.config['ESCRITA_EM_GRUPO'] = escrita_em_grupo
+    portal = app.test_client(use_cookies=False)
+    questionario = carregar_questionario(coorte)
+    orientadores = coorte.execute("SELECT * FROM orientadores WHERE avalia_curriculo OR avalia_entrevista OR avalia_afinidade ORDER BY id").fetchall()
+    candidatos = [row['id'] for row in coorte.execute("SELECT id FROM candidatos ORDER BY id")]
+    notas = lambda orientador, i: {q['codigo']: str(NOTAS_VALIDAS[(i + j) % len(NOTAS_VALIDAS)]) for j, q in enumerate(questionario.do_orientador(orientador))}
+
+    # Avaliações novas e substituídas, uma a uma e em lote (JSON e grelha).
+    for i, orientador in enumerate(orientadores[:4]):
+        for candidato_id in candidatos[i:i + 3]:
+            resposta = portal.post(f"/avaliar/{orientador['token']}/{candidato_id}", data=notas(orientador, candidato_id + 1))
+            assert resposta.status_code == 302
+    orientador = orientadores[0]
+    resposta = portal.post(f"/avaliar/{orientador['token']}/lote", json={'avaliacoes': [{'candidato_id': cid, **notas(orientador, cid)} for cid in candidatos[:6]]})
+    assert resposta.status_code == 200
+    grelha = {f"{cid}-{codigo}": nota for cid in candidatos[6:9] for codigo, nota in notas(orientador, 2 * cid).items()}
+    assert portal.post(f"/avaliar/{orientador['token']}/lote", data=grelha).status_code == 302
+
+    # Mudança de atribuições de um orientador e remoção de um orientador e de um candidato com avaliações.
+    editado = orientadores[1]
+    dados = {'nome': editado['nome'], 'vagas': str(editado['vagas'])}
+    dados.update((atribuicao, '1') for atribuicao in ('avalia_curriculo', 'avalia_entrevista', 'avalia_afinidade') if not editado[atribuicao])
+    assert administrador.post(f"/orientadores/edit/{editado['id']}", data=dados).status_code == 302
+    assert administrador.post(f"/orientadores/delete/{orientadores[2]['id']}").status_code == 302
+    assert administrador.post(f"/candidatos/delete/{candidatos[1]}").status_code == 302
+
+    incrementais = indices(coorte)
+    reconstruir_indices(coorte)
+    coorte.commit()
+    assert incrementais == indices(coorte)